@@ -0,0 +1,92 @@
+"""Latency of real clients while a web scanner floods the server.
+
+    python -m benchmarks.bench_flood --files 100000 --modes threaded asyncio
+
+Runs the same scanner flood (well-known probe paths plus random names,
+none of them in the tree) alongside a client pulling real tools, once with
+admission control switched off and once with the defaults, and reports the
+real client's latency and how the flood was answered.
+"""
+import argparse
+import random
+import shutil
+import string
+import tempfile
+import threading
+
+from .loadgen import run_load
+from .report import environment, write_json
+from .run import start_server
+from .synthetic import QUERIES, generate_paths, write_tree
+
+# What a scanner asks every web server for
+SCANNER_PATHS = ["/wp-admin/setup-config.php", "/wp-login.php", "/xmlrpc.php", "/.env", "/.git/config",
+                 "/phpmyadmin/index.php", "/cgi-bin/luci", "/admin.php", "/config.php", "/vendor/phpunit/eval-stdin.php"]
+ADMISSION_OFF = ["--rate-limit", "0", "--max-concurrent-matches", "0", "--miss-cache-size", "0", "--no-probe-filter"]
+
+
+def scanner_targets(count, seed=1):
+    """Probe paths mixed with random directory-bruteforce names"""
+    rng = random.Random(seed)
+    targets = []
+    for i in range(count):
+        if i % 4 == 0:
+            targets.append(SCANNER_PATHS[i // 4 % len(SCANNER_PATHS)])
+        else:
+            targets.append("/" + "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 12))))
+    return targets
+
+
+def measure(port, targets, args):
+    """Real client results while the flood runs"""
+    flood = {}
+
+    def run_flood():
+        flood.update(run_load("127.0.0.1", port, scanner_targets(args.flood_requests), args.flood_concurrency,
+                              requests=args.flood_requests, keep_alive=True))
+
+    run_load("127.0.0.1", port, targets, 1, requests=len(targets))  # resolve (and cache) every real query once
+    thread = threading.Thread(target=run_flood)
+    thread.start()
+    client = run_load("127.0.0.1", port, targets, args.concurrency, requests=args.requests, keep_alive=True)
+    thread.join()
+    return client, flood
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20000, help="Tree size written to disk")
+    parser.add_argument("--modes", nargs="+", default=["threaded", "asyncio"], choices=["threaded", "asyncio"])
+    parser.add_argument("--concurrency", type=int, default=2, help="Real client threads")
+    parser.add_argument("--requests", type=int, default=500, help="Real client requests")
+    parser.add_argument("--flood-concurrency", type=int, default=16, help="Scanner threads")
+    parser.add_argument("--flood-requests", type=int, default=5000, help="Scanner requests")
+    parser.add_argument("-o", "--output", default=None, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    tree = tempfile.mkdtemp(prefix="fuzzy-bench-")
+    try:
+        write_tree(tree, generate_paths(args.files), file_size=64)
+        targets = ["/" + query for query in QUERIES]
+        print(f"{'mode':>9} {'admission':>10} {'client p50 ms':>14} {'client p99 ms':>14} {'client req/s':>13} "
+              f"{'flood req/s':>12}  flood statuses")
+        for mode in args.modes:
+            for label, extra in (("off", ADMISSION_OFF), ("on", [])):
+                proc, port = start_server(tree, mode, extra)
+                try:
+                    client, flood = measure(port, targets, args)
+                finally:
+                    proc.terminate()
+                    proc.wait()
+                results.append({"mode": mode, "admission": label, "files": args.files, "client": client, "flood": flood})
+                print(f"{mode:>9} {label:>10} {client['p50_ms']:>14.2f} {client['p99_ms']:>14.2f} "
+                      f"{client['requests_per_s']:>13.1f} {flood['requests_per_s']:>12.1f}  {flood['statuses']}")
+    finally:
+        shutil.rmtree(tree, ignore_errors=True)
+    if args.output:
+        write_json({"environment": environment(), "parameters": vars(args), "flood": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Requests/sec with a new connection per request vs. persistent connections.
+
+    python -m benchmarks.bench_keepalive --modes threaded asyncio --concurrency 1 8
+
+Serves a synthetic tree of small files (where connection setup dominates,
+as with a script pulling tools one by one) and fires the same GET load at
+it twice per mode and concurrency: once reconnecting for every request and
+once reusing each client thread's connection.
+"""
+import argparse
+import shutil
+import tempfile
+
+from .loadgen import run_load
+from .report import environment, write_json
+from .run import start_server
+from .synthetic import QUERIES, generate_paths, write_tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=500, help="Tree size written to disk")
+    parser.add_argument("--file-size", type=int, default=4096, help="Size of each generated file in bytes")
+    parser.add_argument("--modes", nargs="+", default=["threaded", "asyncio"], choices=["threaded", "asyncio"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per measurement")
+    parser.add_argument("-o", "--output", default=None, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    tree = tempfile.mkdtemp(prefix="fuzzy-bench-")
+    try:
+        write_tree(tree, generate_paths(args.files), file_size=args.file_size)
+        targets = ["/" + query for query in QUERIES]
+        print(f"{'mode':>9} {'c':>3} {'close req/s':>12} {'keep-alive req/s':>17} {'speedup':>8} {'connections':>12}")
+        for mode in args.modes:
+            proc, port = start_server(tree, mode)
+            try:
+                for concurrency in args.concurrency:
+                    pair = {}
+                    for keep_alive in (False, True):
+                        result = run_load("127.0.0.1", port, targets, concurrency,
+                                          requests=args.requests, keep_alive=keep_alive)
+                        result.update({"mode": mode, "files": args.files, "file_size": args.file_size})
+                        results.append(result)
+                        pair[keep_alive] = result
+                    closed, kept = pair[False], pair[True]
+                    speedup = kept["requests_per_s"] / closed["requests_per_s"] if closed["requests_per_s"] else 0.0
+                    print(f"{mode:>9} {concurrency:>3} {closed['requests_per_s']:>12.1f} "
+                          f"{kept['requests_per_s']:>17.1f} {speedup:>7.2f}x {kept['connections']:>12}")
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        shutil.rmtree(tree, ignore_errors=True)
+    if args.output:
+        write_json({"environment": environment(), "parameters": vars(args), "keepalive": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
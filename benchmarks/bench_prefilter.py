@@ -0,0 +1,50 @@
+"""Match latency with and without the trigram prefilter.
+
+    python -m benchmarks.bench_prefilter --sizes 10000 100000 1000000
+
+Builds in-memory indexes (nothing is written to disk), checks that both
+paths return identical rankings and prints per-query latency.
+"""
+import argparse
+import statistics
+import time
+
+from fuzzy_httpserver.index import FileIndex, set_shared_index
+from fuzzy_httpserver.matcher import smart_file_matcher
+
+from .synthetic import generate_paths, QUERIES
+
+
+def time_queries(root, repeat):
+    timings = []
+    results = {}
+    for query in QUERIES:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results[query] = smart_file_matcher(query, root)
+            timings.append(time.perf_counter() - start)
+    return timings, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'files':>9} {'mode':>10} {'median ms':>10} {'max ms':>10}")
+    for size in args.sizes:
+        paths = generate_paths(size)
+        outcomes = {}
+        for mode, prefilter in (('full-scan', False), ('prefilter', True)):
+            # Distinct fake roots so both indexes can be registered at once
+            root = f"/nonexistent/bench-{mode}-{size}"
+            set_shared_index(FileIndex.from_paths(root, paths, prefilter=prefilter))
+            timings, outcomes[mode] = time_queries(root, args.repeat)
+            print(f"{size:>9} {mode:>10} {statistics.median(timings) * 1000:>10.2f} {max(timings) * 1000:>10.2f}")
+        if outcomes['full-scan'] != outcomes['prefilter']:
+            raise SystemExit(f"ranking mismatch at {size} files")
+
+
+if __name__ == "__main__":
+    main()
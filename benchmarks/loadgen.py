@@ -0,0 +1,94 @@
+"""Threaded HTTP load generator (stdlib http.client only)."""
+import http.client
+import itertools
+import threading
+import time
+
+from .report import percentiles
+
+
+def run_load(host, port, targets, concurrency, requests=None, duration=None, method="GET", body=None,
+             keep_alive=False):
+    """Fire requests at targets from `concurrency` threads.
+
+    Stops after `requests` total requests or `duration` seconds, whichever
+    is given. Every request uses a fresh connection unless keep_alive is
+    set, in which case each thread reuses its connection for as long as
+    the server keeps it open.
+    """
+    if requests is None and duration is None:
+        raise ValueError("give requests or duration")
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    totals = {"bytes_received": 0, "bytes_sent": 0, "errors": 0, "connections": 0}
+
+    def worker():
+        local_latencies = []
+        local_statuses = {}
+        received = sent = errors = connections = 0
+        conn = None
+        while True:
+            n = next(counter)
+            if requests is not None and n >= requests:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            target = targets[n % len(targets)]
+            start = time.perf_counter()
+            try:
+                if conn is None or conn.sock is None:
+                    conn = http.client.HTTPConnection(host, port, timeout=60)
+                    conn.connect()
+                    connections += 1
+                conn.request(method, target, body=body)
+                response = conn.getresponse()
+                data = response.read()
+                if not keep_alive or response.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                if conn is not None:
+                    conn.close()
+                continue
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+            received += len(data)
+            sent += len(body) if body else 0
+        if conn is not None:
+            conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+            totals["bytes_received"] += received
+            totals["bytes_sent"] += sent
+            totals["errors"] += errors
+            totals["connections"] += connections
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    completed = len(latencies)
+    result = {
+        "method": method,
+        "concurrency": concurrency,
+        "keep_alive": keep_alive,
+        "requests": completed,
+        "connections": totals["connections"],
+        "errors": totals["errors"],
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 4),
+        "requests_per_s": round(completed / elapsed, 2) if elapsed else 0.0,
+        "mb_received_per_s": round(totals["bytes_received"] / elapsed / 1e6, 3) if elapsed else 0.0,
+        "mb_sent_per_s": round(totals["bytes_sent"] / elapsed / 1e6, 3) if elapsed else 0.0,
+    }
+    result.update(percentiles(latencies))
+    return result
@@ -0,0 +1,46 @@
+"""Result helpers shared by the benchmarks."""
+import json
+import platform
+import subprocess
+import sys
+import time
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Latency percentiles in milliseconds (nearest-rank) plus min/max/mean"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        rank = max(int(round(point / 100 * len(ordered))) - 1, 0)
+        result[f"p{point}_ms"] = round(ordered[rank] * 1000, 4)
+    result["min_ms"] = round(ordered[0] * 1000, 4)
+    result["max_ms"] = round(ordered[-1] * 1000, 4)
+    result["mean_ms"] = round(sum(ordered) / len(ordered) * 1000, 4)
+    return result
+
+
+def environment():
+    """Metadata recorded with every run so results can be compared later"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+    }
+
+
+def write_json(results, path):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if path in (None, "-"):
+        print(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+        print(f"[+] Results written to {path}")
@@ -0,0 +1,135 @@
+"""Benchmark suite: match latency and HTTP GET/POST throughput.
+
+    python -m benchmarks.run --files 1000 100000 --http-files 2000 \\
+        --concurrency 1 8 32 --output results.json
+
+Match latency is measured by calling the matcher directly on an in-memory
+index of a synthetic tree. HTTP throughput is measured against a real
+server process serving a synthetic tree written to a temp directory.
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from fuzzy_httpserver.index import FileIndex, set_shared_index
+from fuzzy_httpserver.matcher import match_request
+
+from .loadgen import run_load
+from .report import environment, percentiles, write_json
+from .synthetic import QUERIES, generate_paths, write_tree
+
+
+def bench_match(sizes, depth, fanout, repeat):
+    """Match-only latency percentiles per tree size (no HTTP, no cache)"""
+    results = []
+    for size in sizes:
+        paths = generate_paths(size, depth=depth, fanout=fanout)
+        root = f"/nonexistent/bench-match-{size}"
+        started = time.perf_counter()
+        set_shared_index(FileIndex.from_paths(root, paths))
+        build_s = time.perf_counter() - started
+
+        samples = []
+        for _ in range(repeat):
+            for query in QUERIES:
+                started = time.perf_counter()
+                match_request(query, root)
+                samples.append(time.perf_counter() - started)
+        result = {"files": size, "depth": depth, "fanout": fanout, "queries": len(samples),
+                  "index_build_s": round(build_s, 3)}
+        result.update(percentiles(samples))
+        results.append(result)
+        print(f"[match] {size:>8} files  p50 {result['p50_ms']:.2f} ms  p99 {result['p99_ms']:.2f} ms")
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(directory, mode, extra_args=()):
+    port = free_port()
+    cmd = [sys.executable, "-m", "fuzzy_httpserver.server", "-d", directory, "-p", str(port), "--mode", mode]
+    cmd.extend(extra_args)
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def bench_http(files, depth, fanout, file_size, modes, concurrency_levels, requests, post_size):
+    """GET and POST throughput against a server process per concurrency mode"""
+    results = []
+    tree = tempfile.mkdtemp(prefix="fuzzy-bench-")
+    try:
+        paths = generate_paths(files, depth=depth, fanout=fanout)
+        write_tree(tree, paths, file_size=file_size)
+        get_targets = ["/" + query for query in QUERIES]
+        post_body = os.urandom(post_size)
+        for mode in modes:
+            proc, port = start_server(tree, mode)
+            try:
+                for concurrency in concurrency_levels:
+                    for method, targets, body in (("GET", get_targets, None),
+                                                  ("POST", ["/bench-upload.bin"], post_body)):
+                        result = run_load("127.0.0.1", port, targets, concurrency,
+                                          requests=requests, method=method, body=body)
+                        result.update({"mode": mode, "files": files, "file_size": file_size})
+                        if body:
+                            result["post_size"] = post_size
+                        results.append(result)
+                        print(f"[http]  {mode:>8} {method:<4} c={concurrency:<3} "
+                              f"{result['requests_per_s']:>9.1f} req/s  p99 {result.get('p99_ms', 0):.2f} ms")
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        shutil.rmtree(tree, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fuzzy-httpserver benchmark suite")
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Tree sizes for the match-latency benchmark")
+    parser.add_argument("--depth", type=int, default=4, help="Directory depth of generated trees")
+    parser.add_argument("--fanout", type=int, default=8, help="Subdirectories per directory")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the query set per tree")
+    parser.add_argument("--http-files", type=int, default=2000, help="Tree size written to disk for HTTP runs")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="Size of each generated file in bytes")
+    parser.add_argument("--modes", nargs="+", default=["threaded"], choices=["single", "threaded", "asyncio"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per HTTP measurement")
+    parser.add_argument("--post-size", type=int, default=1024 * 1024, help="POST body size in bytes")
+    parser.add_argument("--skip-match", action="store_true")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("-o", "--output", default="-", help="JSON output file (default: stdout)")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "parameters": vars(args)}
+    if not args.skip_match:
+        results["match"] = bench_match(args.files, args.depth, args.fanout, args.repeat)
+    if not args.skip_http:
+        results["http"] = bench_http(args.http_files, args.depth, args.fanout, args.file_size, args.modes,
+                                     args.concurrency, args.requests, args.post_size)
+    write_json(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Synthetic served trees with realistic tool names for the benchmarks."""
+import os
+import random
+
+TOOLS = [
+    'mimikatz', 'winPEAS', 'linpeas', 'chisel', 'ligolo-agent', 'ligolo-proxy',
+    'SharpHound', 'Rubeus', 'Seatbelt', 'PowerView', 'PowerUp', 'nc', 'socat',
+    'plink', 'procdump', 'pspy', 'kerbrute', 'Certify', 'SharpUp', 'GodPotato',
+    'PrintSpoofer', 'JuicyPotato', 'RunasCs', 'lazagne', 'Invoke-Mimikatz',
+    'enum4linux', 'accesschk', 'sysinternals', 'nmap', 'responder',
+]
+ARCH = ['', '64', '32', '_x64', '_x86', '-amd64', '-win32', '-win64', '_arm64']
+OS_TAGS = ['', '-windows', '-linux', '_win', '_lin', '-darwin']
+EXTS = ['.exe', '.ps1', '.sh', '.py', '.dll', '', '.zip', '.txt', '.elf', '.bin']
+SYLLABLES = ['ka', 'lo', 'ri', 'zen', 'tor', 'mex', 'qua', 'dri', 'vol', 'sy', 'nu', 'bek',
+             'fa', 'gro', 'hil', 'jy', 'pet', 'wum', 'xo', 'cri', 'ble', 'dar', 'un', 'os']
+FILLER_EXTS = ['.txt', '.md', '.json', '.conf', '.log', '.dat', '.py', '.c', '.h', '.so', '.png']
+DIRS = ['tools', 'windows', 'linux', 'x64', 'x86', 'Win32', 'privesc', 'ad',
+        'pivot', 'loot', 'scripts', 'bin', 'release', 'old', 'misc']
+
+
+def filler_name(rng):
+    words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 2))]
+    return rng.choice(['_', '-', '']).join(words) + rng.choice(FILLER_EXTS)
+
+
+def tool_name(rng, serial):
+    name = rng.choice(TOOLS) + rng.choice(OS_TAGS) + rng.choice(ARCH)
+    if rng.random() < 0.3:
+        name += f"_v{serial}"
+    return name + rng.choice(EXTS)
+
+
+def generate_paths(count, depth=4, fanout=8, seed=1, tool_ratio=0.05):
+    """Return `count` unique '/' separated file paths.
+
+    Directories are drawn from a fixed-shape tree (`fanout` children per
+    level, up to `depth` levels) and file names from tool names with
+    arch/os suffixes, so the matcher sees the same kind of near-duplicates
+    a real tool share has. Only `tool_ratio` of the files are tools, the
+    rest are unrelated filler names (docs, sources, configs).
+    """
+    rng = random.Random(seed)
+    dirs = ['']
+    level = ['']
+    for d in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                name = f"{rng.choice(DIRS)}{i}" if rng.random() < 0.5 else f"{rng.choice(TOOLS).lower()}_{d}{i}"
+                path = f"{parent}/{name}" if parent else name
+                next_level.append(path)
+        dirs.extend(next_level)
+        level = next_level
+        if len(dirs) > count:
+            break
+
+    paths = set()
+    serial = 0
+    while len(paths) < count:
+        serial += 1
+        name = tool_name(rng, serial) if rng.random() < tool_ratio else filler_name(rng)
+        parent = rng.choice(dirs)
+        paths.add(f"{parent}/{name}" if parent else name)
+    return sorted(paths)
+
+
+QUERIES = [
+    'mimi', 'mimikatz', 'winpeas', 'linpeas.sh', 'chisel', 'ligolo-win',
+    'sharphound', 'rubeus', 'powerview', 'nc', 'pspy64', 'kerbrute',
+    'godpotato', 'printspoofer', 'lazagne.exe', 'nothing-matches-this',
+]
+
+
+def write_tree(root, paths, file_size=1024, seed=1):
+    """Materialize generated paths under root, each file `file_size` bytes"""
+    rng = random.Random(seed)
+    payload = bytes(rng.getrandbits(8) for _ in range(min(file_size, 64 * 1024)))
+    for rel_path in paths:
+        full_path = os.path.join(root, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            remaining = file_size
+            while remaining > 0:
+                f.write(payload[:remaining])
+                remaining -= len(payload)
@@ -0,0 +1,323 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from .metrics import REGISTRY, Counter
+
+# Request logging that stays off the request path: handlers only build a
+# small dict and put it on a queue; one background thread formats the
+# records and writes them out in batches.
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 256
+
+LOG_DROPPED = REGISTRY.register(Counter(
+    "fuzzy_log_records_dropped_total", "Log records dropped because the log queue was full"))
+
+
+def filters_text(filters):
+    if filters:
+        return f" with filters '{'/'.join(filters)}'"
+    return ""
+
+
+def log_date(timestamp):
+    return time.strftime("%d/%b/%Y %H:%M:%S", time.localtime(timestamp))
+
+
+class ConsoleFormatter:
+    """The classic colored terminal output; returns (stream, text)"""
+
+    def __init__(self, color=True):
+        self.color = color
+
+    def paint(self, code, text):
+        if self.color:
+            return f"\033[{code}m{text}\033[0m"
+        return text
+
+    def format(self, record):
+        kind = record['type']
+        if kind == 'access':
+            return 'stderr', '%s - - [%s] "%s" %s %s\n' % (
+                record['client'], log_date(record['time']), record['request'], record['status'], record['size'])
+        if kind == 'server':
+            return 'stderr', "%s - - [%s] %s\n" % (record['client'], log_date(record['time']), record['text'])
+        if kind == 'match':
+            return 'stdout', self.format_match(record)
+        if kind == 'slow':
+            return 'stdout', self.format_slow(record)
+        text = record['text']
+        if record.get('color'):
+            text = self.paint(record['color'], text)
+        return 'stdout', text + "\n"
+
+    def format_match(self, record):
+        match = record['kind']
+        name = record['filename']
+        suffix = filters_text(record['filters'])
+        if match == 'choices':
+            lines = [self.paint(93, f"[?] Multiple files found matching '{name}'{suffix}:")]
+            for i, (rel_path, score) in enumerate(record['choices'], 1):
+                lines.append(self.paint(94, f"  {i}. /{rel_path} (score: {score:.2f})"))
+            lines.append("")  # Empty line for spacing
+        elif match == 'smart':
+            lines = [self.paint(94, f"[+] Smart matched '{name}'{suffix} -> '{record['path']}' (score: {record['score']:.2f})")]
+        elif match == 'filtered_out':
+            lines = [self.paint(91, f"[!] No files found matching '{name}'{suffix}.")]
+        elif match == 'exact_file':
+            lines = [self.paint(94, f"[+] Exactly matched the file '{name}' -> '{record['path']}'")]
+        elif match == 'exact_dir':
+            lines = [self.paint(94, f"[+] Exactly matched the directory '{name}' -> '{record['path']}'")]
+        elif match == 'probe':
+            lines = [self.paint(90, f"[-] Ignored scanner probe '{name}'{suffix}")]
+        elif match == 'fuzzy':
+            type_str = "file" if record['is_file'] else "directory"
+            lines = [self.paint(92, f"[+] Fuzzy matched '{name}' -> '{record['path']}' ({type_str}, score: {record['score']:.2f})")]
+        else:
+            lines = [self.paint(91, f"[!] No exact or fuzzy match for '{name}'.")]
+            if 'files' in record:
+                suppressed = record.get('suppressed')
+                note = f" ({suppressed} earlier misses not listed)" if suppressed else ""
+                lines.append(self.paint(95, f"[>] Available entries in /:{note}") + "\n")
+                # Show files first, then directories
+                lines.extend(self.paint(93, f"/{f} (F)") for f in sorted(record['files']))
+                lines.extend(self.paint(94, f"/{f} (D)") for f in sorted(record['dirs']))
+                lines.append("\n")  # for giving some gap in output
+        return "\n".join(lines) + "\n"
+
+    def format_slow(self, record):
+        stages = ", ".join(f"{name} {ms:.1f} ms" for name, ms in record['stages'].items())
+        counts = ", ".join(f"{name} {value}" for name, value in record['counts'].items())
+        text = f"[slow] {record['duration_ms']:.1f} ms \"{record['request']}\" {record['status']}: {stages}"
+        if counts:
+            text += f"; {counts}"
+        return self.paint(93, text) + "\n"
+
+
+class JSONFormatter:
+    """One JSON object per line"""
+
+    def format(self, record):
+        record = dict(record)
+        for key in ('files', 'dirs'):
+            if key in record:
+                record[key] = sorted(record[key])
+        return 'stdout', json.dumps(record, separators=(',', ':')) + "\n"
+
+
+class StreamSink:
+    """Writes to stdout/stderr as chosen by the formatter"""
+
+    def write(self, stream, text):
+        target = sys.stderr if stream == 'stderr' else sys.stdout
+        target.write(text)
+
+    def flush(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    def close(self):
+        self.flush()
+
+
+class FileSink:
+    """Appends to a file, rotating it to path.1 .. path.N past max_bytes"""
+
+    def __init__(self, path, max_bytes=None, backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.f = open(path, 'a', encoding='utf-8')
+        self.size = self.f.tell()
+
+    def write(self, stream, text):
+        self.follow()
+        if self.max_bytes and self.size and self.size + len(text) > self.max_bytes:
+            self.rotate()
+        self.f.write(text)
+        self.size += len(text)
+
+    def follow(self):
+        """Reopen the path if the file was rotated away by another process
+        (prefork workers share one log) or by logrotate"""
+        self.f.flush()
+        st = os.fstat(self.f.fileno())
+        try:
+            if os.stat(self.path).st_ino == st.st_ino:
+                self.size = st.st_size  # includes what other writers appended
+                return
+        except FileNotFoundError:
+            pass
+        self.f.close()
+        self.f = open(self.path, 'a', encoding='utf-8')
+        self.size = self.f.tell()
+
+    def rotate(self):
+        self.f.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self.f = open(self.path, 'w', encoding='utf-8')
+        self.size = 0
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class AccessLog:
+    """Queue of log records drained by a background writer thread.
+
+    Records are plain dicts; formatting, sorting of directory listings and
+    all I/O happen on the writer thread. When the queue is full records are
+    dropped (and counted) rather than blocking a request.
+    """
+
+    def __init__(self, formatter=None, sink=None, listing_interval=0.0):
+        self.formatter = formatter or ConsoleFormatter()
+        self.sink = sink or StreamSink()
+        # Minimum seconds between two full "available entries" dumps
+        self.listing_interval = listing_interval
+        self._last_listing = None
+        self._suppressed = 0
+        self._listing_lock = threading.Lock()
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _after_fork(self):
+        # The writer thread does not survive fork(); start over in the child
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._listing_lock = threading.Lock()
+
+    def configure(self, formatter=None, sink=None, listing_interval=None):
+        self.close()
+        if formatter is not None:
+            self.formatter = formatter
+        if sink is not None:
+            self.sink = sink
+        if listing_interval is not None:
+            self.listing_interval = listing_interval
+
+    def emit(self, record):
+        record['time'] = time.time()
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="fuzzy-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        get = self._queue.get
+        while True:
+            batch = [get()]
+            # Take whatever else is already waiting, up to one batch
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in batch
+            self._write([record for record in batch if record is not None])
+            if stop:
+                return
+
+    def _write(self, records):
+        chunks = {}
+        for record in records:
+            try:
+                stream, text = self.formatter.format(record)
+            except Exception as e:  # never let one bad record kill the writer
+                stream, text = 'stderr', f"[!] Could not format log record {record!r}: {e}\n"
+            chunks.setdefault(stream, []).append(text)
+        try:
+            for stream, texts in chunks.items():
+                self.sink.write(stream, "".join(texts))
+            self.sink.flush()
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"[!] Log write failed: {e}\n")
+
+    def close(self):
+        """Flush everything queued so far and stop the writer"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+                thread.join()
+        self.sink.flush()
+
+    def message(self, text, color=None, level='info'):
+        self.emit({'type': 'message', 'level': level, 'text': text, 'color': color})
+
+    def server(self, client, text):
+        """Messages from the stdlib handler (errors, etc.)"""
+        self.emit({'type': 'server', 'client': client, 'text': text})
+
+    def access(self, client, request, method, status, size='-', duration=None):
+        record = {'type': 'access', 'client': client, 'request': request, 'method': method,
+                  'status': status, 'size': size}
+        if duration is not None:
+            record['duration_ms'] = round(duration * 1000, 3)
+        self.emit(record)
+
+    def slow(self, request, status, duration, trace):
+        """A request over the slow threshold: its time per stage (the rest,
+        parsing and overhead, as 'other') and candidate counts"""
+        stages = {name: round(seconds * 1000, 3) for name, seconds in trace.stages.items()}
+        stages['other'] = round(max(duration - sum(trace.stages.values()), 0.0) * 1000, 3)
+        self.emit({'type': 'slow', 'request': request, 'status': status, 'duration_ms': round(duration * 1000, 3),
+                   'stages': stages, 'counts': dict(trace.counts)})
+
+    def match(self, result):
+        record = {'type': 'match', 'kind': result.kind, 'filename': result.filename,
+                  'filters': list(result.filter_chain)}
+        if result.path is not None:
+            record['path'] = result.path
+            record['is_file'] = result.is_file
+        if result.score is not None:
+            record['score'] = result.score
+        if result.choices:
+            record['choices'] = [(rel_path, score) for rel_path, score, file_name in result.choices]
+        if result.kind == 'not_found' and result.listing is not None:
+            self._add_listing(record, result.listing)
+        self.emit(record)
+
+    def _add_listing(self, record, listing):
+        # Scanners produce bursts of misses; list the root at most once per interval
+        now = time.monotonic()
+        with self._listing_lock:
+            if (self.listing_interval and self._last_listing is not None
+                    and now - self._last_listing < self.listing_interval):
+                self._suppressed += 1
+                return
+            self._last_listing = now
+            suppressed, self._suppressed = self._suppressed, 0
+        record['files'], record['dirs'] = listing
+        if suppressed:
+            record['suppressed'] = suppressed
+
+
+# Process-wide log (configured from the command line)
+LOG = AccessLog()
+atexit.register(LOG.close)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=LOG._after_fork)
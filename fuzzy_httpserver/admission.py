@@ -0,0 +1,181 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import REGISTRY, Counter
+
+# Admission control: a web scanner firing hundreds of junk paths per second
+# must not starve real clients of match CPU. Requests a resolved-match cache
+# can answer are always admitted; everything that needs matching work takes
+# a slot under a global concurrency cap, and a token from its client's bucket
+# when a per-client rate limit is set. Well-known scanner probes are answered
+# with a 404 before any of that.
+
+# Uncached match requests per second per client IP: off unless asked for, as
+# every client behind one pivot or NAT shares an address (burst: twice this)
+RATE_LIMIT = 0.0
+# Requests computing a match at the same time (CPU-bound, so more only thrash)
+MAX_CONCURRENT_MATCHES = 8
+# How long a request waits for a match slot before it gets a 503
+QUEUE_TIMEOUT = 1.0
+# Client buckets remembered; the least recently seen are forgotten first
+MAX_CLIENTS = 65536
+
+# Path segments and extensions scanners ask every server for
+PROBE_NAMES = frozenset({
+    'wp-admin', 'wp-content', 'wp-includes', 'wp-json', 'wordpress', 'phpmyadmin', 'pma', 'cgi-bin',
+    'actuator', 'boaform', 'hnap1', '.env', '.git', '.svn', '.hg', '.htaccess', '.htpasswd',
+    '.ds_store', '.aws', '.ssh', '.vscode', '.idea',
+})
+PROBE_EXTENSIONS = ('.php', '.php5', '.phtml', '.asp', '.aspx', '.jsp', '.jspa', '.do', '.action', '.cgi')
+
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "fuzzy_admission_rejected_total", "Requests answered without matching", ("reason",)))
+
+
+class Rejected(Exception):
+    """A request turned away before matching: 429 (client over its rate) or
+    503 (every match slot busy), with the seconds to wait before retrying"""
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket per client: rate tokens per second, up to burst"""
+
+    def __init__(self, rate, burst=None, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst or max(1, math.ceil(rate * 2))
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> [tokens, monotonic time of the last refill]
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """0.0 when client may go ahead (a token is used), else the seconds
+        until its next token"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [float(self.burst), now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(client)
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return 0.0
+            return (1.0 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ProbeFilter:
+    """Recognizes scanner probes (/wp-admin/..., /xmlrpc.php) that cannot be
+    meant for the served tree: a probe name or extension only counts while
+    no indexed path contains it, so a tree that really holds PHP files
+    still has them matched"""
+
+    def __init__(self):
+        self._generation = None
+        self._in_tree = {}  # probe token -> whether some indexed path has it
+        self._lock = threading.Lock()
+
+    def probe_token(self, requested):
+        """The probe name or extension in a request path, or None"""
+        for segment in requested.split('?', 1)[0].lower().split('/'):
+            if segment in PROBE_NAMES:
+                return segment
+            if segment.endswith(PROBE_EXTENSIONS):
+                return '.' + segment.rsplit('.', 1)[1]
+        return None
+
+    def is_probe(self, requested, index):
+        token = self.probe_token(requested)
+        if token is None:
+            return False
+        with self._lock:
+            if self._generation != index.generation:
+                self._generation = index.generation
+                self._in_tree = {}
+            in_tree = self._in_tree.get(token)
+        if in_tree is None:
+            # One pass over the files per token and tree generation
+            if token in PROBE_NAMES:
+                in_tree = any(token in entry.rel_path.lower().split('/') for entry in index.files())
+            else:
+                in_tree = any(entry.name.lower().endswith(token) for entry in index.files())
+            with self._lock:
+                self._in_tree[token] = in_tree
+        return not in_tree
+
+
+class AdmissionControl:
+    """Decides which requests get to run the matcher (configured from the
+    command line; every limit can be switched off)"""
+
+    def __init__(self):
+        self.limiter = RateLimiter(RATE_LIMIT) if RATE_LIMIT > 0 else None
+        self.probes = ProbeFilter()
+        self.probe_filter = True
+        self.queue_timeout = QUEUE_TIMEOUT
+        self.max_concurrent = MAX_CONCURRENT_MATCHES
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+
+    def configure(self, rate=None, burst=None, max_concurrent=None, probe_filter=None):
+        """rate 0 disables the per-client limit, max_concurrent 0 the cap"""
+        if rate is not None:
+            self.limiter = RateLimiter(rate, burst) if rate > 0 else None
+        elif burst is not None and self.limiter is not None:
+            self.limiter.burst = burst
+        if max_concurrent is not None:
+            self.max_concurrent = max_concurrent
+            self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        if probe_filter is not None:
+            self.probe_filter = probe_filter
+
+    def is_probe(self, requested, index):
+        if self.probe_filter and self.probes.is_probe(requested, index):
+            ADMISSION_REJECTED.inc('probe')
+            return True
+        return False
+
+    def check_rate(self, client):
+        """Raise Rejected (429) when client has used up its tokens"""
+        if client is None or self.limiter is None:
+            return
+        wait = self.limiter.take(client)
+        if wait:
+            ADMISSION_REJECTED.inc('rate')
+            raise Rejected(429, "[!] Too many requests, slow down.\n", math.ceil(wait))
+
+    def acquire(self):
+        """Take a match slot, raising Rejected (503) after queue_timeout;
+        every successful acquire() must be followed by release()"""
+        slots = self._slots
+        if slots is not None and not slots.acquire(timeout=self.queue_timeout):
+            ADMISSION_REJECTED.inc('busy')
+            raise Rejected(503, "[!] Server busy, try again.\n", 1)
+        return slots
+
+    def stats(self):
+        return {
+            "rate_limit": self.limiter.rate if self.limiter is not None else 0,
+            "burst": self.limiter.burst if self.limiter is not None else 0,
+            "clients": len(self.limiter) if self.limiter is not None else 0,
+            "max_concurrent_matches": self.max_concurrent,
+            "probe_filter": self.probe_filter,
+            "rejected": {reason: ADMISSION_REJECTED.get(reason) for reason in ('rate', 'busy', 'probe')},
+        }
+
+
+# Process-wide admission control (configured from the command line)
+admission = AdmissionControl()
@@ -0,0 +1,540 @@
+import asyncio
+import contextvars
+import email.utils
+import http.client
+import http.server
+import io
+import mimetypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from .accesslog import LOG
+from .admission import Rejected
+from .batch import MAX_MANIFEST_SIZE, BatchError, ManifestSink, plan_batch
+from .index import get_shared_index
+from .matcher import resolve_request
+from .metrics import (ACTIVE_CONNECTIONS, BYTES_RECEIVED, BYTES_SENT, REQUEST_SECONDS, REQUESTS, end_trace, stage,
+                      start_trace)
+from .profiling import PROFILER, profile_response
+from .cache import CachedFile
+from .compress import iter_compressed
+from .responses import (BATCH_PATH, KEEPALIVE_TIMEOUT, MAX_KEEPALIVE_REQUESTS, METRICS_PATH, PROFILE_PATH, STATS_PATH,
+                        choices_response, connection_header, file_response, metrics_response, not_found_response,
+                        rejected_response, requested_path, stats_response, text_response)
+from .transfer import LAST_CHUNK, chunk, is_chunked
+from .upload import UploadSink, UploadTooLarge, UploadWriteError, parse_chunk_size, post_save_path
+
+CHUNK_SIZE = 64 * 1024
+# Bytes per loop.sendfile() call: each gets the connection timeout, so a stalled
+# client is dropped while a slow one downloading a large file is not
+SENDFILE_CHUNK = 4 * 1024 * 1024
+MAX_HEADER_SIZE = 64 * 1024
+
+
+class _Exchange:
+    """The stream writer of a connection plus what the request being
+    answered on it allows: chunked bodies, keeping the connection open;
+    client is the peer address admission control charges"""
+
+    def __init__(self, writer, version, keep_alive, client=None):
+        self.writer = writer
+        self.version = version
+        self.keep_alive = keep_alive
+        self.client = client
+
+    @property
+    def chunked(self):
+        return self.version >= 'HTTP/1.1'
+
+
+class _DirectoryRenderer(http.server.SimpleHTTPRequestHandler):
+    """Runs the stdlib directory handling (redirect, index.html, listing)
+    against an in-memory buffer so asyncio mode answers exactly like the
+    threaded handler"""
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, path, command, version, keep_alive):
+        self.path = path
+        self.command = command
+        self.directory = os.getcwd()
+        self.request_version = version
+        self.requestline = f"{command} {path} {version}"
+        self.client_address = ('', 0)
+        self.headers = {}
+        self.wfile = io.BytesIO()
+        self.close_connection = not keep_alive
+        self.connection_sent = False
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            self.connection_sent = True  # send_error() closes the connection
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if not self.connection_sent:
+            value = connection_header(self.request_version, not self.close_connection)
+            if value:
+                self.send_header('Connection', value)
+        super().end_headers()
+
+    def render(self):
+        f = self.send_head()
+        data = self.wfile.getvalue()
+        if f:
+            try:
+                if self.command != 'HEAD':
+                    data += f.read()
+            finally:
+                f.close()
+        return data
+
+
+class AsyncFuzzyServer:
+    """asyncio-based server: connections are multiplexed on one event loop,
+    match resolution runs on a small executor and file bodies are streamed
+    without blocking the loop"""
+
+    def __init__(self, server_address, workers=32, backlog=128, timeout=60.0,
+                 max_upload_size=None, upload_sha256=False, sock=None,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, max_keepalive_requests=MAX_KEEPALIVE_REQUESTS):
+        self.server_address = server_address
+        self.sock = sock  # listening socket to adopt instead of binding (prefork)
+        self.workers = workers
+        self.backlog = backlog
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.max_keepalive_requests = max_keepalive_requests
+        self.max_upload_size = max_upload_size
+        self.upload_sha256 = upload_sha256
+        self.loop = None
+        self.server = None
+        self.executor = None
+        self.shutdown_requested = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        if self.sock is not None:
+            start = asyncio.start_server(self.handle_connection, sock=self.sock, limit=MAX_HEADER_SIZE)
+        else:
+            host, port = self.server_address
+            start = asyncio.start_server(self.handle_connection, host or None, port,
+                                         backlog=self.backlog, reuse_address=True, limit=MAX_HEADER_SIZE)
+        self.server = self.loop.run_until_complete(start)
+        if not self.shutdown_requested:
+            self.loop.run_forever()
+
+    def shutdown(self):
+        """Make serve_forever() return; safe to call from any thread"""
+        self.shutdown_requested = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def server_close(self):
+        if self.server is not None:
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.server = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        if self.loop is not None:
+            self.loop.close()
+
+    def run_blocking(self, func, *args):
+        """Run func(*args) on the executor in the request's context, so its
+        stages reach the request's trace"""
+        return self.loop.run_in_executor(self.executor, contextvars.copy_context().run, func, *args)
+
+    async def with_timeout(self, awaitable):
+        return await asyncio.wait_for(awaitable, self.timeout)
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('-', 0)
+        ACTIVE_CONNECTIONS.inc()
+        try:
+            handled = 0
+            idle_timeout = self.timeout
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    return
+                handled += 1
+                if not await self.handle_request(reader, writer, head, peer, handled):
+                    return
+                idle_timeout = self.keepalive_timeout
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            ACTIVE_CONNECTIONS.dec()
+            writer.close()
+
+    async def handle_request(self, reader, writer, head, peer, handled):
+        """Answer one request; True when the connection stays open for the next"""
+        started = time.perf_counter()
+        request_line, _, header_block = head.partition(b'\r\n')
+        request_line = request_line.decode('iso-8859-1').rstrip()
+        words = request_line.split()
+        if len(words) != 3 or not words[2].startswith('HTTP/1.'):
+            await self.send_simple(_Exchange(writer, 'HTTP/1.0', False), 400, "Bad request syntax")
+            REQUESTS.inc('-', 400)
+            return False
+        command, target, version = words
+        headers = http.client.parse_headers(io.BytesIO(header_block))
+        connection = headers.get('Connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version < 'HTTP/1.1' else connection != 'close'
+        exchange = _Exchange(writer, version, keep_alive and handled < self.max_keepalive_requests, peer[0])
+
+        trace = token = None
+        if PROFILER.slow_threshold is not None:
+            trace, token = start_trace()
+        try:
+            status = await self.dispatch(reader, exchange, command, target, headers)
+        finally:
+            if token is not None:
+                end_trace(token)
+        elapsed = time.perf_counter() - started
+        REQUESTS.inc(command, status)
+        REQUEST_SECONDS.observe(elapsed, command)
+        LOG.access(peer[0], request_line, command, status, '-', elapsed)
+        if trace is not None and elapsed >= PROFILER.slow_threshold:
+            LOG.slow(request_line, status, elapsed, trace)
+        return exchange.keep_alive
+
+    async def dispatch(self, reader, exchange, command, target, headers):
+        if command in ('GET', 'HEAD'):
+            return await self.do_GET(exchange, command, target, headers)
+        if command == 'POST':
+            return await self.do_POST(reader, exchange, target, headers)
+        return await self.send_simple(exchange, 501, f"Unsupported method ({command!r})")
+
+    async def do_GET(self, exchange, command, target, headers):
+        if target == STATS_PATH:
+            return await self.send_prepared(exchange, command, *stats_response(os.getcwd()))
+        if target == METRICS_PATH:
+            return await self.send_prepared(exchange, command, *metrics_response(os.getcwd()))
+        url = urlsplit(target)
+        if url.path == BATCH_PATH:
+            return await self.send_batch(exchange, command, url.query)
+        if url.path == PROFILE_PATH:
+            return await self.send_prepared(exchange, command, *profile_response(url.query))
+
+        with stage('parse'):
+            requested = requested_path(target)
+        try:
+            # The part of a request worth profiling: the rest is the event loop's
+            result = await self.run_blocking(PROFILER.call, resolve_request, requested, os.getcwd(), exchange.client)
+        except Rejected as e:
+            return await self.send_prepared(exchange, command, *rejected_response(e))
+
+        status = None
+        if result.kind == 'choices':
+            status = await self.send_prepared(exchange, command, *choices_response(result))
+        elif result.kind in ('filtered_out', 'not_found', 'probe'):
+            status = await self.send_prepared(exchange, command, *not_found_response(result))
+        LOG.match(result)
+
+        if result.path is None:
+            return status
+        full_path = get_shared_index(os.getcwd()).abs_path(result.path.lstrip('/'))
+        with stage('send'):
+            if result.is_file:
+                status = await self.send_file(exchange, command, full_path, headers)
+                if status is not None:
+                    return status
+            # Directories (and anything unusual) go through the stdlib logic
+            renderer = _DirectoryRenderer(result.path, command, exchange.version, exchange.keep_alive)
+            data = await self.run_blocking(renderer.render)
+            exchange.keep_alive = not renderer.close_connection
+            exchange.writer.write(data)
+            await self.with_timeout(exchange.writer.drain())
+        BYTES_SENT.inc(amount=len(data) - data.index(b'\r\n\r\n') - 4)
+        return int(data.split(b' ', 2)[1])
+
+    async def send_file(self, exchange, command, full_path, request_headers):
+        """Status sent, or None (nothing sent) when full_path is not a regular file"""
+        ctype = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        # May read the file into memory or compress it first, so off the loop
+        response = await self.run_blocking(
+            file_response, full_path, ctype, request_headers, command, exchange.chunked)
+        if response is None:
+            return None
+        if isinstance(response.body, CachedFile):
+            return await self.send_plan(exchange, command, response.plan, response.body, response.encoding)
+        with response.body:
+            if response.encoding and not exchange.chunked:
+                exchange.keep_alive = False  # the end of the body is marked by closing
+            return await self.send_plan(exchange, command, response.plan, response.body, response.encoding)
+
+    async def send_plan(self, exchange, command, plan, body, encoding=None):
+        writer = exchange.writer
+        writer.write(self.header_block(exchange, plan.status, plan.headers))
+        await self.with_timeout(writer.drain())
+        if command == 'HEAD':
+            return plan.status
+        chunked = is_chunked(plan)
+        sent = 0
+        for preamble, offset, count in plan.parts:
+            if preamble:
+                writer.write(preamble)
+                sent += len(preamble)
+            if encoding:
+                sent += await self.send_compressed(writer, body, encoding, offset, count, chunked)
+            elif isinstance(body, CachedFile):
+                writer.write(body.data[offset:offset + count])
+                await self.with_timeout(writer.drain())
+                sent += count
+            else:
+                done = await self.send_file_range(writer, body, offset, count)
+                sent += done
+                if done < count:
+                    exchange.keep_alive = False  # truncated meanwhile: the body is short
+                    break
+        if plan.trailer:
+            writer.write(plan.trailer)
+            sent += len(plan.trailer)
+        if chunked:
+            writer.write(LAST_CHUNK)
+        if plan.trailer or chunked:
+            await self.with_timeout(writer.drain())
+        BYTES_SENT.inc(amount=sent)
+        return plan.status
+
+    async def send_compressed(self, writer, f, encoding, offset, count, chunked=False):
+        chunks = iter_compressed(f, encoding, offset, count)
+        sent = 0
+        while True:
+            data = await self.loop.run_in_executor(self.executor, next, chunks, None)
+            if data is None:
+                return sent
+            writer.write(chunk(data) if chunked else data)
+            sent += len(data)
+            await self.with_timeout(writer.drain())
+
+    async def send_file_range(self, writer, f, offset, count):
+        """Bytes of f sent, fewer than count when the file was truncated meanwhile"""
+        if count <= 0:
+            return 0
+        if hasattr(self.loop, 'sendfile'):
+            # Zero-copy where the transport supports it (Python 3.7+)
+            await self.with_timeout(writer.drain())
+            sent = 0
+            while sent < count:
+                size = min(SENDFILE_CHUNK, count - sent)
+                done = await self.with_timeout(self.loop.sendfile(writer.transport, f, offset + sent, size))
+                sent += done
+                if done < size:
+                    break
+            return sent
+        f.seek(offset)
+        sent = 0
+        while sent < count:
+            data = await self.loop.run_in_executor(self.executor, f.read, min(CHUNK_SIZE, count - sent))
+            if not data:
+                break
+            writer.write(data)
+            sent += len(data)
+            await self.with_timeout(writer.drain())
+        return sent
+
+    async def send_batch(self, exchange, command, query_string, manifest=None):
+        """Stream the archive of a batch request (GET ?q=... or POSTed manifest)"""
+        try:
+            # Resolves every query, so off the loop
+            batch = await self.run_blocking(plan_batch, query_string, os.getcwd(), manifest, exchange.client)
+        except BatchError as e:
+            return await self.send_prepared(exchange, command, *text_response(e.status, e.message))
+        except Rejected as e:
+            return await self.send_prepared(exchange, command, *rejected_response(e))
+        LOG.message(f"[+] Batch: {len(batch.members)} files" +
+                    (f", not found: {', '.join(batch.missing)}" if batch.missing else ""))
+        headers = list(batch.headers)
+        if exchange.chunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        elif command != 'HEAD':
+            exchange.keep_alive = False  # the end of the archive is marked by closing
+        writer = exchange.writer
+        with stage('send'):
+            writer.write(self.header_block(exchange, 200, headers))
+            await self.with_timeout(writer.drain())
+            if command == 'HEAD':
+                return 200
+            sent = 0
+            while True:
+                data = await self.loop.run_in_executor(self.executor, next, batch.chunks, None)
+                if data is None:
+                    break
+                writer.write(chunk(data) if exchange.chunked else data)
+                sent += len(data)
+                await self.with_timeout(writer.drain())
+            if exchange.chunked:
+                writer.write(LAST_CHUNK)
+                await self.with_timeout(writer.drain())
+        BYTES_SENT.inc(amount=sent)
+        return 200
+
+    async def read_manifest(self, reader, headers, sink):
+        """Read the body of a POST to the batch endpoint into sink"""
+        if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            await self.read_chunked(reader, sink)
+            return
+        length = int(headers.get('Content-Length', 0))
+        if length > MAX_MANIFEST_SIZE:
+            raise UploadTooLarge(f"manifest exceeds {MAX_MANIFEST_SIZE} bytes")
+        await self.read_body(reader, sink, length)
+
+    async def do_POST(self, reader, exchange, target, headers):
+        url = urlsplit(target)
+        if url.path == BATCH_PATH:
+            sink = ManifestSink()
+            try:
+                await self.send_continue(exchange, headers)
+                await self.read_manifest(reader, headers, sink)
+            except UploadTooLarge:
+                exchange.keep_alive = False
+                return await self.send_prepared(
+                    exchange, 'POST', *text_response(413, f"[!] Manifest too large (limit: {MAX_MANIFEST_SIZE} bytes).\n"))
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                exchange.keep_alive = False
+                LOG.message(f"[!] Error reading batch manifest: {e}", level='error')
+                return await self.send_prepared(exchange, 'POST', *text_response(400, "[!] Failed to read the manifest.\n"))
+            finally:
+                BYTES_RECEIVED.inc(amount=sink.size)
+            return await self.send_batch(exchange, 'POST', url.query, sink.data)
+
+        requested = requested_path(target)
+        chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        try:
+            content_length = 0 if chunked else int(headers.get('Content-Length', 0))
+        except ValueError as e:
+            LOG.message(f"[!] Error reading POST data: {e}", level='error')
+            exchange.keep_alive = False  # the body cannot be delimited
+            return await self.send_prepared(exchange, 'POST', *text_response(400, "[!] Failed to read POST data.\n"))
+        if self.max_upload_size is not None and content_length > self.max_upload_size:
+            return await self.reject_too_large(exchange, content_length)
+
+        # The sink's disk I/O (mkstemp, writes, rename) runs on the executor:
+        # a slow disk must not stall every other connection
+        try:
+            save_path = await self.loop.run_in_executor(self.executor, post_save_path, requested, os.getcwd())
+            sink = await self.loop.run_in_executor(self.executor, UploadSink, save_path, self.max_upload_size,
+                                                   self.upload_sha256)
+        except OSError as e:
+            LOG.message(f"[!] Error creating upload for '{requested}': {e}", level='error')
+            exchange.keep_alive = False  # the body is left unread
+            return await self.send_prepared(exchange, 'POST', *text_response(500, "[!] Failed to write POST data to file.\n"))
+
+        try:
+            await self.send_continue(exchange, headers)
+            if chunked:
+                await self.read_chunked(reader, sink, offload=True)
+            else:
+                await self.read_body(reader, sink, content_length, offload=True)
+            await self.loop.run_in_executor(self.executor, sink.commit)
+        except UploadTooLarge:
+            await self.loop.run_in_executor(self.executor, sink.abort)
+            return await self.reject_too_large(exchange, sink.size)
+        except UploadWriteError as e:
+            await self.loop.run_in_executor(self.executor, sink.abort)
+            LOG.message(f"[!] Error writing to file '{save_path}': {e}", level='error')
+            exchange.keep_alive = False
+            return await self.send_prepared(exchange, 'POST', *text_response(500, "[!] Failed to write POST data to file.\n"))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            await self.loop.run_in_executor(self.executor, sink.abort)
+            LOG.message(f"[!] Error reading POST data: {e}", level='error')
+            exchange.keep_alive = False
+            return await self.send_prepared(exchange, 'POST', *text_response(400, "[!] Failed to read POST data.\n"))
+        except BaseException:
+            sink.abort()
+            raise
+        finally:
+            BYTES_RECEIVED.inc(amount=sink.size)
+
+        index = get_shared_index(os.getcwd())
+        await self.loop.run_in_executor(self.executor, index.refresh_path,
+                                        os.path.relpath(save_path, index.root).replace('\\', '/'))
+
+        message = sink.message()
+        LOG.message(message.strip())
+        return await self.send_prepared(exchange, 'POST', *text_response(200, message))
+
+    async def send_continue(self, exchange, headers):
+        """Answer Expect: 100-continue before the body is read, as the stdlib
+        handler of the threaded mode does (curl waits a second for it)"""
+        if exchange.version >= 'HTTP/1.1' and headers.get('Expect', '').lower() == '100-continue':
+            exchange.writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await self.with_timeout(exchange.writer.drain())
+
+    async def read_body(self, reader, sink, remaining, offload=False):
+        """Read remaining bytes into sink; with offload, sink.write() (disk
+        I/O and hashing) runs on the executor instead of the event loop"""
+        while remaining > 0:
+            chunk = await self.with_timeout(reader.read(min(CHUNK_SIZE, remaining)))
+            if not chunk:
+                raise ValueError(f"client closed the connection with {remaining} bytes left")
+            if offload:
+                await self.loop.run_in_executor(self.executor, sink.write, chunk)
+            else:
+                sink.write(chunk)
+            remaining -= len(chunk)
+
+    async def read_chunked(self, reader, sink, offload=False):
+        while True:
+            size = parse_chunk_size(await self.with_timeout(reader.readline()))
+            if size == 0:
+                break
+            await self.read_body(reader, sink, size, offload)
+            if await self.with_timeout(reader.readline()) not in (b"\r\n", b"\n"):
+                raise ValueError("missing CRLF after chunk")
+        # Skip trailer headers up to the terminating empty line
+        while await self.with_timeout(reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+    async def reject_too_large(self, exchange, size):
+        LOG.message(f"[!] Rejected upload of {size}+ bytes (limit: {self.max_upload_size} bytes)", level='warning')
+        exchange.keep_alive = False  # the rest of the body is left unread
+        return await self.send_prepared(
+            exchange, 'POST', *text_response(413, f"[!] Upload too large (limit: {self.max_upload_size} bytes).\n"))
+
+    def header_block(self, exchange, status, headers):
+        try:
+            reason = http.HTTPStatus(status).phrase
+        except ValueError:
+            reason = ''
+        lines = [f"HTTP/1.1 {status} {reason}",
+                 f"Server: {http.server.SimpleHTTPRequestHandler.server_version} (asyncio)",
+                 f"Date: {email.utils.formatdate(time.time(), usegmt=True)}"]
+        lines.extend(f"{key}: {value}" for key, value in headers)
+        connection = connection_header(exchange.version, exchange.keep_alive)
+        if connection:
+            lines.append(f"Connection: {connection}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1', 'strict')
+
+    async def send_prepared(self, exchange, command, status, headers, body):
+        with stage('send'):
+            exchange.writer.write(self.header_block(exchange, status, headers))
+            if body and command != 'HEAD':
+                exchange.writer.write(body)
+                BYTES_SENT.inc(amount=len(body))
+            await self.with_timeout(exchange.writer.drain())
+        return status
+
+    async def send_simple(self, exchange, status, message):
+        """Error reply; like send_error() in the threaded handler it closes the connection"""
+        exchange.keep_alive = False
+        body = f"{status} {message}\n".encode()
+        headers = [("Content-type", "text/plain"), ("Content-Length", str(len(body)))]
+        return await self.send_prepared(exchange, 'GET', status, headers, body)
+
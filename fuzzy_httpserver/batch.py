@@ -0,0 +1,255 @@
+"""Batch downloads: many fuzzy requests answered with one streamed archive.
+
+    curl -o kit.tar 'http://host:8000/__batch?q=mimi/64&q=ligolo/win&q=winpeas'
+    curl -o kit.zip --data-binary @toolkit.txt 'http://host:8000/__batch?format=zip'
+
+Each query is resolved exactly like GET /<query>; an ambiguous one takes
+its best-ranked choice and a directory brings every file below it. The
+archive (tar, tar.gz or zip) is produced while it is sent: file contents
+are read and written chunk by chunk, nothing is staged on disk.
+"""
+import json
+import os
+import stat
+import tarfile
+import time
+import zipfile
+from collections import namedtuple
+from urllib.parse import parse_qs
+
+from .admission import admission
+from .compress import gzip_compressor
+from .index import get_shared_index
+from .matcher import resolve_request
+from .metrics import stage
+from .upload import UploadTooLarge
+
+CHUNK_SIZE = 256 * 1024
+# Bounds on one batch request
+MAX_QUERIES = 256
+MAX_MANIFEST_SIZE = 64 * 1024
+
+# A file to put in the archive: its name there and where it is on disk
+BatchMember = namedtuple('BatchMember', ['arcname', 'full_path'])
+
+# Resolved batch: response headers and the iterator producing the archive
+Batch = namedtuple('Batch', ['headers', 'chunks', 'members', 'missing'])
+
+
+class BatchError(Exception):
+    """A batch request that cannot be answered with an archive"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ManifestSink:
+    """Collects a POSTed manifest, refusing anything over MAX_MANIFEST_SIZE"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > MAX_MANIFEST_SIZE:
+            raise UploadTooLarge(f"manifest exceeds {MAX_MANIFEST_SIZE} bytes")
+        self.data += data
+
+
+def parse_manifest(data):
+    """Queries from a manifest: a JSON list of strings, or one query per
+    line (blank lines and '#' comments ignored)"""
+    text = bytes(data).decode('utf-8', 'replace')
+    if text.lstrip().startswith('['):
+        try:
+            queries = json.loads(text)
+        except ValueError as e:
+            raise BatchError(400, f"[!] Invalid JSON manifest: {e}\n")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise BatchError(400, "[!] A JSON manifest must be a list of strings.\n")
+        return queries
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+
+
+def resolve_batch(queries, base_path):
+    """Files to send for the queries (in request order, each file once) and
+    the queries that matched nothing"""
+    index = get_shared_index(base_path)
+    members = []
+    missing = []
+    seen = set()
+    for query in queries:
+        result = resolve_request(query, base_path)
+        if result.kind == 'choices':
+            rel_paths = [result.choices[0][0]]
+        elif result.path is None:
+            missing.append(query)
+            continue
+        elif result.is_file:
+            rel_paths = [result.path.lstrip('/')]
+        else:
+            rel_paths = [entry.rel_path for entry in index.files_under(result.path.lstrip('/'))]
+        for rel_path in rel_paths:
+            if rel_path not in seen:
+                seen.add(rel_path)
+                members.append(BatchMember(rel_path, index.abs_path(rel_path)))
+    return members, missing
+
+
+def open_member(member):
+    """(open file, stat) for a regular file, or None when it is gone or not one"""
+    try:
+        f = open(member.full_path, 'rb')
+    except OSError:
+        return None
+    st = os.fstat(f.fileno())
+    if not stat.S_ISREG(st.st_mode):
+        f.close()
+        return None
+    return f, st
+
+
+def read_member(f, size):
+    """Up to size bytes of f in chunks (fewer if the file shrank meanwhile)"""
+    while size > 0:
+        data = f.read(min(CHUNK_SIZE, size))
+        if not data:
+            return
+        size -= len(data)
+        yield data
+
+
+def iter_tar(members):
+    """A ustar/pax archive of members, one header or data chunk at a time"""
+    offset = 0
+    for member in members:
+        opened = open_member(member)
+        if opened is None:
+            continue
+        f, st = opened
+        with f:
+            info = tarfile.TarInfo(member.arcname)
+            info.size = st.st_size
+            info.mtime = int(st.st_mtime)
+            info.mode = stat.S_IMODE(st.st_mode)
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            yield header
+            sent = 0
+            for data in read_member(f, st.st_size):
+                sent += len(data)
+                yield data
+        # The header promised st_size bytes: zero-fill a file that shrank, then pad the block
+        padding = st.st_size - sent + (-st.st_size % tarfile.BLOCKSIZE)
+        if padding:
+            yield bytes(padding)
+        offset += len(header) + st.st_size + (-st.st_size % tarfile.BLOCKSIZE)
+    # End of archive: two zero blocks, then up to a whole record as tarfile writes it
+    offset += 2 * tarfile.BLOCKSIZE
+    yield bytes(2 * tarfile.BLOCKSIZE + -offset % tarfile.RECORDSIZE)
+
+
+def iter_tar_gz(members):
+    compressor = gzip_compressor()
+    for data in iter_tar(members):
+        out = compressor.compress(data)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+class _Spool:
+    """Write-only stream for zipfile; take() returns what was written since"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_zip(members):
+    """A deflated zip of members; sizes and CRCs go in data descriptors
+    since nothing can be seeked back to"""
+    spool = _Spool()
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for member in members:
+            opened = open_member(member)
+            if opened is None:
+                continue
+            f, st = opened
+            with f:
+                # zip timestamps start in 1980
+                info = zipfile.ZipInfo(member.arcname, max(time.localtime(st.st_mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = (st.st_mode & 0xFFFF) << 16
+                info.file_size = st.st_size  # picks zip64 for large files
+                with archive.open(info, 'w') as dest:
+                    for data in read_member(f, st.st_size):
+                        dest.write(data)
+                        out = spool.take()
+                        if out:
+                            yield out
+            out = spool.take()  # rest of the member and its data descriptor
+            if out:
+                yield out
+    yield spool.take()  # central directory
+
+
+# format query parameter -> (Content-Type, file extension, generator)
+ARCHIVE_FORMATS = {
+    'tar': ('application/x-tar', 'tar', iter_tar),
+    'tar.gz': ('application/gzip', 'tar.gz', iter_tar_gz),
+    'tgz': ('application/gzip', 'tar.gz', iter_tar_gz),
+    'zip': ('application/zip', 'zip', iter_zip),
+}
+
+
+def plan_batch(query_string, base_path, manifest=None, client=None):
+    """Resolve a batch request (queries from q= parameters and/or a POSTed
+    manifest) to a Batch; raises BatchError when there is nothing to send.
+
+    The batch costs client one request of its rate; its queries then take
+    match slots like any other request (and may raise Rejected).
+    """
+    with stage('parse'):
+        params = parse_qs(query_string)
+        queries = params.get('q', [])
+        if manifest is not None:
+            queries += parse_manifest(manifest)
+        queries = [query.strip().strip('/') for query in queries]
+        queries = [query for query in queries if query]
+    archive_format = params.get('format', ['tar'])[-1].lower()
+    if archive_format not in ARCHIVE_FORMATS:
+        raise BatchError(400, f"[!] Unknown archive format '{archive_format}' "
+                              f"(use {', '.join(ARCHIVE_FORMATS)}).\n")
+    if not queries:
+        raise BatchError(400, "[!] No queries: use ?q=name/filter&q=... or POST one query per line.\n")
+    if len(queries) > MAX_QUERIES:
+        raise BatchError(400, f"[!] Too many queries (limit: {MAX_QUERIES}).\n")
+    admission.check_rate(client)
+
+    members, missing = resolve_batch(queries, base_path)
+    if not members:
+        raise BatchError(404, f"[!] None of the {len(queries)} queries matched a file.\n")
+    ctype, extension, generator = ARCHIVE_FORMATS[archive_format]
+    reply = f"{len(members)} files for {len(queries)} queries"
+    if missing:
+        reply += f"; not found: {', '.join(missing)}"
+    headers = [
+        ("Content-type", ctype),
+        ("Content-Disposition", f'attachment; filename="fuzzy-batch.{extension}"'),
+        ("Server-Reply", reply.encode('ascii', 'backslashreplace').decode('ascii')),
+    ]
+    return Batch(headers, generator(members), members, missing)
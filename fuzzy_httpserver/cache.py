@@ -0,0 +1,187 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with hit/miss counters"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ResolutionCache(LRUCache):
+    """Resolved MatchResults keyed on (root, normalized query + filters).
+
+    Entries are only valid for the index generation they were computed
+    against; the whole cache is dropped as soon as the tree changes.
+    """
+
+    def __init__(self, maxsize=1024):
+        super().__init__(maxsize)
+        self.generation = None
+        self.invalidations = 0
+
+    def lookup(self, key, generation):
+        if generation != self.generation:
+            with self._lock:
+                if generation != self.generation:
+                    if self.generation is not None:
+                        self.invalidations += 1
+                    self._data.clear()
+                    self.generation = generation
+        return self.get(key)
+
+    def store(self, key, generation, result):
+        if generation == self.generation:
+            self.put(key, result)
+
+    def stats(self):
+        stats = super().stats()
+        stats["invalidations"] = self.invalidations
+        return stats
+
+
+# A cached file: os.stat_result it was loaded with and a memoryview of its
+# contents (a private copy: the file can change on disk without affecting it)
+CachedFile = namedtuple('CachedFile', ['st', 'data'])
+
+# Larger files are sent with sendfile() from a freshly opened descriptor
+MAX_CACHED_FILE = 1024 * 1024
+
+
+class FileCache:
+    """Contents of hot files kept in memory, LRU-evicted under a byte budget.
+
+    Lookups cost one stat(); an entry is dropped as soon as the file's
+    inode, size or mtime differ from when it was loaded. Entries are read()
+    copies, never mappings: a tool overwritten in place (cp, scp) must not
+    be able to take the server down with SIGBUS. Callers slice `data` (a
+    memoryview), so serving from the cache copies nothing.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, max_file=MAX_CACHED_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data = OrderedDict()  # path -> (signature, CachedFile)
+        self._lock = threading.Lock()
+
+    @property
+    def max_file_size(self):
+        # A single file may not take more than a quarter of the budget
+        return min(self.max_bytes // 4, self.max_file)
+
+    def get(self, path):
+        """CachedFile for path when its cached copy is still current, else
+        None (nothing is loaded here: see fill())"""
+        if self.max_bytes <= 0:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._data.get(path)
+            if entry is not None:
+                if entry[0] == signature:
+                    self._data.move_to_end(path)
+                    self.hits += 1
+                    return entry[1]
+                self._drop(path)
+                self.invalidations += 1
+            self.misses += 1
+        return None
+
+    def fill(self, path, f, st):
+        """Cache the contents of path, open as f with fstat() st, when its
+        whole body is about to be sent; returns the CachedFile, or None when
+        the file does not fit or changed while it was read"""
+        if self.max_bytes <= 0 or st.st_size > self.max_file_size:
+            return None
+        try:
+            data = os.pread(f.fileno(), st.st_size, 0) if hasattr(os, 'pread') else f.read()
+        except OSError:
+            return None
+        if len(data) != st.st_size:
+            return None  # changed while reading
+        cached = CachedFile(st, memoryview(data))
+        with self._lock:
+            if path in self._data:
+                self._drop(path)
+            self._data[path] = ((st.st_ino, st.st_size, st.st_mtime_ns), cached)
+            self.total += st.st_size
+            while self.total > self.max_bytes:
+                self._drop(next(iter(self._data)))
+        return cached
+
+    def _drop(self, path):
+        # Views handed out earlier keep the buffer alive until released
+        signature, cached = self._data.pop(path)
+        self.total -= cached.st.st_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+# Process-wide cache of hot file contents (sized from the command line)
+file_cache = FileCache()
@@ -0,0 +1,376 @@
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+
+from .metrics import REGISTRY, Counter
+from .transfer import is_not_modified, make_etag
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:  # optional: zstd is only offered when a binding is importable
+    zstandard = None
+try:
+    import brotli
+except ImportError:  # optional: br is only offered when brotli is importable
+    brotli = None
+
+# Content-Encoding for served files: negotiated from Accept-Encoding, served
+# from a precompressed sibling (file.gz) when one exists, otherwise from an
+# on-disk cache of compressed variants so a hot file is compressed once.
+
+CHUNK_SIZE = 256 * 1024
+# Smaller bodies gain too little to be worth a round through the compressor
+MIN_SIZE = 1024
+# Temp files older than this are leftovers of an interrupted compression
+STALE_TEMP_SECONDS = 3600
+
+SIBLING_SUFFIXES = {'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+
+# Text-like files whose type mimetypes does not report as text/*
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/x-sh',
+    'application/x-csh', 'application/x-python-code', 'application/x-perl', 'application/sql',
+    'image/svg+xml',
+}
+COMPRESSIBLE_EXTENSIONS = {
+    '.ps1', '.psm1', '.psd1', '.sh', '.bash', '.zsh', '.py', '.pl', '.rb', '.php', '.bat', '.cmd',
+    '.vbs', '.js', '.lua', '.txt', '.lst', '.csv', '.log', '.conf', '.cfg', '.ini', '.md', '.sql',
+    '.xml', '.json', '.yml', '.yaml', '.html', '.htm', '.css', '.c', '.h', '.cs', '.go', '.rs',
+}
+
+COMPRESSION_RESULTS = REGISTRY.register(Counter(
+    "fuzzy_compression_responses_total", "Compressed responses by encoding and source", ("encoding", "source")))
+
+# Variant of a file to send: path is None when the body must be compressed
+# on the fly (file too big for the cache); source is sibling/cache/stream.
+Variant = namedtuple('Variant', ['encoding', 'path', 'source'])
+
+
+def gzip_compressor():
+    return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def zstd_compressor():
+    if zstd is not None:
+        return zstd.ZstdCompressor(level=3)
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+
+def available_encoders():
+    """Encoding name -> factory of objects with compress()/flush(), best first"""
+    encoders = OrderedDict()
+    if zstd is not None or zstandard is not None:
+        encoders['zstd'] = zstd_compressor
+    if brotli is not None:
+        encoders['br'] = _BrotliCompressor
+    encoders['gzip'] = gzip_compressor
+    return encoders
+
+
+ENCODERS = available_encoders()
+
+
+def accepted_encodings(header):
+    """Codings from an Accept-Encoding header with q > 0, highest q first
+    (ties keep our preference order)"""
+    if not header:
+        return []
+    weights = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    wildcard = weights.get('*', 0.0)
+    ranked = []
+    # Precompressed siblings can be served even without a local encoder
+    candidates = list(ENCODERS) + [name for name in SIBLING_SUFFIXES if name not in ENCODERS]
+    for rank, encoding in enumerate(candidates):
+        q = weights.get(encoding, wildcard)
+        if encoding == 'gzip' and 'gzip' not in weights and 'x-gzip' in weights:
+            q = weights['x-gzip']
+        if q > 0:
+            ranked.append((-q, rank, encoding))
+    return [encoding for _, _, encoding in sorted(ranked)]
+
+
+def is_compressible(full_path, ctype, size):
+    if size < MIN_SIZE:
+        return False
+    ctype = ctype.split(';')[0].strip().lower()
+    if ctype.startswith('text/') or ctype in COMPRESSIBLE_TYPES:
+        return True
+    return os.path.splitext(full_path)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def is_precompressed_sibling(index, entry, query_lower):
+    """True for file.gz (etc.) next to an indexed file: it is served as that
+    file's encoding rather than matched on its own, unless asked for by name"""
+    for suffix in SIBLING_SUFFIXES.values():
+        if entry.name_lower.endswith(suffix) and not query_lower.endswith(suffix):
+            original = index.get(entry.rel_path[:-len(suffix)])
+            return original is not None and original.is_file
+    return False
+
+
+def iter_compressed(f, encoding, offset=0, count=None, chunk_size=CHUNK_SIZE):
+    """Compressed chunks of f, read and compressed chunk_size bytes at a time"""
+    compressor = ENCODERS[encoding]()
+    f.seek(offset)
+    remaining = count
+    while remaining is None or remaining > 0:
+        data = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+        if not data:
+            break
+        if remaining is not None:
+            remaining -= len(data)
+        out = compressor.compress(data)
+        if out:
+            yield out
+    out = compressor.flush()
+    if out:
+        yield out
+
+
+def default_cache_directory():
+    """$XDG_CACHE_HOME/fuzzy-httpserver/compressed (~/.cache/... by default),
+    or None when there is no home directory to put it in"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    if not os.path.isabs(base):
+        return None
+    return os.path.join(base, 'fuzzy-httpserver', 'compressed')
+
+
+def private_directory(path):
+    """Create path (mode 0700) unless it exists, then make sure no other user
+    can write to it: cached variants are sent as they are found, so entries
+    planted under their predictable names would be served. Raises ValueError
+    when the directory is not ours alone."""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError as e:
+        raise ValueError(f"cannot create the compression cache directory '{path}': {e}")
+    if not stat.S_ISDIR(st.st_mode):
+        raise ValueError(f"compression cache directory '{path}' is not a directory")
+    if hasattr(os, 'getuid'):  # POSIX: owner and permission bits mean something
+        if st.st_uid != os.getuid():
+            raise ValueError(f"compression cache directory '{path}' is not owned by the current user")
+        if st.st_mode & 0o077:
+            raise ValueError(f"compression cache directory '{path}' is accessible to other users "
+                             f"(mode {stat.S_IMODE(st.st_mode):04o}; chmod 700 it)")
+    return path
+
+
+class CompressionCache:
+    """Compressed variants of served files in a directory outside the tree.
+
+    Entries are keyed by path, mtime, size and encoding, so a changed file
+    simply gets a new entry; old ones age out of the LRU once the total
+    exceeds max_bytes. The directory must belong to the serving user alone
+    (see setup()).
+    """
+
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.entries = None  # file name -> size, least recently used first
+        self.total = 0
+        self._lock = threading.Lock()
+        self._pending = {}   # file name -> Event set when its compression finishes
+
+    @property
+    def max_file_size(self):
+        # Bigger files would churn the whole cache; they are compressed on the fly
+        return self.max_bytes // 4
+
+    def setup(self, directory=None):
+        """Use directory, or the per-user default, after checking that only
+        the current user can write to it (ValueError otherwise)"""
+        directory = directory or default_cache_directory()
+        if directory is None:
+            self.directory = tempfile.mkdtemp(prefix="fuzzy-httpserver-compressed-")
+        else:
+            self.directory = private_directory(directory)
+
+    def _load(self):
+        if self.directory is None:
+            # Not set up from the command line: a fresh private directory
+            self.directory = tempfile.mkdtemp(prefix="fuzzy-httpserver-compressed-")
+        found = []
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.startswith('.'):
+                    if now - st.st_mtime > STALE_TEMP_SECONDS:
+                        try:
+                            os.unlink(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                found.append((st.st_mtime, entry.name, st.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        self.total = sum(self.entries.values())
+        self._evict()
+
+    def key(self, full_path, st, encoding):
+        raw = f"{os.path.abspath(full_path)}\0{st.st_mtime_ns}\0{st.st_size}\0{encoding}"
+        return hashlib.sha256(raw.encode('utf-8', 'surrogateescape')).hexdigest() + SIBLING_SUFFIXES[encoding]
+
+    def get(self, f, full_path, st, encoding, compress=True):
+        """Path of the compressed variant of full_path (already open as f,
+        unless f is None), compressing it first if needed; concurrent
+        requests for the same variant wait for the first one instead of
+        compressing it again. Without compress, None when it is not cached."""
+        name = self.key(full_path, st, encoding)
+        path = os.path.join(self.directory, name)
+        while True:
+            with self._lock:
+                if self.entries is None:
+                    self._load()
+                if name in self.entries:
+                    self.entries.move_to_end(name)
+                    return path
+                pending = self._pending.get(name)
+                if not compress:
+                    return None
+                if pending is None:
+                    pending = self._pending[name] = threading.Event()
+                    break
+            pending.wait()
+        try:
+            if f is None:
+                with open(full_path, 'rb') as source:
+                    size = self._compress(source, encoding, name)
+            else:
+                size = self._compress(f, encoding, name)
+        finally:
+            with self._lock:
+                del self._pending[name]
+            pending.set()
+        with self._lock:
+            self.entries[name] = size
+            self.total += size
+            self._evict(keep=name)
+        return path
+
+    def _compress(self, f, encoding, name):
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter_compressed(f, encoding):
+                    out.write(chunk)
+                size = out.tell()
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return size
+
+    def _evict(self, keep=None):
+        while self.total > self.max_bytes and self.entries:
+            name, size = next(iter(self.entries.items()))
+            if name == keep:
+                break
+            del self.entries[name]
+            self.total -= size
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries or ()),
+                "bytes": self.total,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Process-wide cache (configured from the command line)
+compression_cache = CompressionCache()
+
+
+def has_encoded_variants(full_path, st, ctype):
+    """Whether some Accept-Encoding gets an encoded representation of the
+    file; then even its plain responses must carry Vary: Accept-Encoding"""
+    if not compression_cache.enabled:
+        return False
+    if is_compressible(full_path, ctype, st.st_size):
+        return True
+    return any(os.path.exists(full_path + suffix) for suffix in SIBLING_SUFFIXES.values())
+
+
+def select_variant(f, full_path, st, ctype, request_headers, command='GET'):
+    """Pick the representation of a file (open as f, or None) to send: None
+    for the file itself, else a Variant with the chosen Content-Encoding"""
+    if not compression_cache.enabled or request_headers.get('Range'):
+        # Ranges (download resumes) always refer to the plain file
+        return None
+    accepted = accepted_encodings(request_headers.get('Accept-Encoding'))
+    if not accepted:
+        return None
+    for encoding in accepted:
+        sibling = full_path + SIBLING_SUFFIXES[encoding]
+        try:
+            sibling_st = os.stat(sibling)
+        except OSError:
+            continue
+        if sibling_st.st_mtime >= st.st_mtime:
+            COMPRESSION_RESULTS.inc(encoding, 'sibling')
+            return Variant(encoding, sibling, 'sibling')
+    accepted = [encoding for encoding in accepted if encoding in ENCODERS]
+    if not accepted or not is_compressible(full_path, ctype, st.st_size):
+        return None
+    encoding = accepted[0]
+    if compression_cache.max_bytes and st.st_size <= compression_cache.max_file_size:
+        # A miss is only compressed for a response with a body: HEAD and 304
+        # are answered as a stream variant, which compresses nothing for them
+        compress = command == 'GET' and not is_not_modified(request_headers, make_etag(st, encoding), st.st_mtime)
+        try:
+            path = compression_cache.get(f, full_path, st, encoding, compress)
+        except OSError:
+            path = None  # cache directory unusable: compress on the fly instead
+        if path is not None:
+            COMPRESSION_RESULTS.inc(encoding, 'cache')
+            return Variant(encoding, path, 'cache')
+    COMPRESSION_RESULTS.inc(encoding, 'stream')
+    return Variant(encoding, None, 'stream')
@@ -0,0 +1,608 @@
+import os
+import re
+import fnmatch
+import threading
+import struct
+import select
+import errno
+from collections import namedtuple
+
+from .accesslog import LOG
+from .ngram import DirSummaries, NgramIndex
+from .scoring import PathFeatures
+
+# Never worth matching against (globs, checked against names and relative paths)
+DEFAULT_EXCLUDES = ('.git', 'node_modules')
+
+# One entry per file or directory below the served root.
+# rel_path uses '/' separators, stem/ext are lowercased (os.path.splitext).
+IndexEntry = namedtuple('IndexEntry', ['rel_path', 'name', 'name_lower', 'stem', 'ext', 'is_file', 'parent'])
+
+
+def make_entry(rel_path, is_file):
+    """Build an IndexEntry from a '/' separated path relative to the root"""
+    parent, _, name = rel_path.rpartition('/')
+    name_lower = name.lower()
+    stem, ext = os.path.splitext(name_lower)
+    return IndexEntry(rel_path, name, name_lower, stem, ext, is_file, parent)
+
+
+def join_rel(parent, name):
+    return f"{parent}/{name}" if parent else name
+
+
+class FileIndex:
+    """Process-wide index of the served tree.
+
+    Built once with os.walk and then kept current by incremental
+    add/remove updates, so request handling never has to touch the
+    filesystem to find candidates.
+    """
+
+    def __init__(self, root, prefilter=True, features=True, summaries=True, max_depth=None,
+                 exclude=DEFAULT_EXCLUDES):
+        self.root = os.path.abspath(root)
+        # Entries deeper than max_depth levels (1 = the root's own entries) are not indexed
+        self.max_depth = max_depth
+        self.exclude = tuple(exclude)
+        self._exclude_re = re.compile('|'.join(fnmatch.translate(pattern) for pattern in self.exclude)) \
+            if self.exclude else None
+        self.lock = threading.RLock()
+        self.generation = 0
+        self._entries = {}               # rel_path -> IndexEntry
+        self._children = {'': {}}        # dir rel_path -> {name: IndexEntry}
+        self._dir_mtimes = {}            # dir rel_path -> st_mtime_ns (see revalidate)
+        self._files_snapshot = None
+        self._file_positions = None
+        self._snapshot_generation = -1
+        self._watcher = None
+        self.use_prefilter = prefilter
+        self.use_features = features
+        self.use_summaries = summaries
+        self._summaries_building = False
+        self._reset_derived()
+
+    def _reset_derived(self):
+        """Start fresh derived structures (kept in sync through add(entry) and
+        remove(entry)); readers still holding the old ones keep a consistent view"""
+        self._ngrams = NgramIndex() if self.use_prefilter else None
+        self._features = PathFeatures() if self.use_features else None
+        self._summaries = None  # built on demand, see build_summaries()
+        self.listeners = [derived for derived in (self._ngrams, self._features) if derived is not None]
+        self._derived_pending = False
+
+    def defer_derived(self):
+        """Stop maintaining the derived structures until they are first used;
+        bulk loads (snapshots) then only pay for the entries themselves"""
+        with self.lock:
+            self._ngrams = self._features = self._summaries = None
+            self.listeners = []
+            self._derived_pending = True
+
+    def ensure_derived(self):
+        """Build derived structures deferred by defer_derived()"""
+        with self.lock:
+            if not self._derived_pending:
+                return
+            self._reset_derived()
+            for entry in self.files():
+                for listener in self.listeners:
+                    listener.add(entry)
+
+    @property
+    def ngrams(self):
+        if self._derived_pending:
+            self.ensure_derived()
+        return self._ngrams
+
+    @property
+    def features(self):
+        if self._derived_pending:
+            self.ensure_derived()
+        return self._features
+
+    def build_summaries(self, background=False):
+        """Build the per-directory subtree summaries (about as costly as the
+        rest of the index, and only needed by filtered short queries).
+
+        Built from a copy of the file list without holding the lock, so
+        requests carry on meanwhile (their walks are just not pruned).
+        """
+        with self.lock:
+            if not self.use_summaries or self._summaries is not None or self._summaries_building:
+                return
+            self._summaries_building = True
+        if background:
+            threading.Thread(target=self._build_summaries, name='fuzzy-index-summaries', daemon=True).start()
+        else:
+            self._build_summaries()
+
+    def _build_summaries(self):
+        try:
+            files = self.files()
+            summaries = DirSummaries()
+            for entry in files:
+                summaries.add(entry)
+            with self.lock:
+                current = self.files()
+                if current is not files:
+                    # Catch up with files added meanwhile; removals can stay (summaries only over-approximate)
+                    built = set(files)
+                    for entry in current:
+                        if entry not in built:
+                            summaries.add(entry)
+                self._summaries = summaries
+                self.listeners.append(summaries)
+        finally:
+            self._summaries_building = False
+
+    def scan_options(self):
+        """What decides which paths get indexed (stored with snapshots)"""
+        return {'max_depth': self.max_depth, 'exclude': list(self.exclude)}
+
+    def indexable(self, rel_path):
+        """False for paths deeper than max_depth or matching an exclude glob"""
+        if self.max_depth is not None and rel_path.count('/') >= self.max_depth:
+            return False
+        if self._exclude_re is not None:
+            name = rel_path.rpartition('/')[2]
+            if self._exclude_re.match(name) or self._exclude_re.match(rel_path):
+                return False
+        return True
+
+    @classmethod
+    def from_paths(cls, root, rel_paths, prefilter=True, features=True, summaries=True):
+        """Build an index from '/' separated file paths without touching the disk"""
+        index = cls(root, prefilter=prefilter, features=features, summaries=summaries)
+        with index.lock:
+            for rel_path in rel_paths:
+                parts = rel_path.split('/')
+                for i in range(1, len(parts)):
+                    dir_rel = '/'.join(parts[:i])
+                    if dir_rel not in index._children:
+                        index._insert(make_entry(dir_rel, False))
+                index._insert(make_entry(rel_path, True))
+            index.generation += 1
+        return index
+
+    # ------------------------------------------------------------------
+    # Building and querying
+    # ------------------------------------------------------------------
+    def build(self):
+        """Walk the whole tree once and populate the index"""
+        with self.lock:
+            self._entries = {}
+            self._children = {'': {}}
+            self._dir_mtimes = {}
+            self._reset_derived()
+            self._scan_subtree('')
+            self.generation += 1
+
+    def files(self):
+        """Return all file entries in os.walk order (cached per generation)"""
+        with self.lock:
+            self._refresh_snapshot()
+            return self._files_snapshot
+
+    def files_under(self, dir_rel):
+        """Return the file entries below a directory, in os.walk order"""
+        result = []
+        with self.lock:
+            self._collect_files(dir_rel, result)
+        return result
+
+    def _refresh_snapshot(self):
+        if self._snapshot_generation != self.generation:
+            result = []
+            self._collect_files('', result)
+            self._files_snapshot = tuple(result)
+            self._file_positions = None
+            self._snapshot_generation = self.generation
+
+    def in_walk_order(self, entries):
+        """Sort a subset of file entries the way files() orders them"""
+        with self.lock:
+            self._refresh_snapshot()
+            if self._file_positions is None:
+                self._file_positions = {entry.rel_path: i for i, entry in enumerate(self._files_snapshot)}
+            positions = self._file_positions
+        return sorted(entries, key=lambda entry: positions.get(entry.rel_path, -1))
+
+    def candidate_files(self, query_lower, filters=()):
+        """Files whose stem contains the query or is contained in it, in walk order.
+
+        Exact (not approximate) when the trigram prefilter can be used; otherwise
+        every file is returned, or with filters the tree is walked skipping
+        subtrees whose summary rules out the query or one of the (lowercased)
+        filters; the caller's own checks do the rest of the filtering.
+        """
+        if self.ngrams is not None:
+            candidates = self.ngrams.substring_candidates(query_lower, self.lock)
+            if candidates is not None:
+                return self.in_walk_order(candidates)
+        summaries = self._summaries if filters else None
+        if summaries is None:
+            if filters:
+                self.build_summaries(background=True)
+            return self.files()
+        with self.lock:
+            if not summaries.may_match('', query_lower, filters):
+                return []
+            result = []
+            self._collect_files('', result, lambda dir_rel: summaries.may_match(dir_rel, query_lower, filters))
+            return result
+
+    def children(self, dir_rel=''):
+        """Return the direct children of a directory, in listing order"""
+        with self.lock:
+            return list(self._children.get(dir_rel, {}).values())
+
+    def get(self, rel_path):
+        with self.lock:
+            return self._entries.get(rel_path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _collect_files(self, dir_rel, result, visit=None):
+        subdirs = []
+        for entry in self._children.get(dir_rel, {}).values():
+            if entry.is_file:
+                result.append(entry)
+            else:
+                subdirs.append(entry.rel_path)
+        for sub in subdirs:
+            if visit is None or visit(sub):
+                self._collect_files(sub, result, visit)
+
+    # ------------------------------------------------------------------
+    # Incremental updates
+    # ------------------------------------------------------------------
+    def abs_path(self, rel_path):
+        return os.path.join(self.root, *rel_path.split('/')) if rel_path else self.root
+
+    def _scan_subtree(self, dir_rel):
+        """Add everything below dir_rel (which must already be indexed or be the root)"""
+        top = self.abs_path(dir_rel)
+        for root, dirs, files in os.walk(top):
+            rel_root = os.path.relpath(root, self.root).replace('\\', '/')
+            if rel_root == '.':
+                rel_root = ''
+            depth = rel_root.count('/') + 2 if rel_root else 1  # of the entries listed here
+            if self.max_depth is not None and depth > self.max_depth:
+                dirs[:] = []
+                continue
+            try:
+                self._dir_mtimes[rel_root] = os.stat(root).st_mtime_ns
+            except OSError:
+                pass
+            if self._exclude_re is not None:
+                # Pruning dirs in place also keeps os.walk out of them
+                dirs[:] = [name for name in dirs if self.indexable(join_rel(rel_root, name))]
+                files = [name for name in files if self.indexable(join_rel(rel_root, name))]
+            for name in files:
+                self._insert(make_entry(join_rel(rel_root, name), True))
+            for name in dirs:
+                self._insert(make_entry(join_rel(rel_root, name), False))
+            if self.max_depth is not None and depth >= self.max_depth:
+                dirs[:] = []  # indexed, but not descended into
+
+    def _insert(self, entry):
+        self._entries[entry.rel_path] = entry
+        self._children.setdefault(entry.parent, {})[entry.name] = entry
+        if not entry.is_file:
+            self._children.setdefault(entry.rel_path, {})
+        for listener in self.listeners:
+            listener.add(entry)
+
+    def add_path(self, rel_path):
+        """Index a newly created file or directory (and its subtree)"""
+        if not self.indexable(rel_path):
+            return None
+        path = self.abs_path(rel_path)
+        try:
+            is_dir = os.path.isdir(path) and not os.path.islink(path)
+        except OSError:
+            return None
+        with self.lock:
+            parent = rel_path.rpartition('/')[0]
+            if parent not in self._children:
+                return None  # parent not indexed (yet); its own event will pick this up
+            if rel_path in self._entries:
+                self._remove_locked(rel_path)
+            entry = make_entry(rel_path, not is_dir)
+            self._insert(entry)
+            if is_dir:
+                self._scan_subtree(rel_path)
+            self.generation += 1
+            return entry
+
+    def remove_path(self, rel_path):
+        """Drop a file or directory (and its subtree) from the index"""
+        with self.lock:
+            if rel_path not in self._entries:
+                return False
+            self._remove_locked(rel_path)
+            self.generation += 1
+            return True
+
+    def _remove_locked(self, rel_path):
+        entry = self._entries.pop(rel_path)
+        siblings = self._children.get(entry.parent)
+        if siblings is not None:
+            siblings.pop(entry.name, None)
+        for listener in self.listeners:
+            listener.remove(entry)
+        if not entry.is_file:
+            self._dir_mtimes.pop(rel_path, None)
+            for child in list(self._children.get(rel_path, {}).values()):
+                self._remove_locked(child.rel_path)
+            self._children.pop(rel_path, None)
+
+    def refresh_path(self, rel_path):
+        """Make sure rel_path is indexed, adding any missing parent directories too"""
+        parts = rel_path.split('/')
+        with self.lock:
+            for i in range(1, len(parts) + 1):
+                prefix = '/'.join(parts[:i])
+                if prefix not in self._entries or i == len(parts):
+                    return self.add_path(prefix)
+
+    def rename_path(self, old_rel, new_rel):
+        with self.lock:
+            self.remove_path(old_rel)
+            return self.add_path(new_rel)
+
+    def rescan_dir(self, dir_rel):
+        """Reconcile one directory's children with the filesystem (used by the poller)"""
+        path = self.abs_path(dir_rel)
+        try:
+            names = os.listdir(path)
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            if dir_rel:
+                self.remove_path(dir_rel)
+            return
+        with self.lock:
+            if dir_rel not in self._children:
+                return
+            current = self._children[dir_rel]
+            self._dir_mtimes[dir_rel] = mtime
+            on_disk = set(names)
+            for name in list(current):
+                if name not in on_disk:
+                    self.remove_path(join_rel(dir_rel, name))
+            for name in names:
+                if name not in current:
+                    self.add_path(join_rel(dir_rel, name))
+
+    def revalidate(self):
+        """Stat every indexed directory and rescan only those whose mtime
+        changed; returns the number rescanned"""
+        with self.lock:
+            dirs = list(self._dir_mtimes.items())
+        rescanned = 0
+        for dir_rel, old_mtime in dirs:
+            try:
+                mtime = os.stat(self.abs_path(dir_rel)).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != old_mtime:
+                self.rescan_dir(dir_rel)
+                rescanned += 1
+        return rescanned
+
+    # ------------------------------------------------------------------
+    # Watching
+    # ------------------------------------------------------------------
+    def start_watching(self, mode='auto', poll_interval=2.0):
+        """Keep the index current in the background.
+
+        mode is 'inotify', 'poll', 'auto' (inotify with polling fallback) or 'off'.
+        Returns the mode actually in use.
+        """
+        if mode == 'off':
+            return 'off'
+        if mode in ('auto', 'inotify'):
+            try:
+                self._watcher = InotifyWatcher(self)
+            except OSError as e:
+                if mode == 'inotify':
+                    raise
+                LOG.message(f"[!] inotify unavailable ({e}), falling back to polling", color=93, level='warning')
+        if self._watcher is None:
+            self._watcher = PollingWatcher(self, poll_interval)
+        self._watcher.start()
+        return self._watcher.mode
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+
+class PollingWatcher:
+    """Fallback watcher: stats every indexed directory and rescans only the changed ones"""
+    mode = 'poll'
+
+    def __init__(self, index, interval):
+        self.index = index
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fuzzy-index-poll', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.index.revalidate()
+
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Linux inotify watcher using libc through ctypes (no extra dependencies)"""
+    mode = 'inotify'
+
+    def __init__(self, index):
+        import ctypes  # only once inotify is actually used
+        self.index = index
+        self.get_errno = ctypes.get_errno
+        # The libc this process is linked against; find_library() (which runs
+        # ldconfig and pulls in subprocess) only when that does not work
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            from ctypes.util import find_library
+            libc_name = find_library('c')
+            if not libc_name:
+                raise OSError(errno.ENOSYS, "libc not found")
+            self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify not supported")
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = self.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.wd_to_dir = {}
+        self.dir_to_wd = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fuzzy-index-inotify', daemon=True)
+        try:
+            with index.lock:
+                dirs = [rel for rel in index._children]
+            for dir_rel in dirs:
+                self.add_watch(dir_rel)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, dir_rel):
+        path = os.fsencode(self.index.abs_path(dir_rel))
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            err = self.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return  # vanished or unreadable directory, nothing to watch
+            raise OSError(err, f"inotify_add_watch: {os.strerror(err)}")
+        self.wd_to_dir[wd] = dir_rel
+        self.dir_to_wd[dir_rel] = wd
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch_new_subtree(self, dir_rel):
+        """Watch dir_rel and every indexed directory below it ('' is the whole tree)"""
+        with self.index.lock:
+            if not dir_rel:
+                dirs = list(self.index._children)  # no relative path starts with '/'
+            else:
+                dirs = [rel for rel in self.index._children if rel == dir_rel or rel.startswith(dir_rel + '/')]
+        for rel in dirs:
+            if rel not in self.dir_to_wd:
+                self.add_watch(rel)
+
+    def _forget_subtree(self, dir_rel):
+        prefix = dir_rel + '/'
+        for rel in [rel for rel in self.dir_to_wd if rel == dir_rel or rel.startswith(prefix)]:
+            wd = self.dir_to_wd.pop(rel)
+            self.wd_to_dir.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([self.fd], [], [], 1.0)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self._handle_events(data)
+        except OSError as e:
+            LOG.message(f"[!] inotify watcher stopped: {e}", color=91, level='error')
+        finally:
+            os.close(self.fd)
+
+    def _handle_events(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: resync everything from disk
+                self.index.build()
+                self._watch_new_subtree('')
+                continue
+            dir_rel = self.wd_to_dir.get(wd)
+            if dir_rel is None:
+                continue
+            if mask & IN_IGNORED:
+                self.wd_to_dir.pop(wd, None)
+                if self.dir_to_wd.get(dir_rel) == wd:
+                    self.dir_to_wd.pop(dir_rel, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue  # the parent directory reports the removal itself
+
+            rel_path = join_rel(dir_rel, name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                entry = self.index.add_path(rel_path)
+                if entry is not None and not entry.is_file:
+                    self._watch_new_subtree(rel_path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.index.remove_path(rel_path)
+                if mask & IN_ISDIR:
+                    self._forget_subtree(rel_path)
+
+
+_shared_indexes = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_index(root):
+    """Return the process-wide index for root, building it on first use"""
+    root = os.path.abspath(root)
+    with _shared_lock:
+        index = _shared_indexes.get(root)
+        if index is None:
+            index = FileIndex(root)
+            index.build()
+            _shared_indexes[root] = index
+        return index
+
+
+def set_shared_index(index):
+    """Install a prebuilt index as the process-wide index for its root"""
+    with _shared_lock:
+        _shared_indexes[index.root] = index
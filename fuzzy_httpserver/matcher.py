@@ -0,0 +1,272 @@
+from collections import namedtuple
+
+from .admission import admission
+from .cache import ResolutionCache
+from .compress import is_precompressed_sibling
+from .index import get_shared_index
+from .metrics import REGISTRY, Counter, Gauge, count, record_outcome, stage
+from .scoring import calculate_name_score, calculate_path_score, similarity_scorer
+
+# Outcome of resolving a GET path against the served tree.
+#   kind: 'smart' | 'choices' | 'filtered_out' | 'exact_file' | 'exact_dir' | 'fuzzy' | 'not_found'
+#         | 'probe' (a scanner probe answered without matching)
+#   path: URL path to serve ('/rel/path') for the serving kinds
+#   choices: ranked (rel_path, score, file_name) list for 'choices'
+#   listing: (files, dirs) of the served root for 'not_found'
+MatchResult = namedtuple('MatchResult', ['kind', 'filename', 'filter_chain', 'path', 'score', 'is_file', 'choices', 'listing'])
+
+# Process-wide cache of resolved requests (resized from the command line)
+resolution_cache = ResolutionCache(maxsize=1024)
+# Names that matched nothing, keyed on the name alone: when /name has no
+# match, neither has /name/any/filters. Kept apart so that a flood of
+# misses cannot evict the hot entries of resolution_cache.
+miss_cache = ResolutionCache(maxsize=4096)
+
+
+def _cache_metrics():
+    stats = resolution_cache.stats()
+    lookups = Counter("fuzzy_resolution_cache_lookups_total", "Resolution cache lookups", ("result",))
+    lookups.values = {("hit",): stats["hits"], ("miss",): stats["misses"]}
+    invalidations = Counter("fuzzy_resolution_cache_invalidations_total", "Cache drops caused by tree changes")
+    invalidations.values = {(): stats["invalidations"]}
+    size = Gauge("fuzzy_resolution_cache_entries", "Resolved requests currently cached")
+    size.values = {(): stats["size"]}
+    misses = miss_cache.stats()
+    miss_lookups = Counter("fuzzy_miss_cache_lookups_total", "Negative cache lookups for names with no match", ("result",))
+    miss_lookups.values = {("hit",): misses["hits"], ("miss",): misses["misses"]}
+    miss_size = Gauge("fuzzy_miss_cache_entries", "Names with no match currently cached")
+    miss_size.values = {(): misses["size"]}
+    return [lookups, invalidations, size, miss_lookups, miss_size]
+
+
+REGISTRY.add_collector(_cache_metrics)
+
+
+def score_entries(index, entries, query, dir_preference=None):
+    """Path scores for file entries, batched over the index's precomputed features"""
+    features = None
+    if index.features is not None:
+        with index.lock:
+            features = index.features
+            rows = [features.row_of.get(entry.rel_path) for entry in entries]
+        if None in rows:
+            features = None  # changed under us; score this request the slow way
+    if features is None:
+        ratio = similarity_scorer(query.lower())
+        return [calculate_path_score(entry.rel_path, query, dir_preference, ratio) for entry in entries]
+    return features.score(rows, query, dir_preference)
+
+
+def smart_candidates(index, query_lower, filters=()):
+    """Indexed files whose stem relates to the query (and whose path contains
+    every lowercased filter), with whether the stem matches exactly"""
+    exact = []
+    candidates = []
+    with stage('index'):
+        entries = index.candidate_files(query_lower, filters)
+    count('candidates', len(entries))
+    with stage('filter'):
+        for entry in entries:
+            if is_precompressed_sibling(index, entry, query_lower):
+                continue
+
+            # Check if file name (without extension) matches query
+            file_name = entry.stem
+
+            # Check for exact file name match
+            if file_name == query_lower:
+                is_exact = True
+            # Check for partial matches - more flexible matching
+            elif (file_name.startswith(query_lower) or  # file starts with query
+                  query_lower.startswith(file_name) or  # query starts with file
+                  query_lower in file_name or           # query is contained in file
+                  file_name in query_lower):            # file is contained in query
+                is_exact = False
+            else:
+                continue
+
+            # Progressive filtering, before anything is scored
+            if filters:
+                path_lower = entry.rel_path.lower()
+                if not all(token in path_lower for token in filters):
+                    continue
+            exact.append(is_exact)
+            candidates.append(entry)
+    return candidates, exact
+
+
+def smart_file_matcher(query, base_path, dir_preference=None, filters=()):
+    """Smart file matching with path analysis and keyword prioritization.
+
+    With filters, only files whose path contains every filter are scored,
+    each filter adding 1.0 to their score.
+    """
+    query_lower = query.lower()
+    index = get_shared_index(base_path)
+    filters = [token.lower() for token in filters]
+    candidates, exact = smart_candidates(index, query_lower, filters)
+
+    # Score all candidates in one batch
+    matching_files = []
+    count('scored', len(candidates))
+    with stage('score'):
+        scores = score_entries(index, candidates, query, dir_preference)
+    for entry, is_exact, score in zip(candidates, exact, scores):
+        if is_exact or score >= 0.3:  # Lower threshold for partial matches
+            matching_files.append((entry.rel_path, score, entry.name))
+    count('matched', len(matching_files))
+
+    with stage('sort'):
+        # Sort by score (highest first)
+        matching_files.sort(key=lambda x: x[1], reverse=True)
+
+        if filters:
+            # Boost score for filter matches
+            for _ in filters:
+                matching_files = [(rel_path, score + 1.0, file_name) for rel_path, score, file_name in matching_files]
+            matching_files.sort(key=lambda x: x[1], reverse=True)
+
+    return matching_files
+
+
+def has_smart_match(query, base_path, batch_size=64):
+    """Whether smart_file_matcher(query) without filters finds anything,
+    scoring only as many candidates as it takes to find out"""
+    query_lower = query.lower()
+    index = get_shared_index(base_path)
+    candidates, exact = smart_candidates(index, query_lower)
+    if any(exact):
+        return True
+    with stage('score'):
+        for start in range(0, len(candidates), batch_size):
+            if max(score_entries(index, candidates[start:start + batch_size], query)) >= 0.3:
+                return True
+    return False
+
+
+def resolve_request(requested, base_path, client=None):
+    """Resolve an unquoted request path (without the leading '/') to a MatchResult,
+    reusing a cached result while the served tree is unchanged.
+
+    Scanner probes are answered without matching. Anything else that has to
+    be matched goes through admission control, charged to client when given:
+    raises Rejected when it is over its rate or no match slot frees up.
+    """
+    index = get_shared_index(base_path)
+    generation = index.generation
+    path_parts = requested.split("/")
+    if admission.is_probe(requested, index):
+        result = MatchResult('probe', path_parts[0], path_parts[1:], None, None, True, None, None)
+        record_outcome(result)
+        return result
+    # Matching is case-insensitive throughout, so the lowercased path is the key
+    key = (base_path, requested.lower())
+    cached = resolution_cache.lookup(key, generation)
+    if cached is None:
+        cached = miss_cache.lookup((base_path, path_parts[0].lower()), generation)
+    if cached is not None:
+        # Echo the client's own spelling in messages
+        result = cached._replace(filename=path_parts[0], filter_chain=path_parts[1:])
+    else:
+        admission.check_rate(client)
+        slot = admission.acquire()
+        try:
+            result = match_request(requested, base_path)
+        finally:
+            if slot is not None:
+                slot.release()
+        if result.kind == 'not_found':
+            miss_cache.store((base_path, path_parts[0].lower()), generation, result)
+        else:
+            resolution_cache.store(key, generation, result)
+    record_outcome(result)
+    return result
+
+
+def match_request(requested, base_path):
+    """Run the full matching pipeline for an unquoted request path"""
+    path_parts = requested.split("/")
+
+    # Step 1: Parse the URL to extract filename and filter chain
+    filename = None
+    filter_chain = []
+
+    if len(path_parts) == 1:
+        # Single part: /mimi
+        filename = path_parts[0]
+    elif len(path_parts) >= 2:
+        # Multiple parts: /mimi/64/exe
+        filename = path_parts[0]
+        filter_chain = path_parts[1:]  # All parts after filename are filters
+
+    def result(kind, path=None, score=None, is_file=True, choices=None, listing=None):
+        return MatchResult(kind, filename, filter_chain, path, score, is_file, choices, listing)
+
+    # Separate files and directories of the served root (from the index)
+    files = []
+    dirs = []
+    with stage('index'):
+        for entry in get_shared_index(base_path).children():
+            if entry.is_file:
+                files.append(entry.name)
+            else:
+                dirs.append(entry.name)
+
+    # Step 2: Use smart file matcher to find initial files, keeping only
+    # those that pass the whole filter chain
+    matching_files = smart_file_matcher(filename, base_path, filters=filter_chain)
+
+    # If multiple files found, show options
+    if len(matching_files) > 1:
+        return result('choices', choices=matching_files)
+
+    # If exactly one file found, serve it
+    elif len(matching_files) == 1:
+        rel_path, score, file_name = matching_files[0]
+        return result('smart', path=f"/{rel_path}", score=score)
+
+    # If files matched but none passed the filters
+    elif filter_chain and has_smart_match(filename, base_path):
+        return result('filtered_out')
+
+    # Step 3: Fallback to exact file match in current directory
+    file_mapping = {f.lower(): f for f in files}
+    if filename.lower() in file_mapping:
+        return result('exact_file', path="/" + file_mapping[filename.lower()])
+
+    # Step 4: Fallback to exact directory match
+    dir_mapping = {d.lower(): d for d in dirs}
+    if filename.lower() in dir_mapping:
+        return result('exact_dir', path="/" + dir_mapping[filename.lower()], is_file=False)
+
+    # Step 5: Fallback to fuzzy matching
+    best_match = None
+    best_score = 0
+    best_type = None
+
+    with stage('score'):
+        # Every root name: a trigram shortlist could drop the best-scoring one
+        count('fuzzy_scored', len(files) + len(dirs))
+        ratio = similarity_scorer(filename.lower())
+
+        # Check files first (higher priority)
+        for file in files:
+            score = calculate_name_score(filename, file, True, ratio)
+            if score > best_score and score >= 0.5:
+                best_score = score
+                best_match = file
+                best_type = "file"
+
+        # Then check directories (lower priority)
+        for dir_name in dirs:
+            score = calculate_name_score(filename, dir_name, False, ratio)
+            if score > best_score and score >= 0.5:
+                best_score = score
+                best_match = dir_name
+                best_type = "directory"
+
+    if best_match:
+        return result('fuzzy', path="/" + best_match, score=best_score, is_file=best_type == "file")
+
+    # Step 6: No match
+    return result('not_found', listing=(files, dirs))
@@ -0,0 +1,223 @@
+import bisect
+import contextvars
+import threading
+import time
+
+# Minimal Prometheus-style metrics (text exposition format 0.0.4).
+# Updates are a lock plus a dict/list bump, so instrumenting a request
+# costs a few microseconds at most.
+
+# Seconds; stage timings are mostly sub-millisecond, sends can take minutes
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+# Labels put on every sample: with --processes, the worker slot, since each
+# worker counts on its own and has to be scraped (and summed) separately
+CONST_LABELS = {}
+
+
+def format_labels(names, values):
+    if CONST_LABELS:
+        names = tuple(CONST_LABELS) + tuple(names)
+        values = tuple(CONST_LABELS.values()) + tuple(values)
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self.values.items())
+        if not items and not self.labels:
+            items = [((), 0)]
+        for label_values, value in items:
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self.values[label_values] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        names = self.labels + ("le",)
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(names, label_values + (bound,))} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """collector() returns extra metric objects, evaluated at scrape time"""
+        self.collectors.append(collector)
+
+    def render(self, extra=()):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        for metric in extra:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "fuzzy_requests_total", "HTTP requests handled", ("method", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "fuzzy_request_duration_seconds", "Time from request line to last byte sent", ("method",)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "fuzzy_stage_duration_seconds", "Time spent per request stage", ("stage",)))
+MATCH_OUTCOMES = REGISTRY.register(Counter(
+    "fuzzy_match_outcomes_total", "How GET paths were resolved", ("outcome",)))
+BYTES_SENT = REGISTRY.register(Counter(
+    "fuzzy_bytes_sent_total", "Response body bytes sent"))
+BYTES_RECEIVED = REGISTRY.register(Counter(
+    "fuzzy_bytes_received_total", "Request body bytes received (uploads)"))
+ACTIVE_CONNECTIONS = REGISTRY.register(Gauge(
+    "fuzzy_active_connections", "Client connections currently open"))
+
+# MatchResult.kind -> outcome label
+OUTCOMES = {
+    'exact_file': 'exact',
+    'exact_dir': 'exact',
+    'smart': 'smart',
+    'fuzzy': 'fuzzy',
+    'choices': 'multiple_choices',
+    'filtered_out': 'not_found',
+    'not_found': 'not_found',
+    'probe': 'probe',
+}
+
+
+# Trace of the request being handled, when the slow request log is on.
+# A context variable: per thread in threaded mode, per connection task in
+# asyncio mode (executor calls are run in a copy of the task's context).
+_trace = contextvars.ContextVar('fuzzy_trace', default=None)
+
+
+class RequestTrace:
+    """Seconds per stage and candidate counts of one request"""
+    __slots__ = ('stages', 'counts')
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+
+
+def start_trace():
+    """Trace the current request: returns (trace, token for end_trace)"""
+    trace = RequestTrace()
+    return trace, _trace.set(trace)
+
+
+def end_trace(token):
+    _trace.reset(token)
+
+
+def count(name, amount):
+    """Add to a candidate count of the traced request (no-op untraced)"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.counts[name] = trace.counts.get(name, 0) + amount
+
+
+class stage:
+    """Times a block into fuzzy_stage_duration_seconds{stage=...}
+    (and into the request's trace, if it has one)"""
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(elapsed, self.name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.stages[self.name] = trace.stages.get(self.name, 0.0) + elapsed
+        return False
+
+
+def record_outcome(result):
+    MATCH_OUTCOMES.inc(OUTCOMES.get(result.kind, result.kind))
+
+
+def render(extra=()):
+    return REGISTRY.render(extra)
@@ -0,0 +1,108 @@
+"""IPv4 addresses of the local network interfaces, without running ifconfig.
+
+Interface names come from socket.if_nameindex() (or /proc/net/dev) and
+each address from a SIOCGIFADDR ioctl, so a host with hundreds of tun
+devices is answered in milliseconds instead of waiting on a subprocess.
+"""
+import socket
+import struct
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no ioctl interface, nothing is listed
+    fcntl = None
+
+# struct ifreq: 16-byte name, then a sockaddr_in whose address starts at byte 20
+if sys.platform.startswith('linux'):
+    SIOCGIFADDR = 0x8915
+else:
+    SIOCGIFADDR = 0xc0206921  # BSD/macOS _IOWR('i', 33, struct ifreq)
+IFNAMSIZ = 16
+
+
+def interface_names():
+    """Names of the network interfaces, in kernel index order"""
+    try:
+        return [name for _, name in socket.if_nameindex()]
+    except (AttributeError, OSError):
+        pass
+    try:
+        with open('/proc/net/dev') as f:
+            lines = f.readlines()[2:]  # two header lines
+    except OSError:
+        return []
+    return [line.split(':', 1)[0].strip() for line in lines if ':' in line]
+
+
+def interface_address(sock, name):
+    """IPv4 address of an interface, or None when it has none"""
+    request = struct.pack('256s', name.encode()[:IFNAMSIZ - 1])
+    try:
+        reply = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+    except OSError:
+        return None
+    return socket.inet_ntoa(reply[20:24])
+
+
+def get_network_interfaces():
+    """[(interface, IPv4 address)] for every interface that has one"""
+    if fcntl is None:
+        return []
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for name in interface_names():
+            address = interface_address(sock, name)
+            if address is not None:
+                interfaces.append((name, address))
+    return interfaces
+
+
+def format_interfaces(interfaces):
+    lines = ["Network Interfaces and IP Addresses:", "-" * 40]
+    if not interfaces:
+        lines.append("No network interfaces found with IP addresses.")
+    # Only the interfaces worth giving to a target
+    for interface_name, ip_address in interfaces:
+        if 'tun' in interface_name or 'eth' in interface_name:
+            lines.append(f"\033[35m{interface_name}: {ip_address}\033[0m")
+    lines.append("-" * 40)
+    return "\n" + "\n".join(lines) + "\n"
+
+
+def list_all_interfaces():
+    print(format_interfaces(get_network_interfaces()), flush=True)
+
+
+class InterfaceDiscovery:
+    """Looks the interfaces up on a thread started with the server, so
+    startup never waits for it; show() prints them as soon as they are known"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interfaces = None
+        self.wanted = False
+        self.thread = threading.Thread(target=self._run, name="fuzzy-interfaces", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            interfaces = get_network_interfaces()
+        except OSError:
+            interfaces = []
+        with self.lock:
+            self.interfaces = interfaces
+            if self.wanted:
+                print(format_interfaces(interfaces), flush=True)
+
+    def show(self):
+        with self.lock:
+            if self.interfaces is None:
+                self.wanted = True  # printed by the thread when it is done
+            else:
+                print(format_interfaces(self.interfaces), flush=True)
+
+    def join(self):
+        """Wait for the lookup (before fork(), which a running thread would not survive)"""
+        self.thread.join()
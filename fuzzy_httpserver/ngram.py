@@ -0,0 +1,219 @@
+from array import array
+from contextlib import nullcontext
+
+# Inverted trigram index over file stems.
+#
+# Postings are compact array('I') lists of entry ids. Removed entries are
+# tombstoned (their slot in _by_id becomes None) and the postings are
+# rebuilt once tombstones outnumber live entries.
+
+GRAM_SIZE = 3
+
+
+def trigrams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+class NgramIndex:
+    """Trigram postings over file stems, kept in sync by FileIndex"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._postings = {}    # trigram -> array('I') of entry ids
+        self._by_id = []       # entry id -> IndexEntry (None once removed)
+        self._ids = {}         # rel_path -> entry id
+        self._by_stem = {}     # stem -> {rel_path: IndexEntry}
+        self._stem_lengths = {}  # stem length -> number of distinct stems that long
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, entry):
+        if not entry.is_file:
+            return
+        if entry.rel_path in self._ids:
+            self.remove(entry)
+        entry_id = len(self._by_id)
+        self._by_id.append(entry)
+        self._ids[entry.rel_path] = entry_id
+        for gram in trigrams(entry.stem):
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('I')
+            posting.append(entry_id)
+        same_stem = self._by_stem.get(entry.stem)
+        if same_stem is None:
+            same_stem = self._by_stem[entry.stem] = {}
+            length = len(entry.stem)
+            self._stem_lengths[length] = self._stem_lengths.get(length, 0) + 1
+        same_stem[entry.rel_path] = entry
+
+    def remove(self, entry):
+        entry_id = self._ids.pop(entry.rel_path, None)
+        if entry_id is None:
+            return
+        stored = self._by_id[entry_id]
+        self._by_id[entry_id] = None
+        same_stem = self._by_stem.get(stored.stem)
+        if same_stem is not None:
+            same_stem.pop(entry.rel_path, None)
+            if not same_stem:
+                del self._by_stem[stored.stem]
+                length = len(stored.stem)
+                self._stem_lengths[length] -= 1
+                if not self._stem_lengths[length]:
+                    del self._stem_lengths[length]
+        self._dead += 1
+        if self._dead > 1024 and self._dead > len(self._ids):
+            self._compact()
+
+    def _compact(self):
+        live = [entry for entry in self._by_id if entry is not None]
+        self.clear()
+        for entry in live:
+            self.add(entry)
+
+    def substring_candidates(self, query_lower, lock=None):
+        """Entries whose stem contains query_lower or is contained in it.
+
+        Returns None when the query is shorter than a trigram, in which case
+        the caller has to scan everything. lock (the index lock) is only held
+        while the postings are read; the substring lookups, whose number
+        grows with the query length, run without it.
+        """
+        if len(query_lower) < GRAM_SIZE:
+            return None
+        found = {}
+
+        with lock or nullcontext():
+            # Stem contains the query: every query trigram must be in the stem,
+            # so scanning the rarest posting and checking directly is enough
+            postings = []
+            for gram in trigrams(query_lower):
+                posting = self._postings.get(gram)
+                if posting is None:
+                    postings = None
+                    break
+                postings.append(posting)
+            if postings:
+                by_id = self._by_id
+                for entry_id in min(postings, key=len):
+                    entry = by_id[entry_id]
+                    if entry is not None and query_lower in entry.stem:
+                        found[entry.rel_path] = entry
+            by_stem = self._by_stem
+            lengths = [size for size in self._stem_lengths if 0 < size <= len(query_lower)]
+
+        # Stem contained in the query: look up the query's substrings of every
+        # indexed stem length (not all O(L^2) of them). Single dict get/update
+        # calls are atomic, so a concurrent change is at worst missed here.
+        for size in lengths:
+            for start in range(len(query_lower) - size + 1):
+                same_stem = by_stem.get(query_lower[start:start + size])
+                if same_stem:
+                    found.update(same_stem)
+        return list(found.values())
+
+
+# Per-directory subtree summaries: a bloom filter (a Python int) over the
+# bigrams and trigrams of every name below a directory, plus the shortest
+# file stem below it. Used to skip whole subtrees when the tree has to be
+# walked (queries shorter than a trigram, or the prefilter disabled).
+
+SUMMARY_BITS = 2048
+_SUMMARY_MASK = SUMMARY_BITS - 1
+
+
+def gram_bits(gram):
+    """The two bloom bits of a gram"""
+    h = hash(gram)
+    return (1 << (h & _SUMMARY_MASK)) | (1 << ((h >> 11) & _SUMMARY_MASK))
+
+
+class _GramBits(dict):
+    """gram -> gram_bits(gram), computed once per distinct indexed gram"""
+
+    def __missing__(self, gram):
+        bits = self[gram] = gram_bits(gram)
+        return bits
+
+
+class DirSummaries:
+    """Subtree summaries kept in sync by FileIndex.
+
+    Removals are not subtracted (a bloom filter cannot forget); a stale
+    summary only ever lets a subtree through, it never hides a file.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.blooms = {}     # dir rel_path -> bloom of the names below it
+        self.min_stem = {}   # dir rel_path -> length of the shortest file stem below it
+        self._gram_bits = _GramBits()
+        self._name_bits = {}  # directory name -> bloom bits (directory names repeat a lot)
+
+    def __len__(self):
+        return len(self.blooms)
+
+    def name_bits(self, name_lower):
+        memo = self._gram_bits
+        bits = 0
+        for gram in {name_lower[i:i + size] for size in (2, 3) for i in range(len(name_lower) - size + 1)}:
+            bits |= memo[gram]
+        return bits
+
+    def add(self, entry):
+        if not entry.is_file:
+            return
+        bits = self.name_bits(entry.name_lower)
+        stem_len = len(entry.stem)
+        blooms = self.blooms
+        min_stem = self.min_stem
+        dir_rel = entry.parent
+        while True:
+            blooms[dir_rel] = blooms.get(dir_rel, 0) | bits
+            if min_stem.get(dir_rel, stem_len + 1) > stem_len:
+                min_stem[dir_rel] = stem_len
+            if not dir_rel:
+                return
+            dir_rel, _, name = dir_rel.rpartition('/')
+            name_bits = self._name_bits.get(name)
+            if name_bits is None:
+                name_bits = self._name_bits[name] = self.name_bits(name.lower())
+            bits |= name_bits
+
+    def remove(self, entry):
+        pass
+
+    def may_contain(self, dir_rel, token):
+        """False only if no name below dir_rel contains token (lowercased)"""
+        bloom = self.blooms.get(dir_rel, 0)
+        size = min(len(token), GRAM_SIZE)
+        if size < 2:
+            return bloom != 0
+        for i in range(len(token) - size + 1):
+            # Not memoized: query tokens must not grow the table
+            bits = gram_bits(token[i:i + size])
+            if bloom & bits != bits:
+                return False
+        return True
+
+    def may_match(self, dir_rel, query_lower, filters):
+        """False only if no file below dir_rel can pass the smart matcher:
+        a stem related to the query and every filter somewhere in its path"""
+        if dir_rel not in self.blooms:
+            return False  # no files below
+        dir_lower = dir_rel.lower()
+        for token in filters:
+            if token not in dir_lower and not self.may_contain(dir_rel, token):
+                return False
+        # A stem can only be a prefix/part of the query if it is no longer than it;
+        # otherwise it has to contain the query
+        if self.min_stem[dir_rel] > len(query_lower):
+            return self.may_contain(dir_rel, query_lower)
+        return True
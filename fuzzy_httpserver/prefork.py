@@ -0,0 +1,124 @@
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from .accesslog import LOG
+
+# Prefork serving: the parent builds the file index, then forks worker
+# processes that inherit it copy-on-write and accept on a shared listening
+# socket (or on their own SO_REUSEPORT sockets). Matching is pure-Python
+# CPU work, so this is what spreads it over several cores.
+
+
+def listen_socket(port, backlog=128, reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("", port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def shutdown_on_sigterm(httpd):
+    """In a worker: make SIGTERM stop httpd.serve_forever() from outside
+    (shutdown() waits for the serve loop, so it cannot run in the handler's
+    own thread)"""
+    def handler(signum, frame):
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, handler)
+
+
+class Supervisor:
+    """Forks `processes` workers running target(slot) and restarts any that
+    die. SIGTERM/SIGINT stop the workers with SIGTERM, waiting up to
+    `grace` seconds before killing the stragglers."""
+
+    # A worker that dies sooner than this after starting is restarted after a pause
+    min_uptime = 1.0
+    grace = 15.0
+
+    def __init__(self, processes, target):
+        if not hasattr(os, 'fork'):
+            raise OSError("multiple processes need os.fork(), which this platform lacks")
+        self.processes = processes
+        self.target = target
+        self.children = {}  # pid -> (slot, start time)
+        self.stopping = False
+
+    def spawn(self, slot):
+        # Anything still buffered would otherwise be written again by the child
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (slot, time.monotonic())
+            return pid
+        # Worker: Ctrl-C reaches the whole process group, let the parent coordinate
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        code = 0
+        try:
+            self.target(slot)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            LOG.close()
+            os._exit(code)
+
+    def stop(self, signum=None, frame=None):
+        if self.stopping:
+            return
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal.signal(signal.SIGALRM, self.kill)
+        signal.alarm(max(int(self.grace), 1))
+
+    def kill(self, signum=None, frame=None):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """Start the workers and supervise them until stopped"""
+        # Keep the objects built so far (the index) out of the collector, so it
+        # does not touch, and thereby copy, their pages in every worker
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.processes):
+            self.spawn(slot)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            slot, started = self.children.pop(pid, (None, None))
+            if slot is None or self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+            LOG.message(f"[!] Worker {slot} (pid {pid}) exited with status {code}, restarting",
+                        color=91, level='error')
+            if time.monotonic() - started < self.min_uptime:
+                time.sleep(self.min_uptime)  # don't spin on a worker that dies at startup
+            if not self.stopping:
+                self.spawn(slot)
+        signal.alarm(0)
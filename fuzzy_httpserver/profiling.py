@@ -0,0 +1,214 @@
+"""Opt-in profiling of a running server.
+
+A fraction of requests (--profile-sample-rate) runs under cProfile; the
+samples are merged into one pstats aggregate that is written to disk every
+interval and served at GET /__profile. Requests slower than
+--slow-request-ms are logged with their time per stage and candidate counts.
+
+    curl 'http://host:8000/__profile?seconds=30'        # profile every request for 30 s
+    curl 'http://host:8000/__profile?sort=tottime'      # top functions of the aggregate
+    curl -o server.pstats 'http://host:8000/__profile?format=pstats'
+    python -m pstats server.pstats
+"""
+import io
+import marshal
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qs
+
+from .accesslog import LOG
+
+# Seconds between two writes of the aggregate to --profile-file
+WRITE_INTERVAL = 60.0
+# Longest ?seconds= a client can ask for
+MAX_TRIGGER_SECONDS = 300
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls', 'pcalls', 'filename', 'name')
+
+
+class Profiler:
+    """Samples calls under cProfile into one pstats aggregate.
+
+    Only one call is profiled at a time (a profiler sees every thread on
+    Python 3.12+), so concurrent requests are simply not sampled. In
+    asyncio mode only the matching, which runs on the executor, is profiled.
+    """
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.path = None
+        self.interval = WRITE_INTERVAL
+        self.slow_threshold = None  # seconds; None: no request is traced
+        self.forced_until = 0.0
+        self.samples = 0
+        self._stats = None
+        self._epoch = 0  # bumped by reset(): samples started before it are dropped
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self._writer = None
+
+    def configure(self, sample_rate=None, path=None, interval=None, slow_threshold=None):
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if path is not None:
+            self.path = path
+        if interval is not None:
+            self.interval = interval
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold if slow_threshold > 0 else None
+
+    def after_fork(self, worker):
+        """In a prefork worker: write to path.<worker> (the writer thread
+        of the parent did not survive the fork)"""
+        if self.path is not None:
+            self.path = f"{self.path}.{worker}"
+        self._writer = None
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def sampled(self):
+        if self.forced_until:
+            if time.monotonic() < self.forced_until:
+                return True
+            self.forced_until = 0.0
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def call(self, func, *args):
+        """func(*args), run under cProfile when this call is sampled"""
+        if not self.sampled() or not self._active.acquire(blocking=False):
+            return func(*args)
+        try:
+            import cProfile  # with pstats, only imported once something is profiled
+            epoch = self._epoch
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # another profiler is already active (Python 3.12+)
+                return func(*args)
+            try:
+                return func(*args)
+            finally:
+                profile.disable()
+                self._add(profile, epoch)
+        finally:
+            self._active.release()
+
+    def _add(self, profile, epoch):
+        import pstats
+        stats = pstats.Stats(profile)
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            if self._stats is None:
+                self._stats = stats
+            else:
+                self._stats.add(stats)
+            self.samples += 1
+            self._dirty = True
+        if self.path is not None and self._writer is None:
+            self._start_writer()
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="fuzzy-profile-writer", daemon=True)
+                self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def write(self):
+        """Write the aggregate to path if anything was added since the last write"""
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            data = marshal.dumps(self._stats.stats)
+            self._dirty = False
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self._dirty = True  # try again next interval
+            LOG.message(f"[!] Could not write profile '{self.path}': {e}", color=91, level='error')
+
+    def trigger(self, seconds):
+        """Profile every request for the next seconds"""
+        self.forced_until = time.monotonic() + seconds
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self._epoch += 1
+            self.samples = 0
+            self._dirty = False
+
+    def pstats_data(self):
+        """The aggregate in the binary format pstats.Stats() loads, or None"""
+        with self._lock:
+            if self._stats is None:
+                return None
+            return marshal.dumps(self._stats.stats)
+
+    def report(self, sort='cumulative', limit=40):
+        """The aggregate's top functions as text, or None without samples"""
+        import pstats
+        out = io.StringIO()
+        with self._lock:
+            if self._stats is None:
+                return None
+            stats = pstats.Stats(stream=out)
+            stats.add(self._stats)
+            samples = self.samples
+        out.write(f"{samples} sampled requests\n")
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def profile_response(query_string):
+    """Answer to GET /__profile: trigger (?seconds=N), reset (?reset=1) or
+    fetch the aggregate (?format=pstats, or text with ?sort= and ?limit=)"""
+    params = parse_qs(query_string)
+
+    def reply(status, body, ctype="text/plain; charset=utf-8", extra=()):
+        return status, [("Content-type", ctype), *extra, ("Content-Length", str(len(body)))], body
+
+    if 'seconds' in params:
+        try:
+            seconds = float(params['seconds'][-1])
+        except ValueError:
+            seconds = -1
+        if not 0 < seconds <= MAX_TRIGGER_SECONDS:
+            return reply(400, f"[!] seconds must be between 0 and {MAX_TRIGGER_SECONDS}.\n".encode())
+        PROFILER.trigger(seconds)
+        return reply(202, f"[+] Profiling every request for the next {seconds:g} s; GET /__profile afterwards.\n".encode())
+    if params.get('reset', ['0'])[-1] not in ('', '0'):
+        PROFILER.reset()
+        return reply(200, b"[+] Profile reset.\n")
+    if params.get('format', ['text'])[-1] == 'pstats':
+        data = PROFILER.pstats_data()
+        if data is not None:
+            return reply(200, data, "application/octet-stream",
+                         [("Content-Disposition", 'attachment; filename="fuzzy-httpserver.pstats"')])
+    else:
+        sort = params.get('sort', ['cumulative'])[-1]
+        if sort not in SORT_KEYS:
+            return reply(400, f"[!] Unknown sort key '{sort}' (use {', '.join(SORT_KEYS)}).\n".encode())
+        try:
+            limit = max(1, int(params.get('limit', ['40'])[-1]))
+        except ValueError:
+            limit = 40
+        report = PROFILER.report(sort, limit)
+        if report is not None:
+            return reply(200, report.encode())
+    return reply(404, b"[!] No profile samples yet: start the server with --profile-sample-rate "
+                      b"or GET /__profile?seconds=30 first.\n")
+
+
+# Process-wide profiler (configured from the command line)
+PROFILER = Profiler()
@@ -0,0 +1,197 @@
+import json
+import os
+import stat
+from collections import namedtuple
+from urllib.parse import unquote, urlsplit
+
+from .admission import admission
+from .cache import file_cache
+from .compress import compression_cache, has_encoded_variants, select_variant
+from .index import get_shared_index
+from .matcher import miss_cache, resolution_cache
+from .metrics import Counter, Gauge, render
+from .transfer import plan_file_response, plan_stream_response
+
+# Response bodies shared by every serving mode.
+# Each builder returns (status, headers, body) so the threaded handler
+# and the asyncio server send exactly the same thing.
+
+# How to send a file: body is a CachedFile (send slices of its data) or an
+# open file the caller must close; with an encoding, the body parts are
+# compressed while they are sent.
+FileResponse = namedtuple('FileResponse', ['plan', 'body', 'encoding'])
+
+# Reserved paths answered by the server itself instead of the matcher
+STATS_PATH = "/__stats"
+METRICS_PATH = "/__metrics"
+BATCH_PATH = "/__batch"
+PROFILE_PATH = "/__profile"
+
+# Persistent connections: seconds a connection may sit idle between two
+# requests, and requests answered on one connection before it is closed
+KEEPALIVE_TIMEOUT = 5.0
+MAX_KEEPALIVE_REQUESTS = 100
+
+
+def requested_path(target):
+    """What a request target asks the matcher (or upload) for: its path,
+    percent-decoded, without the leading slash and the query string, which
+    no served file name can contain (the stdlib's translate_path drops it too)"""
+    return unquote(urlsplit(target).path.lstrip("/"))
+
+
+def filter_suffix(result):
+    if result.filter_chain:
+        return f" with filters '{'/'.join(result.filter_chain)}'"
+    return ""
+
+
+def connection_header(request_version, keep_alive):
+    """Connection header for a response, or None when the default of the
+    request's HTTP version already says it (HTTP/1.1 keeps connections open)"""
+    if not keep_alive:
+        return "close"
+    if request_version < "HTTP/1.1":
+        return "keep-alive"
+    return None
+
+
+def choices_response(result):
+    """300 Multiple Choices listing the ranked candidates"""
+    headers = [
+        ("Content-type", "text/plain"),
+        ("Server-Reply", f"Multiple files found matching '{result.filename}'{filter_suffix(result)}. Choose one:"),
+    ]
+    lines = []
+    for i, (rel_path, score, file_name) in enumerate(result.choices, 1):
+        lines.append(f"{i}. /{rel_path} (score: {score:.2f})\n")
+    body = "".join(lines).encode()
+    headers.append(("Content-Length", str(len(body))))
+    return 300, headers, body
+
+
+def not_found_response(result):
+    """404 for a filtered-out smart match or for no match at all"""
+    if result.kind == 'filtered_out':
+        reply = f"No files found matching '{result.filename}'{filter_suffix(result)}."
+    else:
+        reply = "No file matched."
+    headers = [
+        ("Content-type", "text/plain"),
+        ("Server-Reply", reply),
+        ("Content-Length", "0"),
+    ]
+    return 404, headers, b""
+
+
+def rejected_response(rejected):
+    """429/503 for a request turned away by admission control"""
+    body = rejected.message.encode()
+    headers = [
+        ("Content-type", "text/plain"),
+        ("Retry-After", str(rejected.retry_after)),
+        ("Content-Length", str(len(body))),
+    ]
+    return rejected.status, headers, body
+
+
+def text_response(status, message):
+    """Plain reply to an upload (or a failed one)"""
+    body = message.encode()
+    return status, [("Content-Length", str(len(body)))], body
+
+
+def file_response(full_path, ctype, request_headers, command='GET', chunked=False):
+    """FileResponse for a regular file, or None when full_path is not one.
+
+    Small hot files come from the in-memory cache, which is only filled by
+    a request that sends the whole file; everything else is sent from a
+    descriptor opened (and fstat()ed) for this request. chunked tells
+    whether the client takes a chunked body (HTTP/1.1) when a file is
+    compressed on the fly; otherwise the connection must be closed after it.
+    """
+    cached = file_cache.get(full_path)
+    f = None
+    if cached is not None:
+        st = cached.st
+    else:
+        try:
+            f = open(full_path, 'rb')
+        except OSError:
+            return None
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            f.close()
+            return None
+    try:
+        variant = select_variant(f, full_path, st, ctype, request_headers, command)
+        if variant is not None and variant.path is not None:
+            try:
+                encoded = open(variant.path, 'rb')
+            except OSError:
+                variant = None  # evicted in the meantime: send the plain file
+            else:
+                if f is not None:
+                    f.close()
+                plan = plan_file_response(os.fstat(encoded.fileno()), request_headers, ctype, command,
+                                          variant.encoding, st)
+                return FileResponse(plan, encoded, None)
+        if variant is not None:
+            if f is None:
+                f = open(full_path, 'rb')
+            plan = plan_stream_response(st, request_headers, ctype, command, variant.encoding, chunked)
+            return FileResponse(plan, f, variant.encoding)
+        plan = plan_file_response(st, request_headers, ctype, command,
+                                  vary=has_encoded_variants(full_path, st, ctype))
+        if cached is not None:
+            return FileResponse(plan, cached, None)
+        if plan.status == 200 and command != 'HEAD':
+            # Not for 304s, ranges or HEAD: only a full body is worth keeping
+            cached = file_cache.fill(full_path, f, st)
+            if cached is not None:
+                f.close()
+                return FileResponse(plan, cached, None)
+        return FileResponse(plan, f, None)
+    except BaseException:
+        if f is not None:
+            f.close()
+        raise
+
+
+def stats_response(base_path):
+    """200 with JSON counters for sizing the caches"""
+    index = get_shared_index(base_path)
+    stats = {
+        "index": {"entries": len(index), "generation": index.generation},
+        "resolution_cache": resolution_cache.stats(),
+        "miss_cache": miss_cache.stats(),
+        "admission": admission.stats(),
+        "compression_cache": compression_cache.stats(),
+        "file_cache": file_cache.stats(),
+    }
+    body = json.dumps(stats, indent=2).encode() + b"\n"
+    headers = [
+        ("Content-type", "application/json"),
+        ("Content-Length", str(len(body))),
+    ]
+    return 200, headers, body
+
+
+def metrics_response(base_path):
+    """200 with all counters in the Prometheus text format"""
+    index = get_shared_index(base_path)
+    entries = Gauge("fuzzy_index_entries", "Files and directories in the index")
+    entries.set(len(index))
+    generation = Counter("fuzzy_index_generation", "Tree changes seen by the index")
+    generation.values = {(): index.generation}
+    files = file_cache.stats()
+    file_lookups = Counter("fuzzy_file_cache_lookups_total", "In-memory file cache lookups", ("result",))
+    file_lookups.values = {("hit",): files["hits"], ("miss",): files["misses"]}
+    file_bytes = Gauge("fuzzy_file_cache_bytes", "Bytes of file contents held in memory")
+    file_bytes.set(files["bytes"])
+    body = render((entries, generation, file_lookups, file_bytes)).encode()
+    headers = [
+        ("Content-type", "text/plain; version=0.0.4; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+    ]
+    return 200, headers, body
@@ -0,0 +1,455 @@
+import os
+from array import array
+
+try:
+    from rapidfuzz.distance import LCSseq
+except ImportError:  # optional: the bit-parallel backend computes the same ratio
+    LCSseq = None
+
+# Ranking contract. Every score is a sum of independent terms: a string
+# similarity in [0, 1] (weighted 0.3 for paths, 1.0 for bare names) plus
+# fixed bonuses and penalties (exact stem, extension, architecture and
+# directory keywords, filters). Candidates are sorted by score, ties keeping
+# index walk order. Similarity backends may differ in the exact ratio, but
+# must serve the same file for every case of the golden corpus
+# (python -m pytest tests).
+
+# Keywords for prioritization (higher index = higher priority)
+PRIORITY_KEYWORDS = ['64', 'x64', 'amd64', '32', 'x86', 'win32', 'win64']
+KEYWORD_SCORES = [(i + 1) / len(PRIORITY_KEYWORDS) * 0.2 for i in range(len(PRIORITY_KEYWORDS))]
+
+# Below this many candidates NumPy's per-call overhead outweighs the batching
+NUMPY_MIN_BATCH = 64
+
+# NumPy is optional and takes longer to import than the rest of the server:
+# it is loaded on the first batch large enough to use it
+_numpy = None  # None: not tried yet, False: not installed
+
+
+def load_numpy():
+    """The numpy module, or None when it is not installed"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:  # optional: the pure-Python batch path gives identical scores
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+FLAG_64 = 1
+FLAG_32 = 2
+
+
+if hasattr(int, 'bit_count'):
+    def popcount(value):
+        return value.bit_count()
+else:
+    def popcount(value):
+        return bin(value).count('1')
+
+
+def difflib_similarity(query_lower):
+    """The original SequenceMatcher ratio: the reference backend"""
+    import difflib  # only when this backend is selected
+
+    def ratio(text):
+        return difflib.SequenceMatcher(None, query_lower, text).ratio()
+    return ratio
+
+
+def bitparallel_similarity(query_lower):
+    """LCS ratio 2 * LCS / (len(query) + len(text)), with the bit-parallel
+    LCS of Allison-Dix/Hyyrö: one bit per query character and a few integer
+    operations per text character, the character masks built once per query"""
+    masks = {}
+    for i, ch in enumerate(query_lower):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    get = masks.get
+    length = len(query_lower)
+    full = (1 << length) - 1
+
+    def ratio(text):
+        total = length + len(text)
+        if not total:
+            return 1.0
+        v = full
+        for ch in text:
+            m = get(ch)
+            if m:
+                u = v & m
+                # Carries only ever move up, past the query bits masked off below
+                v = (v + u) | (v - u)
+        return 2 * (length - popcount(v & full)) / total
+    return ratio
+
+
+def rapidfuzz_similarity(query_lower):
+    """Same ratio as bitparallel_similarity, with the LCS computed by rapidfuzz"""
+    lcs = LCSseq.similarity
+    length = len(query_lower)
+
+    def ratio(text):
+        total = length + len(text)
+        if not total:
+            return 1.0
+        return 2 * lcs(query_lower, text) / total
+    return ratio
+
+
+def available_similarity_backends():
+    """Backend name -> factory of ratio(text) functions for a query, best first"""
+    backends = {}
+    if LCSseq is not None:
+        backends['rapidfuzz'] = rapidfuzz_similarity
+    backends['bitparallel'] = bitparallel_similarity
+    backends['difflib'] = difflib_similarity
+    return backends
+
+
+SIMILARITY_BACKENDS = available_similarity_backends()
+_similarity = [next(iter(SIMILARITY_BACKENDS))]
+
+
+def set_similarity_backend(name):
+    """Select the backend by name ('auto' picks the fastest available)"""
+    if name == 'auto':
+        name = next(iter(SIMILARITY_BACKENDS))
+    if name not in SIMILARITY_BACKENDS:
+        raise ValueError(f"similarity backend {name!r} is not available "
+                         f"(available: {', '.join(SIMILARITY_BACKENDS)})")
+    _similarity[0] = name
+
+
+def similarity_backend():
+    return _similarity[0]
+
+
+def similarity_scorer(query_lower):
+    """ratio(text) function for a lowercased query, from the selected backend"""
+    return SIMILARITY_BACKENDS[_similarity[0]](query_lower)
+
+
+def calculate_name_score(query, candidate, is_file, ratio=None):
+    """Score a bare file or directory name for the fuzzy fallbacks; pass
+    ratio=similarity_scorer(query.lower()) when scoring many names"""
+    query_lower = query.lower()
+    candidate_lower = candidate.lower()
+    if ratio is None:
+        ratio = similarity_scorer(query_lower)
+
+    # Base score from the string similarity
+    base_score = ratio(candidate_lower)
+
+    # Bonus for files
+    file_bonus = 0.3 if is_file else 0
+
+    # Bonus for exact extension match
+    extension_bonus = 0
+    if '.' in query and '.' in candidate:
+        query_ext = query.split('.')[-1].lower()
+        candidate_ext = candidate.split('.')[-1].lower()
+        if query_ext == candidate_ext:
+            extension_bonus = 0.2
+
+    # Bonus for prefix match
+    prefix_bonus = 0
+    if candidate_lower.startswith(query_lower):
+        prefix_bonus = 0.1
+
+    # Bonus for exact name match (case-insensitive)
+    exact_bonus = 0
+    if query_lower == candidate_lower:
+        exact_bonus = 0.5
+
+    return base_score + file_bonus + extension_bonus + prefix_bonus + exact_bonus
+
+
+def calculate_path_score(file_path, query, dir_preference=None, ratio=None):
+    """Calculate score based on path analysis and keywords.
+
+    Reference implementation: PathFeatures.score() must return exactly
+    these values.
+    """
+    score = 0
+    path_lower = file_path.lower()
+    query_lower = query.lower()
+    if ratio is None:
+        ratio = similarity_scorer(query_lower)
+
+    # Base similarity score
+    score += ratio(path_lower) * 0.3
+
+    # File name matching (without extension)
+    file_name = os.path.splitext(os.path.basename(file_path))[0].lower()
+    if file_name == query_lower:
+        score += 1.0  # Exact file name match
+
+    # Extension matching
+    if '.' in query and '.' in file_path:
+        query_ext = query.split('.')[-1].lower()
+        file_ext = file_path.split('.')[-1].lower()
+        if query_ext == file_ext:
+            score += 0.3
+
+    # Directory preference scoring
+    if dir_preference:
+        dir_pref_lower = dir_preference.lower()
+        if dir_pref_lower in path_lower:
+            score += 1.5  # Heavy bonus for directory preference
+        else:
+            score -= 0.5  # Penalty for non-preferred directory
+
+    # Query keyword analysis - this is the most important part
+    query_has_64 = '64' in query_lower
+    query_has_32 = '32' in query_lower
+    path_has_64 = any(kw in path_lower for kw in ['64', 'x64', 'amd64'])
+    path_has_32 = any(kw in path_lower for kw in ['32', 'x86', 'win32'])
+
+    # If query has 64, heavily prioritize 64-bit paths
+    if query_has_64 and path_has_64:
+        score += 2.0
+    elif query_has_64 and path_has_32:
+        score -= 1.0  # Penalize 32-bit when 64 is requested
+
+    # If query has 32, heavily prioritize 32-bit paths
+    if query_has_32 and path_has_32:
+        score += 2.0
+    elif query_has_32 and path_has_64:
+        score -= 1.0  # Penalize 64-bit when 32 is requested
+
+    # Default preference: 64-bit over 32-bit (when no specific preference)
+    if not query_has_64 and not query_has_32:
+        if path_has_64:
+            score += 0.5  # Bonus for 64-bit by default
+        elif path_has_32:
+            score += 0.2  # Lower bonus for 32-bit
+
+    # Path keyword analysis (secondary priority)
+    for i, keyword in enumerate(PRIORITY_KEYWORDS):
+        if keyword in path_lower:
+            # Higher priority for keywords that appear later in the list
+            keyword_score = (i + 1) / len(PRIORITY_KEYWORDS) * 0.2
+            score += keyword_score
+
+    # Query keyword matching in path
+    query_words = query_lower.split()
+    for word in query_words:
+        if word in path_lower:
+            score += 0.1
+
+    # Character-by-character analysis
+    char_matches = 0
+    query_chars = set(query_lower.replace('.', ''))
+    path_chars = set(path_lower.replace('.', '').replace('/', '').replace('\\', ''))
+    if query_chars:
+        char_matches = len(query_chars.intersection(path_chars)) / len(query_chars)
+    score += char_matches * 0.1
+
+    return score
+
+
+def char_masks(chars):
+    """Split a character set into two 64-bit ASCII masks plus the non-ASCII rest"""
+    lo = hi = 0
+    rest = set()
+    for ch in chars:
+        code = ord(ch)
+        if code < 64:
+            lo |= 1 << code
+        elif code < 128:
+            hi |= 1 << (code - 64)
+        else:
+            rest.add(ch)
+    return lo, hi, frozenset(rest)
+
+
+class PathFeatures:
+    """Per-path facts used by the path score, precomputed once per file.
+
+    Kept in sync by FileIndex (add/remove) and stored column-wise in
+    compact arrays; score() then evaluates a whole candidate batch at once,
+    with NumPy when it is importable.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.row_of = {}              # rel_path -> row
+        self.paths = []               # lowercased rel_path
+        self.stems = []               # lowercased basename without extension
+        self.ext_ids = array('i')     # id of the text after the last '.', -1 when there is no '.'
+        self.flags = array('B')       # FLAG_64 / FLAG_32
+        self.keywords = array('B')    # bit i set when PRIORITY_KEYWORDS[i] is in the path
+        self.chars_lo = array('Q')    # path characters (minus . / \) with code < 64
+        self.chars_hi = array('Q')    # ... with 64 <= code < 128
+        self.chars_rest = {}          # row -> frozenset of non-ASCII characters
+        self.ext_table = {}
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def add(self, entry):
+        if not entry.is_file:
+            return
+        path_lower = entry.rel_path.lower()
+        row = len(self.paths)
+        self.row_of[entry.rel_path] = row
+        self.paths.append(path_lower)
+        self.stems.append(entry.stem)
+        if '.' in path_lower:
+            ext = path_lower.split('.')[-1]
+            self.ext_ids.append(self.ext_table.setdefault(ext, len(self.ext_table)))
+        else:
+            self.ext_ids.append(-1)
+        flags = 0
+        if '64' in path_lower:  # covers 'x64' and 'amd64'
+            flags |= FLAG_64
+        if '32' in path_lower or 'x86' in path_lower:  # covers 'win32'
+            flags |= FLAG_32
+        self.flags.append(flags)
+        mask = 0
+        for i, keyword in enumerate(PRIORITY_KEYWORDS):
+            if keyword in path_lower:
+                mask |= 1 << i
+        self.keywords.append(mask)
+        lo, hi, rest = char_masks(set(path_lower.replace('.', '').replace('/', '').replace('\\', '')))
+        self.chars_lo.append(lo)
+        self.chars_hi.append(hi)
+        if rest:
+            self.chars_rest[row] = rest
+
+    def remove(self, entry):
+        # Rows are append-only; a removed path simply stops being a candidate
+        self.row_of.pop(entry.rel_path, None)
+
+    def score(self, rows, query, dir_preference=None):
+        """Scores for the given rows, identical to calculate_path_score"""
+        if not rows:
+            return []
+        query_lower = query.lower()
+        ratio = similarity_scorer(query_lower)
+        paths = self.paths
+        ratios = [ratio(paths[row]) for row in rows]
+        if len(rows) >= NUMPY_MIN_BATCH and load_numpy() is not None:
+            return self._score_numpy(rows, query, query_lower, ratios, dir_preference)
+        return self._score_python(rows, query, query_lower, ratios, dir_preference)
+
+    def _query_terms(self, query, query_lower):
+        query_ext_id = None
+        if '.' in query:
+            query_ext_id = self.ext_table.get(query_lower.split('.')[-1], -2)
+        query_chars = set(query_lower.replace('.', ''))
+        return query_ext_id, query_chars
+
+    def _score_python(self, rows, query, query_lower, ratios, dir_preference):
+        query_ext_id, query_chars = self._query_terms(query, query_lower)
+        query_has_64 = '64' in query_lower
+        query_has_32 = '32' in query_lower
+        query_words = query_lower.split()
+        q_lo, q_hi, q_rest = char_masks(query_chars)
+        dir_pref_lower = dir_preference.lower() if dir_preference else None
+
+        scores = []
+        for row, ratio in zip(rows, ratios):
+            path_lower = self.paths[row]
+            score = 0
+            score += ratio * 0.3
+            if self.stems[row] == query_lower:
+                score += 1.0
+            if query_ext_id is not None and self.ext_ids[row] == query_ext_id:
+                score += 0.3
+            if dir_pref_lower is not None:
+                if dir_pref_lower in path_lower:
+                    score += 1.5
+                else:
+                    score -= 0.5
+            flags = self.flags[row]
+            path_has_64 = flags & FLAG_64
+            path_has_32 = flags & FLAG_32
+            if query_has_64 and path_has_64:
+                score += 2.0
+            elif query_has_64 and path_has_32:
+                score -= 1.0
+            if query_has_32 and path_has_32:
+                score += 2.0
+            elif query_has_32 and path_has_64:
+                score -= 1.0
+            if not query_has_64 and not query_has_32:
+                if path_has_64:
+                    score += 0.5
+                elif path_has_32:
+                    score += 0.2
+            mask = self.keywords[row]
+            if mask:
+                for i, keyword_score in enumerate(KEYWORD_SCORES):
+                    if mask & (1 << i):
+                        score += keyword_score
+            for word in query_words:
+                if word in path_lower:
+                    score += 0.1
+            char_matches = 0
+            if query_chars:
+                common = popcount(self.chars_lo[row] & q_lo) + popcount(self.chars_hi[row] & q_hi)
+                if q_rest:
+                    common += len(q_rest & self.chars_rest.get(row, frozenset()))
+                char_matches = common / len(query_chars)
+            score += char_matches * 0.1
+            scores.append(score)
+        return scores
+
+    def _score_numpy(self, rows, query, query_lower, ratios, dir_preference):
+        np = load_numpy()
+        query_ext_id, query_chars = self._query_terms(query, query_lower)
+        query_has_64 = '64' in query_lower
+        query_has_32 = '32' in query_lower
+        n = len(rows)
+
+        # Gather the candidate rows into small contiguous arrays
+        flags = np.fromiter((self.flags[row] for row in rows), dtype=np.uint8, count=n)
+        path_has_64 = (flags & FLAG_64) != 0
+        path_has_32 = (flags & FLAG_32) != 0
+
+        # Same additions in the same order as the reference, so the floats match exactly
+        score = np.zeros(n)
+        score += np.array(ratios) * 0.3
+        stems = self.stems
+        score += np.where(np.fromiter((stems[row] == query_lower for row in rows), dtype=bool, count=n), 1.0, 0.0)
+        if query_ext_id is not None:
+            ext_ids = np.fromiter((self.ext_ids[row] for row in rows), dtype=np.int64, count=n)
+            score += np.where(ext_ids == query_ext_id, 0.3, 0.0)
+        if dir_preference:
+            dir_pref_lower = dir_preference.lower()
+            in_pref = np.fromiter((dir_pref_lower in self.paths[row] for row in rows), dtype=bool, count=n)
+            score += np.where(in_pref, 1.5, -0.5)
+        if query_has_64:
+            score += np.where(path_has_64, 2.0, np.where(path_has_32, -1.0, 0.0))
+        if query_has_32:
+            score += np.where(path_has_32, 2.0, np.where(path_has_64, -1.0, 0.0))
+        if not query_has_64 and not query_has_32:
+            score += np.where(path_has_64, 0.5, np.where(path_has_32, 0.2, 0.0))
+        keywords = np.fromiter((self.keywords[row] for row in rows), dtype=np.uint8, count=n)
+        for i, keyword_score in enumerate(KEYWORD_SCORES):
+            score += np.where(keywords & (1 << i), keyword_score, 0.0)
+        paths = self.paths
+        for word in query_lower.split():
+            score += np.where(np.fromiter((word in paths[row] for row in rows), dtype=bool, count=n), 0.1, 0.0)
+        if query_chars:
+            q_lo, q_hi, q_rest = char_masks(query_chars)
+            lo = np.fromiter((self.chars_lo[row] for row in rows), dtype=np.uint64, count=n) & np.uint64(q_lo)
+            hi = np.fromiter((self.chars_hi[row] for row in rows), dtype=np.uint64, count=n) & np.uint64(q_hi)
+            common = _np_popcount(lo) + _np_popcount(hi)
+            if q_rest:
+                common += np.fromiter((len(q_rest & self.chars_rest.get(row, frozenset())) for row in rows),
+                                      dtype=np.int64, count=n)
+            score += common / len(query_chars) * 0.1
+        return score.tolist()
+
+
+def _np_popcount(values):
+    np = load_numpy()
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values).astype(np.int64)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+    return table[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
@@ -1,497 +1,643 @@
+import time
+
+IMPORT_STARTED = time.perf_counter()  # for --startup-profile
+
 import http.server
 import socketserver
 import os
 import argparse
-from urllib.parse import unquote
-import difflib
-import hashlib
-import re,subprocess
+import sys
+from urllib.parse import urlsplit
+import queue
+import threading
+
+from .accesslog import LOG, ConsoleFormatter, FileSink, JSONFormatter
+from .admission import MAX_CONCURRENT_MATCHES, RATE_LIMIT, Rejected, admission
+from .index import DEFAULT_EXCLUDES, FileIndex, get_shared_index, set_shared_index
+from .matcher import resolve_request
+from .matcher import miss_cache, resolution_cache
+from .cache import CachedFile, file_cache
+from .compress import compression_cache, iter_compressed
+from .transfer import LAST_CHUNK, chunk, is_chunked, send_file_range
+from .scoring import load_numpy, set_similarity_backend
+from .metrics import (ACTIVE_CONNECTIONS, BYTES_RECEIVED, BYTES_SENT, CONST_LABELS, REQUEST_SECONDS, REQUESTS, end_trace,
+                      stage, start_trace)
+from .profiling import PROFILER, WRITE_INTERVAL, profile_response
+from .responses import (BATCH_PATH, KEEPALIVE_TIMEOUT, MAX_KEEPALIVE_REQUESTS, METRICS_PATH, PROFILE_PATH, STATS_PATH,
+                        choices_response, connection_header, file_response, metrics_response, not_found_response,
+                        rejected_response, requested_path, stats_response, text_response)
+from .upload import (CHUNK_SIZE, UploadSink, UploadTooLarge, UploadWriteError, copy_body, copy_chunked,
+                     parse_size, post_save_path)
 
 class FuzzyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def find_file_recursively(self, base_path, target_filename):
-        """Recursively search for a file in all subdirectories"""
-        target_lower = target_filename.lower()
-        best_match = None
-        best_score = 0
-        best_path = None
-        
-        def calculate_score(query, candidate, is_file):
-            query_lower = query.lower()
-            candidate_lower = candidate.lower()
-            
-            # Base score from difflib
-            base_score = difflib.SequenceMatcher(None, query_lower, candidate_lower).ratio()
-            
-            # Bonus for files
-            file_bonus = 0.3 if is_file else 0
-            
-            # Bonus for exact extension match
-            extension_bonus = 0
-            if '.' in query and '.' in candidate:
-                query_ext = query.split('.')[-1].lower()
-                candidate_ext = candidate.split('.')[-1].lower()
-                if query_ext == candidate_ext:
-                    extension_bonus = 0.2
-            
-            # Bonus for prefix match
-            prefix_bonus = 0
-            if candidate_lower.startswith(query_lower):
-                prefix_bonus = 0.1
-            
-            # Bonus for exact name match (case-insensitive)
-            exact_bonus = 0
-            if query_lower == candidate_lower:
-                exact_bonus = 0.5
-            
-            return base_score + file_bonus + extension_bonus + prefix_bonus + exact_bonus
-        
-        for root, dirs, files in os.walk(base_path):
-            # Check files in current directory
-            for file in files:
-                score = calculate_score(target_filename, file, True)
-                if score > best_score and score >= 0.5:
-                    best_score = score
-                    best_match = file
-                    best_path = root
-        
-        return best_match, best_path, best_score
-
-    def smart_file_matcher(self, query, base_path, dir_preference=None):
-        """Smart file matching with path analysis and keyword prioritization"""
-        query_lower = query.lower()
-        matching_files = []
-        
-        # Keywords for prioritization (higher index = higher priority)
-        priority_keywords = ['64', 'x64', 'amd64', '32', 'x86', 'win32', 'win64']
-        
-        def calculate_path_score(file_path, query):
-            """Calculate score based on path analysis and keywords"""
-            score = 0
-            path_lower = file_path.lower()
-            query_lower = query.lower()
-            
-            # Base similarity score
-            score += difflib.SequenceMatcher(None, query_lower, path_lower).ratio() * 0.3
-            
-            # File name matching (without extension)
-            file_name = os.path.splitext(os.path.basename(file_path))[0].lower()
-            if file_name == query_lower:
-                score += 1.0  # Exact file name match
-            
-            # Extension matching
-            if '.' in query and '.' in file_path:
-                query_ext = query.split('.')[-1].lower()
-                file_ext = file_path.split('.')[-1].lower()
-                if query_ext == file_ext:
-                    score += 0.3
-            
-            # Directory preference scoring
-            if dir_preference:
-                dir_pref_lower = dir_preference.lower()
-                if dir_pref_lower in path_lower:
-                    score += 1.5  # Heavy bonus for directory preference
-                else:
-                    score -= 0.5  # Penalty for non-preferred directory
-            
-            # Query keyword analysis - this is the most important part
-            query_has_64 = '64' in query_lower
-            query_has_32 = '32' in query_lower
-            path_has_64 = any(kw in path_lower for kw in ['64', 'x64', 'amd64'])
-            path_has_32 = any(kw in path_lower for kw in ['32', 'x86', 'win32'])
-            
-            # If query has 64, heavily prioritize 64-bit paths
-            if query_has_64 and path_has_64:
-                score += 2.0
-            elif query_has_64 and path_has_32:
-                score -= 1.0  # Penalize 32-bit when 64 is requested
-            
-            # If query has 32, heavily prioritize 32-bit paths
-            if query_has_32 and path_has_32:
-                score += 2.0
-            elif query_has_32 and path_has_64:
-                score -= 1.0  # Penalize 64-bit when 32 is requested
-            
-            # Default preference: 64-bit over 32-bit (when no specific preference)
-            if not query_has_64 and not query_has_32:
-                if path_has_64:
-                    score += 0.5  # Bonus for 64-bit by default
-                elif path_has_32:
-                    score += 0.2  # Lower bonus for 32-bit
-            
-            # Path keyword analysis (secondary priority)
-            for i, keyword in enumerate(priority_keywords):
-                if keyword in path_lower:
-                    # Higher priority for keywords that appear later in the list
-                    keyword_score = (i + 1) / len(priority_keywords) * 0.2
-                    score += keyword_score
-            
-            # Query keyword matching in path
-            query_words = query_lower.split()
-            for word in query_words:
-                if word in path_lower:
-                    score += 0.1
-            
-            # Character-by-character analysis
-            char_matches = 0
-            query_chars = set(query_lower.replace('.', ''))
-            path_chars = set(path_lower.replace('.', '').replace('/', '').replace('\\', ''))
-            if query_chars:
-                char_matches = len(query_chars.intersection(path_chars)) / len(query_chars)
-            score += char_matches * 0.1
-            
-            return score
-        
-        # Search recursively for files
-        for root, dirs, files in os.walk(base_path):
-            for file in files:
-                # Check if file name (without extension) matches query
-                file_name = os.path.splitext(file)[0].lower()
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, base_path).replace('\\', '/')
-                
-                # Check for exact file name match
-                if file_name == query_lower:
-                    score = calculate_path_score(rel_path, query)
-                    matching_files.append((rel_path, score, file))
-                # Check for partial matches - more flexible matching
-                elif (file_name.startswith(query_lower) or  # file starts with query
-                      query_lower.startswith(file_name) or  # query starts with file
-                      query_lower in file_name or           # query is contained in file
-                      file_name in query_lower):            # file is contained in query
-                    score = calculate_path_score(rel_path, query)
-                    if score >= 0.3:  # Lower threshold for partial matches
-                        matching_files.append((rel_path, score, file))
-        
-        # Sort by score (highest first)
-        matching_files.sort(key=lambda x: x[1], reverse=True)
-        
-        return matching_files
+    # Persistent connections; every response carries a Content-Length or a chunked body
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes: without TCP_NODELAY the body of a
+    # small response waits for the client's delayed ACK on a kept-alive connection
+    disable_nagle_algorithm = True
+    # Per-connection socket timeout (seconds) so slow clients can't hold a worker
+    timeout = None
+    # Idle time allowed between two requests, and requests per connection
+    keepalive_timeout = KEEPALIVE_TIMEOUT
+    max_keepalive_requests = MAX_KEEPALIVE_REQUESTS
+    # Upload limits/options (set from the command line)
+    max_upload_size = None
+    upload_sha256 = False
+
+    def setup(self):
+        super().setup()
+        ACTIVE_CONNECTIONS.inc()
+
+    def finish(self):
+        ACTIVE_CONNECTIONS.dec()
+        super().finish()
+
+    def handle(self):
+        self.close_connection = True
+        self.requests_handled = 0
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def wait_for_request(self):
+        """Wait up to keepalive_timeout for the next request on a kept-alive
+        connection; False when the client closed it or stayed idle"""
+        self.connection.settimeout(self.keepalive_timeout)
+        try:
+            return bool(self.rfile.peek(1))  # pipelined requests are already buffered
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def handle_one_request(self):
+        self.started = time.perf_counter()
+        self.status = None
+        self.requests_handled += 1
+        self.final_response = self.connection_sent = False
+        trace = token = None
+        if PROFILER.slow_threshold is not None:
+            trace, token = start_trace()
+        try:
+            PROFILER.call(super().handle_one_request)
+        finally:
+            if token is not None:
+                end_trace(token)
+        if self.status is not None:
+            method = self.command or '-'
+            elapsed = time.perf_counter() - self.started
+            REQUESTS.inc(method, self.status)
+            REQUEST_SECONDS.observe(elapsed, method)
+            if trace is not None and elapsed >= PROFILER.slow_threshold:
+                LOG.slow(self.requestline, self.status, elapsed, trace)
+
+    def send_response(self, code, message=None):
+        self.final_response = True  # not a 100 Continue
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            self.connection_sent = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if self.final_response and not self.connection_sent:
+            keep_alive = (not self.close_connection and self.server.keep_alive
+                          and self.requests_handled < self.max_keepalive_requests)
+            value = connection_header(self.request_version, keep_alive)
+            if value:
+                self.send_header('Connection', value)  # also sets close_connection
+            self.close_connection = not keep_alive
+        super().end_headers()
+
+    def log_request(self, code='-', size='-'):
+        self.status = int(code)
+        LOG.access(self.address_string(), self.requestline, self.command, self.status, size,
+                   time.perf_counter() - self.started)
+
+    def log_message(self, format, *args):
+        LOG.server(self.address_string(), format % args)
 
     def do_GET(self):
-        requested = unquote(self.path.lstrip("/"))
-        full_base = os.getcwd()
-        path_parts = requested.split("/")
-        base_path = full_base
-        remaining_parts = path_parts.copy()
-
-        # Step 1: Parse the URL to extract filename and filter chain
-        filename = None
-        filter_chain = []
-        
-        if len(path_parts) == 1:
-            # Single part: /mimi
-            filename = path_parts[0]
-        elif len(path_parts) >= 2:
-            # Multiple parts: /mimi/64/exe
-            filename = path_parts[0]
-            filter_chain = path_parts[1:]  # All parts after filename are filters
-
+        if self.path == STATS_PATH:
+            return self.send_prepared(*stats_response(os.getcwd()))
+        if self.path == METRICS_PATH:
+            return self.send_prepared(*metrics_response(os.getcwd()))
+        url = urlsplit(self.path)
+        if url.path == BATCH_PATH:
+            return self.serve_batch(url.query)
+        if url.path == PROFILE_PATH:
+            return self.send_prepared(*profile_response(url.query))
+
+        with stage('parse'):
+            requested = requested_path(self.path)
         try:
-            entries = os.listdir(base_path)
-        except Exception:
-            entries = []
-
-        # Separate files and directories
-        files = []
-        dirs = []
-        for entry in entries:
-            full_path = os.path.join(base_path, entry)
-            if os.path.isfile(full_path):
-                files.append(entry)
-            else:
-                dirs.append(entry)
-
-        # Step 2: Use smart file matcher to find initial files
-        matching_files = self.smart_file_matcher(filename, full_base)
-        
-        if matching_files:
-            # Apply progressive filtering
-            current_results = matching_files
-            
-            for filter_keyword in filter_chain:
-                filtered_results = []
-                filter_lower = filter_keyword.lower()
-                
-                for rel_path, score, file_name in current_results:
-                    if filter_lower in rel_path.lower():
-                        # Boost score for filter match
-                        filtered_score = score + 1.0
-                        filtered_results.append((rel_path, filtered_score, file_name))
-                
-                current_results = filtered_results
-                
-                # If no results after filtering, break
-                if not current_results:
-                    break
-            
-            # Use the final filtered results
-            matching_files = current_results
-            matching_files.sort(key=lambda x: x[1], reverse=True)
-            
-            # If multiple files found, show options
-            if len(matching_files) > 1:
-                self.send_response(300)  # Multiple choices
-                self.send_header("Content-type", "text/plain")
-                
-                if filter_chain:
-                    filter_str = "/".join(filter_chain)
-                    self.send_header("Server-Reply", f"Multiple files found matching '{filename}' with filters '{filter_str}'. Choose one:")
-                else:
-                    self.send_header("Server-Reply", f"Multiple files found matching '{filename}'. Choose one:")
-                self.end_headers()
-                
-                if filter_chain:
-                    filter_str = "/".join(filter_chain)
-                    print(f"\033[93m[?] Multiple files found matching '{filename}' with filters '{filter_str}':\033[0m")
-                else:
-                    print(f"\033[93m[?] Multiple files found matching '{filename}':\033[0m")
-                for i, (rel_path, score, file_name) in enumerate(matching_files, 1):
-                    full_path = f"/{rel_path}"
-                    self.wfile.write(f"{i}. {full_path} (score: {score:.2f})\n".encode())
-                    print(f"\033[94m  {i}. {full_path} (score: {score:.2f})\033[0m")
-                
-                print()  # Empty line for spacing
-                return
-            
-            # If exactly one file found, serve it
-            elif len(matching_files) == 1:
-                rel_path, score, file_name = matching_files[0]
-                self.path = f"/{rel_path}"
-                if filter_chain:
-                    filter_str = "/".join(filter_chain)
-                    print(f"\033[94m[+] Smart matched '{filename}' with filters '{filter_str}' -> '{self.path}' (score: {score:.2f})\033[0m")
-                else:
-                    print(f"\033[94m[+] Smart matched '{filename}' -> '{self.path}' (score: {score:.2f})\033[0m")
+            result = resolve_request(requested, os.getcwd(), self.client_address[0])
+        except Rejected as e:
+            return self.send_prepared(*rejected_response(e))
+
+        if result.kind == 'choices':
+            self.send_prepared(*choices_response(result))
+        elif result.kind in ('filtered_out', 'not_found', 'probe'):
+            self.send_prepared(*not_found_response(result))
+        LOG.match(result)
+
+        if result.path is not None:
+            self.path = result.path
+            full_path = get_shared_index(os.getcwd()).abs_path(result.path.lstrip('/'))
+            with stage('send'):
+                if result.is_file and self.serve_file(full_path):
+                    return
+                # Directories (and anything unusual) go through the stdlib logic
+                if self.command == 'HEAD':
+                    return super().do_HEAD()
                 return super().do_GET()
-            
-            # If no files found after filtering
-            elif len(matching_files) == 0:
-                self.send_response(404)
-                self.send_header("Content-type", "text/plain")
-                if filter_chain:
-                    filter_str = "/".join(filter_chain)
-                    self.send_header("Server-Reply", f"No files found matching '{filename}' with filters '{filter_str}'.")
-                else:
-                    self.send_header("Server-Reply", f"No files found matching '{filename}'.")
-                self.end_headers()
-                if filter_chain:
-                    filter_str = "/".join(filter_chain)
-                    print(f"\033[91m[!] No files found matching '{filename}' with filters '{filter_str}'.\033[0m")
-                else:
-                    print(f"\033[91m[!] No files found matching '{filename}'.\033[0m")
-                return
 
-        # Step 3: Fallback to exact file match in current directory
-        file_mapping = {f.lower(): f for f in files}
-        if filename.lower() in file_mapping:
-            self.path = "/" + file_mapping[filename.lower()]
-            print(f"\033[94m[+] Exactly matched the file '{filename}' -> '{self.path}'\033[0m")
-            return super().do_GET()
-
-        # Step 4: Fallback to exact directory match
-        dir_mapping = {d.lower(): d for d in dirs}
-        if filename.lower() in dir_mapping:
-            self.path = "/" + dir_mapping[filename.lower()]
-            print(f"\033[94m[+] Exactly matched the directory '{filename}' -> '{self.path}'\033[0m")
-            return super().do_GET()
-
-        # Step 5: Fallback to fuzzy matching
-        best_match = None
-        best_score = 0
-        best_type = None
-
-        # Score function that prioritizes files and exact extensions
-        def calculate_score(query, candidate, is_file):
-            query_lower = query.lower()
-            candidate_lower = candidate.lower()
-            
-            # Base score from difflib
-            base_score = difflib.SequenceMatcher(None, query_lower, candidate_lower).ratio()
-            
-            # Bonus for files
-            file_bonus = 0.3 if is_file else 0
-            
-            # Bonus for exact extension match
-            extension_bonus = 0
-            if '.' in query and '.' in candidate:
-                query_ext = query.split('.')[-1].lower()
-                candidate_ext = candidate.split('.')[-1].lower()
-                if query_ext == candidate_ext:
-                    extension_bonus = 0.2
-            
-            # Bonus for prefix match
-            prefix_bonus = 0
-            if candidate_lower.startswith(query_lower):
-                prefix_bonus = 0.1
-            
-            # Bonus for exact name match (case-insensitive)
-            exact_bonus = 0
-            if query_lower == candidate_lower:
-                exact_bonus = 0.5
-            
-            return base_score + file_bonus + extension_bonus + prefix_bonus + exact_bonus
-
-        # Check files first (higher priority)
-        for file in files:
-            score = calculate_score(filename, file, True)
-            if score > best_score and score >= 0.5:
-                best_score = score
-                best_match = file
-                best_type = "file"
-
-        # Then check directories (lower priority)
-        for dir_name in dirs:
-            score = calculate_score(filename, dir_name, False)
-            if score > best_score and score >= 0.5:
-                best_score = score
-                best_match = dir_name
-                best_type = "directory"
-
-        if best_match:
-            self.path = "/" + best_match
-            type_str = "file" if best_type == "file" else "directory"
-            print(f"\033[92m[+] Fuzzy matched '{filename}' -> '{self.path}' ({type_str}, score: {best_score:.2f})\033[0m")
-            return super().do_GET()
-
-        # Step 6: No match — 404 response and list files/dirs on server side
-        self.send_response(404)
-        self.send_header("Content-type", "text/plain")
-        self.send_header("Server-Reply", "No file matched.")
+    # HEAD is resolved exactly like GET (as in asyncio mode); only the body is left out
+    do_HEAD = do_GET
+
+    def serve_file(self, full_path):
+        """Send a regular file with ETag/conditional/Range support and
+        Content-Encoding negotiation, from memory or zero-copy from disk.
+        Returns False (having sent nothing) when full_path is not a regular file."""
+        chunked = self.request_version >= "HTTP/1.1"
+        response = file_response(full_path, self.guess_type(full_path), self.headers, self.command, chunked)
+        if response is None:
+            return False
+        if isinstance(response.body, CachedFile):
+            self.send_plan(response.plan, response.body, response.encoding)
+            return True
+        with response.body:
+            if response.encoding and not chunked and self.command != 'HEAD':
+                self.close_connection = True  # the end of the body is marked by closing
+            self.send_plan(response.plan, response.body, response.encoding)
+        return True
+
+    def send_plan(self, plan, body, encoding=None):
+        """Send a FilePlan from an open file or a CachedFile, compressing the
+        parts on the fly if encoding is given"""
+        self.send_response(plan.status)
+        for key, value in plan.headers:
+            self.send_header(key, value)
         self.end_headers()
-        print(f"\033[91m[!] No exact or fuzzy match for '{filename}'.\033[0m")
-
-        print(f"\033[95m[>] Available entries in /:\033[0m\n")
-
-        # Show files first, then directories
-        for f in sorted(files):
-            print(f"\033[93m/{f} (F)\033[0m")
-        
-        for f in sorted(dirs):
-            print(f"\033[94m/{f} (D)\033[0m")
-
-        print("\n") # for giving some gap in output
+        if self.command == 'HEAD':
+            return  # headers only, same as for a GET (do_HEAD shares do_GET)
+        chunked = is_chunked(plan)
+        sent = 0
+        for preamble, offset, count in plan.parts:
+            if preamble:
+                self.wfile.write(preamble)
+                sent += len(preamble)
+            if encoding:
+                for data in iter_compressed(body, encoding, offset, count):
+                    self.wfile.write(chunk(data) if chunked else data)
+                    sent += len(data)
+            elif isinstance(body, CachedFile):
+                self.wfile.write(body.data[offset:offset + count])
+                sent += count
+            else:
+                done = send_file_range(self.connection, body, offset, count)
+                sent += done
+                if done < count:
+                    self.close_connection = True  # truncated meanwhile: the body is short
+                    break
+        if plan.trailer:
+            self.wfile.write(plan.trailer)
+            sent += len(plan.trailer)
+        if chunked:
+            self.wfile.write(LAST_CHUNK)
+        BYTES_SENT.inc(amount=sent)
+
+    def serve_batch(self, query_string, manifest=None):
+        """Stream the archive of a batch request (GET ?q=... or POSTed manifest)"""
+        from .batch import BatchError, plan_batch  # tarfile/zipfile: only when used
+        try:
+            batch = plan_batch(query_string, os.getcwd(), manifest, self.client_address[0])
+        except BatchError as e:
+            return self.send_prepared(*text_response(e.status, e.message))
+        except Rejected as e:
+            return self.send_prepared(*rejected_response(e))
+        LOG.message(f"[+] Batch: {len(batch.members)} files" +
+                    (f", not found: {', '.join(batch.missing)}" if batch.missing else ""))
+        chunked = self.request_version >= "HTTP/1.1"
+        if not chunked and self.command != 'HEAD':
+            self.close_connection = True  # the end of the archive is marked by closing
+        with stage('send'):
+            self.send_response(200)
+            for key, value in batch.headers:
+                self.send_header(key, value)
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            if self.command == 'HEAD':
+                return  # the archive is never built
+            sent = 0
+            for data in batch.chunks:
+                self.wfile.write(chunk(data) if chunked else data)
+                sent += len(data)
+            if chunked:
+                self.wfile.write(LAST_CHUNK)
+            BYTES_SENT.inc(amount=sent)
+
+    def read_manifest(self):
+        """Body of a POST to the batch endpoint, or None (reply sent) when it
+        cannot be read"""
+        from .batch import MAX_MANIFEST_SIZE, ManifestSink
+        close_connection, self.close_connection = self.close_connection, True  # until the body is read in full
+        sink = ManifestSink()
+        try:
+            buf = bytearray(CHUNK_SIZE)
+            if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+                copy_chunked(self.rfile, sink, buf)
+            else:
+                length = int(self.headers.get('Content-Length', 0))
+                if length > MAX_MANIFEST_SIZE:
+                    raise UploadTooLarge(f"manifest exceeds {MAX_MANIFEST_SIZE} bytes")
+                copy_body(self.rfile, sink, length, buf)
+        except UploadTooLarge:
+            self.send_prepared(*text_response(413, f"[!] Manifest too large (limit: {MAX_MANIFEST_SIZE} bytes).\n"))
+            return None
+        except (OSError, ValueError) as e:
+            self.send_prepared(*text_response(400, "[!] Failed to read the manifest.\n"))
+            LOG.message(f"[!] Error reading batch manifest: {e}", level='error')
+            return None
+        finally:
+            BYTES_RECEIVED.inc(amount=sink.size)
+        self.close_connection = close_connection
+        return sink.data
+
+    def copyfile(self, source, outputfile):
+        # Directory listings and the stdlib fallback path
+        start = source.tell()
+        super().copyfile(source, outputfile)
+        BYTES_SENT.inc(amount=source.tell() - start)
+
+    def send_prepared(self, status, headers, body):
+        with stage('send'):
+            self.send_response(status)
+            for key, value in headers:
+                self.send_header(key, value)
+            self.end_headers()
+            if body and self.command != 'HEAD':
+                self.wfile.write(body)
+                BYTES_SENT.inc(amount=len(body))
 
     def do_POST(self):
-        requested = unquote(self.path.lstrip("/"))
-        path_parts = requested.split("/")
-        filename = path_parts[-1] or "default"
+        url = urlsplit(self.path)
+        if url.path == BATCH_PATH:
+            manifest = self.read_manifest()
+            if manifest is not None:
+                self.serve_batch(url.query, manifest)
+            return
+        requested = requested_path(self.path)
+        chunked = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
 
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-        except Exception as e:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"[!] Failed to read POST data.\n")
-            print(f"[!] Error reading POST data: {e}")
+            content_length = 0 if chunked else int(self.headers.get('Content-Length', 0))
+        except ValueError as e:
+            self.close_connection = True  # the body cannot be delimited
+            self.send_prepared(*text_response(400, "[!] Failed to read POST data.\n"))
+            LOG.message(f"[!] Error reading POST data: {e}", level='error')
+            return
+        if self.max_upload_size is not None and content_length > self.max_upload_size:
+            self.reject_too_large(content_length)
             return
-
-        # Compute MD5
-        md5 = hashlib.md5(post_data).hexdigest()
-        size_bytes = len(post_data)
-        size_kb = size_bytes / 1024
-
-        # Make sure the directory path exists
-        dir_path = os.path.join(os.getcwd(), *path_parts[:-1])
-        os.makedirs(dir_path, exist_ok=True)
-
-        # Create the filename
-        save_path = os.path.join(dir_path, f"fuzzy_post_data_{filename}")
 
         try:
-            with open(save_path, "wb") as f:
-                f.write(post_data)
-        except Exception as e:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"[!] Failed to write POST data to file.\n")
-            print(f"[!] Error writing to file '{save_path}': {e}")
+            save_path = post_save_path(requested, os.getcwd())
+            sink = UploadSink(save_path, self.max_upload_size, self.upload_sha256)
+        except OSError as e:
+            self.close_connection = True  # the body is left unread
+            self.send_prepared(*text_response(500, "[!] Failed to write POST data to file.\n"))
+            LOG.message(f"[!] Error creating upload for '{requested}': {e}", level='error')
             return
 
-        self.send_response(200)
-        self.end_headers()
-        message = (
-            f"\n\n"
-            f"\033[30;107m[+] POST data saved to: {save_path}\033[0m\n"
-            f"\033[30;107m[+] Size: {size_bytes} bytes ({size_kb:.2f} KB)\033[0m\n"
-            f"\033[30;107m[+] MD5: {md5}\033[0m\n"
-            f"\n\n"
-        )
-        self.wfile.write(message.encode())
-        print(message.strip())
-
-# Methods to get all network interfaces and their IPs to keep this module self-contained
-def get_network_interfaces():
-    """Get all network interfaces and their IP addresses using ifconfig"""
-    interfaces = []
-    
+        try:
+            # Stream the body through one reused buffer: memory use does not grow with the upload
+            buf = bytearray(CHUNK_SIZE)
+            if chunked:
+                copy_chunked(self.rfile, sink, buf)
+            else:
+                copy_body(self.rfile, sink, content_length, buf)
+            sink.commit()
+        except UploadTooLarge:
+            sink.abort()
+            self.reject_too_large(sink.size)
+            return
+        except UploadWriteError as e:
+            sink.abort()
+            self.close_connection = True
+            self.send_prepared(*text_response(500, "[!] Failed to write POST data to file.\n"))
+            LOG.message(f"[!] Error writing to file '{save_path}': {e}", level='error')
+            return
+        except (OSError, ValueError) as e:
+            sink.abort()
+            self.close_connection = True
+            self.send_prepared(*text_response(400, "[!] Failed to read POST data.\n"))
+            LOG.message(f"[!] Error reading POST data: {e}", level='error')
+            return
+        finally:
+            BYTES_RECEIVED.inc(amount=sink.size)
+
+        # Let the index know right away instead of waiting for the watcher
+        index = get_shared_index(os.getcwd())
+        index.refresh_path(os.path.relpath(save_path, index.root).replace('\\', '/'))
+
+        message = sink.message()
+        self.send_prepared(*text_response(200, message))
+        LOG.message(message.strip())
+
+    def reject_too_large(self, size):
+        self.close_connection = True  # the rest of the body is left unread
+        self.send_prepared(*text_response(413, f"[!] Upload too large (limit: {self.max_upload_size} bytes).\n"))
+        LOG.message(f"[!] Rejected upload of {size}+ bytes (limit: {self.max_upload_size} bytes)", level='warning')
+
+
+class BoundedThreadingMixIn(socketserver.ThreadingMixIn):
+    """ThreadingMixIn variant that hands connections to a fixed pool of workers
+    instead of starting one thread per connection"""
+    max_workers = 32
+    daemon_threads = True
+
+    def _start_workers(self):
+        self._requests = queue.Queue()
+        self._workers = []
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"fuzzy-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _worker_loop(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            self.process_request_thread(*item)
+
+    def process_request(self, request, client_address):
+        if not hasattr(self, '_requests'):
+            self._start_workers()
+        self._requests.put((request, client_address))
+
+    def server_close(self):
+        super().server_close()
+        for _ in getattr(self, '_workers', ()):
+            self._requests.put(None)
+
+    def drain(self, timeout):
+        """After server_close(), wait up to timeout seconds for the requests
+        already accepted to finish"""
+        deadline = time.monotonic() + timeout
+        for worker in getattr(self, '_workers', ()):
+            worker.join(max(deadline - time.monotonic(), 0))
+
+
+class FuzzyHTTPServer(http.server.HTTPServer):
+    """Single-threaded server: one request at a time"""
+    # An idle kept-alive client would hold up everyone else
+    keep_alive = False
+
+
+class ThreadedFuzzyHTTPServer(BoundedThreadingMixIn, http.server.HTTPServer):
+    """Serves connections concurrently on a bounded pool of worker threads"""
+    keep_alive = True
+
+
+def create_server(mode, port, sock=None, workers=32, backlog=128, timeout=60.0,
+                  max_upload_size=None, upload_sha256=False,
+                  keepalive_timeout=KEEPALIVE_TIMEOUT, max_keepalive_requests=MAX_KEEPALIVE_REQUESTS):
+    """Server for a concurrency mode, bound to port or, in prefork workers,
+    accepting on an already listening socket"""
+    if mode == "asyncio":
+        from .aioserver import AsyncFuzzyServer
+        return AsyncFuzzyServer(("", port), workers=workers, backlog=backlog, timeout=timeout,
+                                max_upload_size=max_upload_size, upload_sha256=upload_sha256, sock=sock,
+                                keepalive_timeout=keepalive_timeout, max_keepalive_requests=max_keepalive_requests)
+    FuzzyHTTPRequestHandler.timeout = timeout
+    FuzzyHTTPRequestHandler.max_upload_size = max_upload_size
+    FuzzyHTTPRequestHandler.upload_sha256 = upload_sha256
+    FuzzyHTTPRequestHandler.keepalive_timeout = keepalive_timeout
+    FuzzyHTTPRequestHandler.max_keepalive_requests = max_keepalive_requests
+    if mode == "threaded":
+        ThreadedFuzzyHTTPServer.max_workers = workers
+        server_class = ThreadedFuzzyHTTPServer
+    else:
+        server_class = FuzzyHTTPServer
+    server_class.request_queue_size = backlog
+    if sock is None:
+        return server_class(("", port), FuzzyHTTPRequestHandler)
+    httpd = server_class(("", port), FuzzyHTTPRequestHandler, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    httpd.server_address = sock.getsockname()
+    httpd.server_name, httpd.server_port = httpd.server_address[:2]
+    return httpd
+
+
+class StartupProfile:
+    """Time spent in each startup phase, printed by --startup-profile once
+    the server is listening"""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.last = IMPORT_STARTED
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        self.mark('listen')
+        lines = [f"[startup] {phase:<10} {seconds * 1000:8.1f} ms" for phase, seconds in self.phases]
+        total = sum(seconds for _, seconds in self.phases)
+        lines.append(f"[startup] {'total':<10} {total * 1000:8.1f} ms (from the first import)")
+        print("\n".join(lines), file=sys.stderr, flush=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Fuzzy HTTP File Server")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Port to serve on (default: 8000)")
+    parser.add_argument("-d", "--directory", type=str, default=os.getcwd(), help="Directory to serve (default: current directory)")
+    parser.add_argument("--watch", choices=["auto", "inotify", "poll", "off"], default="auto", help="How to keep the file index current (default: auto = inotify, polling fallback)")
+    parser.add_argument("--index-file", type=str, default=None, help="Load the file index from this snapshot (revalidated by directory mtimes) and keep it updated; built on first run")
+    parser.add_argument("--max-depth", type=int, default=None, help="Only index this many directory levels for matching (1 = the served directory's own entries; default: unlimited)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB", help=f"Leave matching names or relative paths (e.g. 'uploads', '*.tmp') out of the index, in addition to {', '.join(DEFAULT_EXCLUDES)} (repeatable)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between directory scans in poll mode (default: 2.0)")
+    parser.add_argument("--mode", choices=["single", "threaded", "asyncio"], default="threaded", help="Concurrency mode (default: threaded)")
+    parser.add_argument("--workers", type=int, default=32, help="Worker threads for threaded/asyncio mode (default: 32)")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes serving the port, sharing one copy-on-write index (default: 1)")
+    parser.add_argument("--reuseport", action="store_true", help="With --processes, give each worker its own SO_REUSEPORT socket instead of sharing one")
+    parser.add_argument("--backlog", type=int, default=128, help="Listen backlog (default: 128)")
+    parser.add_argument("--similarity", choices=["auto", "rapidfuzz", "bitparallel", "difflib"], default="auto", help="String similarity used for ranking: auto = rapidfuzz if installed, else bitparallel; difflib is the slow reference (default: auto)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Resolved requests kept in the LRU cache, 0 disables it (default: 1024)")
+    parser.add_argument("--miss-cache-size", type=int, default=4096, help="Names with no match remembered so repeated misses skip matching, 0 disables it (default: 4096)")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT, help=f"Requests per second each client IP may send that need matching (cached answers are free); clients behind one pivot share an IP, so keep it well above their combined use (default: {RATE_LIMIT:g}, off)")
+    parser.add_argument("--rate-burst", type=int, default=None, help="Such requests a client may send in a burst above --rate-limit (default: twice --rate-limit)")
+    parser.add_argument("--max-concurrent-matches", type=int, default=MAX_CONCURRENT_MATCHES, help=f"Requests computing a match at the same time, others wait briefly and then get a 503; 0 disables the cap (default: {MAX_CONCURRENT_MATCHES})")
+    parser.add_argument("--no-probe-filter", action="store_true", help="Match scanner probes (/wp-admin/..., *.php, ...) like any other request instead of answering 404 right away")
+    parser.add_argument("--max-upload", type=parse_size, default=None, help="Largest accepted POST body, e.g. 512M or 4G (default: unlimited)")
+    parser.add_argument("--sha256", action="store_true", help="Also report the SHA-256 of uploads")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-connection socket timeout in seconds (default: 60)")
+    parser.add_argument("--keepalive-timeout", type=float, default=KEEPALIVE_TIMEOUT, help=f"Seconds a persistent connection may stay idle between requests (default: {KEEPALIVE_TIMEOUT:g})")
+    parser.add_argument("--max-keepalive-requests", type=int, default=MAX_KEEPALIVE_REQUESTS, help=f"Requests served on one connection before it is closed, 1 disables keep-alive (default: {MAX_KEEPALIVE_REQUESTS})")
+    parser.add_argument("--file-cache-size", type=parse_size, default=128 * 1024 * 1024, help="Memory budget for hot file contents, 0 disables the cache (default: 128M)")
+    parser.add_argument("--no-compress", action="store_true", help="Never send Content-Encoding (gzip/zstd/br) responses")
+    parser.add_argument("--compress-cache-dir", type=str, default=None, help="Where compressed variants of served files are kept; must be owned by you with mode 0700 (default: $XDG_CACHE_HOME/fuzzy-httpserver/compressed)")
+    parser.add_argument("--compress-cache-size", type=parse_size, default=256 * 1024 * 1024, help="Disk budget for compressed variants, 0 compresses every response on the fly (default: 256M)")
+    parser.add_argument("--log-format", choices=["console", "json"], default="console", help="Request log format: colored console output or JSON lines (default: console)")
+    parser.add_argument("--log-file", type=str, default=None, help="Write the request log to this file instead of the terminal")
+    parser.add_argument("--log-max-bytes", type=parse_size, default=None, help="Rotate the log file past this size, e.g. 10M (default: never)")
+    parser.add_argument("--log-backups", type=int, default=5, help="Rotated log files to keep (default: 5)")
+    parser.add_argument("--listing-interval", type=float, default=5.0, help="Minimum seconds between two root listings logged for unmatched requests, 0 lists every miss (default: 5)")
+    parser.add_argument("--profile-sample-rate", type=float, default=0.0, help="Fraction of requests run under cProfile, aggregated at GET /__profile, e.g. 0.01 (default: 0, off)")
+    parser.add_argument("--profile-file", type=str, default="fuzzy-httpserver.pstats", help="Where the aggregated profile is written (in pstats format; default: fuzzy-httpserver.pstats)")
+    parser.add_argument("--profile-interval", type=float, default=WRITE_INTERVAL, help=f"Seconds between two writes of the profile file (default: {WRITE_INTERVAL:g})")
+    parser.add_argument("--slow-request-ms", type=float, default=0.0, help="Log the time per stage and candidate counts of requests slower than this, 0 disables it (default: 0)")
+    parser.add_argument("--startup-profile", action="store_true", help="Print how long each startup phase took (imports, index, listen) to stderr")
+    return parser
+
+
+def refresh_index_file(index, path, loaded):
+    from .snapshot import refresh_snapshot
     try:
-        result = subprocess.run(['ifconfig'], 
-                              capture_output=True, text=True, check=True)
-        interfaces = parse_ifconfig_output(result.stdout)
-        
-    except subprocess.CalledProcessError:
-        print("Error: ifconfig command failed")
-        return []
-    except FileNotFoundError:
-        print("Error: ifconfig command not found")
-        return []
-    except Exception as e:
-        print(f"Error getting network interfaces: {e}")
-        return []
-    
-    return interfaces
-
-def parse_ifconfig_output(output):
-    """Parse output from ifconfig command"""
-    interfaces = []
-    current_interface = None
-    
-    for line in output.split('\n'):
-        if line and not line.startswith(' ') and not line.startswith('\t'):
-            interface_match = re.match(r'^([^:\s]+)', line)
-            if interface_match:
-                current_interface = interface_match.group(1)
-        
-        elif current_interface and ('inet ' in line or 'inet addr:' in line):
-            
-            ip_match = re.search(r'inet\s+(?:addr:)?([0-9.]+)', line)
-            if ip_match:
-                ip_address = ip_match.group(1)
-                interfaces.append((current_interface, ip_address))
-    
-    return interfaces
-
-def list_all_interfaces():
-    print("Network Interfaces and IP Addresses:")
-    print("-" * 40)
-    
-    interfaces = get_network_interfaces()
-    
-    if not interfaces:
-        print("No network interfaces found with IP addresses.")
+        changed = refresh_snapshot(index, path, loaded)
+    except OSError as e:
+        LOG.message(f"[!] Could not write index file '{path}': {e}", color=91, level='error')
         return
-    
-    # Display results in the requested format
-    for interface_name, ip_address in interfaces:
-        if 'tun' in interface_name or 'eth' in interface_name:
-            print(f"\033[35m{interface_name}: {ip_address}\033[0m")
-
-    print("-" * 40)
-
+    if loaded and changed:
+        LOG.message(f"[+] Index file revalidated: {changed} changed directories rescanned", color=94)
 
-parser = argparse.ArgumentParser(description="Fuzzy HTTP File Server")
-parser.add_argument("-p", "--port", type=int, default=8000, help="Port to serve on (default: 8000)")
-parser.add_argument("-d", "--directory", type=str, default=os.getcwd(), help="Directory to serve (default: current directory)")
-args = parser.parse_args()
-
-os.chdir(args.directory)
-
-
-with socketserver.TCPServer(("", args.port), FuzzyHTTPRequestHandler) as httpd:
-    print(f"[+] Serving '{args.directory}' on port {args.port}")
-    print()
-    list_all_interfaces()
-    print()
-    httpd.serve_forever()
 
+def main(argv=None):
+    profile = StartupProfile(False)
+    profile.mark('imports')
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    profile.enabled = args.startup_profile
+    try:
+        set_similarity_backend(args.similarity)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.max_depth is not None and args.max_depth < 1:
+        parser.error("--max-depth must be at least 1")
+    if args.max_keepalive_requests < 1:
+        parser.error("--max-keepalive-requests must be at least 1")
+    if args.rate_limit < 0 or (args.rate_burst is not None and args.rate_burst < 1) or args.max_concurrent_matches < 0:
+        parser.error("--rate-limit and --max-concurrent-matches must not be negative, --rate-burst at least 1")
+    if not 0 <= args.profile_sample_rate <= 1:
+        parser.error("--profile-sample-rate must be between 0 and 1")
+    if args.profile_interval <= 0:
+        parser.error("--profile-interval must be positive")
+    index_options = dict(max_depth=args.max_depth, exclude=DEFAULT_EXCLUDES + tuple(args.exclude))
+    # Runs while the index is built
+    from .netinfo import InterfaceDiscovery
+    interfaces = InterfaceDiscovery()
+
+    # Relative log and cache paths are taken from where the server was started
+    sink = FileSink(os.path.abspath(args.log_file), args.log_max_bytes, args.log_backups) if args.log_file else None
+    formatter = JSONFormatter() if args.log_format == "json" else ConsoleFormatter(color=sink is None)
+    LOG.configure(formatter, sink, args.listing_interval)
+    compression_cache.enabled = not args.no_compress
+    compression_cache.max_bytes = args.compress_cache_size
+    if compression_cache.enabled and compression_cache.max_bytes:
+        try:
+            compression_cache.setup(os.path.abspath(args.compress_cache_dir) if args.compress_cache_dir else None)
+        except ValueError as e:
+            parser.error(str(e))
+    index_file = os.path.abspath(args.index_file) if args.index_file else None
+    PROFILER.configure(sample_rate=args.profile_sample_rate, path=os.path.abspath(args.profile_file),
+                       interval=args.profile_interval, slow_threshold=args.slow_request_ms / 1000)
+    resolution_cache.maxsize = args.cache_size
+    miss_cache.maxsize = args.miss_cache_size
+    admission.configure(rate=args.rate_limit, burst=args.rate_burst,
+                        max_concurrent=args.max_concurrent_matches, probe_filter=not args.no_probe_filter)
+    file_cache.max_bytes = args.file_cache_size
+
+    os.chdir(args.directory)
+    profile.mark('setup')
+
+    # Build the shared file index once, before accepting requests (and before forking)
+    if index_file:
+        from .snapshot import load_index
+        file_index, loaded = load_index(os.getcwd(), index_file, **index_options)
+        source = f", loaded from '{args.index_file}'" if loaded else ""
+    else:
+        file_index = FileIndex(os.getcwd(), **index_options)
+        file_index.build()
+        source = ""
+    set_shared_index(file_index)
+    profile.mark('index')
+    if args.processes > 1:
+        if index_file:
+            # Before forking, so the workers share the revalidated index
+            refresh_index_file(file_index, index_file, loaded)
+        file_index.build_summaries()
+        load_numpy()  # imported once here rather than in every worker
+        # Watcher threads do not survive fork(): every worker starts its own
+        print(f"[+] Indexed {len(file_index)} entries (watch: {args.watch}, in each worker{source})")
+    else:
+        watch_mode = file_index.start_watching(args.watch, args.poll_interval)
+        file_index.build_summaries(background=True)
+        if index_file:
+            # The watcher is already running, so nothing changed from here on is missed
+            threading.Thread(target=refresh_index_file, args=(file_index, index_file, loaded),
+                             name="fuzzy-index-file", daemon=True).start()
+        print(f"[+] Indexed {len(file_index)} entries (watch: {watch_mode}{source})")
+    profile.mark('watch')
+
+    server_options = dict(workers=args.workers, backlog=args.backlog, timeout=args.timeout,
+                          max_upload_size=args.max_upload, upload_sha256=args.sha256,
+                          keepalive_timeout=args.keepalive_timeout, max_keepalive_requests=args.max_keepalive_requests)
+
+    if args.processes > 1:
+        from .prefork import Supervisor, listen_socket, shutdown_on_sigterm
+        if args.reuseport:
+            listen_socket(args.port, args.backlog, reuse_port=True).close()  # fail now if the port is taken
+            shared_sock = None
+        else:
+            shared_sock = listen_socket(args.port, args.backlog)
+
+        def serve_worker(slot):
+            PROFILER.after_fork(slot)
+            CONST_LABELS['worker'] = str(slot)
+            file_index.start_watching(args.watch, args.poll_interval)
+            sock = shared_sock or listen_socket(args.port, args.backlog, reuse_port=True)
+            httpd = create_server(args.mode, args.port, sock=sock, **server_options)
+            shutdown_on_sigterm(httpd)
+            try:
+                httpd.serve_forever()
+            finally:
+                httpd.server_close()
+                if hasattr(httpd, 'drain'):
+                    httpd.drain(Supervisor.grace - 5)
+                PROFILER.write()
+
+        print(f"[+] Serving '{args.directory}' on port {args.port} ({args.mode} mode, {args.processes} processes)")
+        interfaces.show()
+        interfaces.join()
+        profile.report()
+        Supervisor(args.processes, serve_worker).run()
+        LOG.close()
+        print("\n[+] Shutting down")
+    else:
+        httpd = create_server(args.mode, args.port, **server_options)
+        with httpd:
+            print(f"[+] Serving '{args.directory}' on port {args.port} ({args.mode} mode)")
+            interfaces.show()
+            profile.report()
+            # Off the first large request's path
+            threading.Thread(target=load_numpy, name="fuzzy-numpy", daemon=True).start()
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                PROFILER.write()
+                LOG.close()
+                print("\n[+] Shutting down")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Persistent snapshot of a FileIndex, so huge trees start without a full walk.
+
+    python -m fuzzy_httpserver.snapshot -d /opt/tools --index-file tools.idx
+
+Binary layout (little-endian), read through an mmap:
+
+    header   magic, version, counts, creation time
+    root     UTF-8 path of the indexed root
+    options  JSON of the index's scan options (max depth, excludes)
+    dirs     one (mtime_ns,) per directory: the root first, then every
+             directory in the order its entry appears below
+    entries  one fixed-size record per file/directory: parent directory
+             number, name offset/length in the name blob, stem length in
+             characters (the extension is the rest of the lowercased
+             name), flags
+    names    all names, UTF-8 (surrogateescape)
+
+Entries are stored parent directory by parent directory, each directory's
+children in index order, so loading reproduces the same walk order. The
+directory mtimes are the generation stamps used to revalidate a loaded
+snapshot: only directories whose mtime changed are listed again. Loading
+decodes every record into the entry tables, which matching needs in full;
+the trigram and feature structures are built on first use (or by
+refresh_snapshot in the background).
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from .index import DEFAULT_EXCLUDES, FileIndex, IndexEntry, join_rel
+
+MAGIC = b'FZIX'
+VERSION = 3
+HEADER = struct.Struct('<4sIIIIIQd')  # magic, version, root/options length, dirs, entries, names length, created
+DIR = struct.Struct('<q')             # mtime_ns
+ENTRY = struct.Struct('<IIHHBxxx')    # parent dir, name offset, name length, stem length, flags
+FLAG_DIR = 1
+
+
+def encode_name(name):
+    return name.encode('utf-8', 'surrogateescape')
+
+
+def scan_options_json(index):
+    return json.dumps(index.scan_options(), sort_keys=True).encode('utf-8')
+
+
+def write_snapshot(index, path):
+    """Write index to path atomically; returns the number of entries written"""
+    # Copy the structure under the lock, encode it outside
+    with index.lock:
+        dir_mtimes = dict(index._dir_mtimes)
+        order = ['']
+        records = []  # (parent number, entry)
+        numbers = {'': 0}
+        for dir_rel in order:  # grows while iterating: breadth-first over directories
+            for entry in index._children.get(dir_rel, {}).values():
+                records.append((numbers[dir_rel], entry))
+                if not entry.is_file:
+                    numbers[entry.rel_path] = len(order)
+                    order.append(entry.rel_path)
+
+    names = bytearray()
+    entry_table = bytearray()
+    for parent, entry in records:
+        name = encode_name(entry.name)
+        flags = 0 if entry.is_file else FLAG_DIR
+        entry_table += ENTRY.pack(parent, len(names), len(name), len(entry.stem), flags)
+        names += name
+    dir_table = b''.join(DIR.pack(dir_mtimes.get(dir_rel, 0)) for dir_rel in order)
+    root = encode_name(index.root)
+    options = scan_options_json(index)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.fuzzy-index-', dir=directory)
+    try:
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it 0600
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(root), len(options), len(order), len(records), len(names),
+                                time.time()))
+            f.write(root)
+            f.write(options)
+            f.write(dir_table)
+            f.write(entry_table)
+            f.write(names)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(records)
+
+
+def read_snapshot(path, root, **index_options):
+    """FileIndex for root loaded from a snapshot, or None when the file is
+    missing, unreadable, of another format version, or for another root or
+    other scan options than index_options ask for"""
+    root = os.path.abspath(root)
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    with data:
+        magic, version = struct.unpack_from('<4sI', data, 0)
+        if magic != MAGIC or version != VERSION:
+            return None
+        root_len, options_len, n_dirs, n_entries, names_len, created = HEADER.unpack_from(data, 0)[2:]
+        offset = HEADER.size
+        if data[offset:offset + root_len].decode('utf-8', 'surrogateescape') != root:
+            return None
+        offset += root_len
+        index = FileIndex(root, **index_options)
+        if data[offset:offset + options_len] != scan_options_json(index):
+            return None
+        offset += options_len
+        dir_offset = offset
+        entry_offset = dir_offset + n_dirs * DIR.size
+        names_offset = entry_offset + n_entries * ENTRY.size
+        if names_offset + names_len != len(data):
+            return None  # truncated or corrupt
+        names = data[names_offset:names_offset + names_len]
+
+        # The trigram/feature structures are built on first use instead
+        index.defer_derived()
+        with index.lock:
+            dir_paths = ['']
+            for parent, name_off, name_len, stem_len, flags in ENTRY.iter_unpack(
+                    data[entry_offset:names_offset]):
+                name = names[name_off:name_off + name_len].decode('utf-8', 'surrogateescape')
+                parent_rel = dir_paths[parent]
+                name_lower = name.lower()
+                rel_path = join_rel(parent_rel, name)
+                is_file = not flags & FLAG_DIR
+                index._insert(IndexEntry(rel_path, name, name_lower, name_lower[:stem_len], name_lower[stem_len:],
+                                         is_file, parent_rel))
+                if not is_file:
+                    dir_paths.append(rel_path)
+            for dir_rel, (mtime,) in zip(dir_paths, DIR.iter_unpack(data[dir_offset:entry_offset])):
+                index._dir_mtimes[dir_rel] = mtime
+            index.generation += 1
+    return index
+
+
+def load_index(root, path, **index_options):
+    """Index for root from its snapshot if usable, else by walking the tree.
+    Returns (index, loaded) where loaded tells which of the two happened."""
+    index = read_snapshot(path, root, **index_options)
+    if index is not None:
+        return index, True
+    index = FileIndex(root, **index_options)
+    index.build()
+    return index, False
+
+
+def refresh_snapshot(index, path, loaded):
+    """Bring a loaded index up to date (relisting only directories whose
+    mtime changed) and rewrite the snapshot if anything differed"""
+    generation = index.generation
+    changed = index.revalidate() if loaded else 0
+    # Warm the deferred structures before the (slower) rewrite, ahead of requests
+    index.ensure_derived()
+    if not loaded or changed or index.generation != generation:
+        write_snapshot(index, path)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a fuzzy-httpserver index snapshot offline")
+    parser.add_argument("-d", "--directory", default=os.getcwd(), help="Tree to index (default: current directory)")
+    parser.add_argument("--index-file", required=True, help="Snapshot file to write")
+    parser.add_argument("--max-depth", type=int, default=None, help="Only index this many directory levels (1 = the top directory's own entries)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB", help=f"Leave matching names or relative paths out of the index, in addition to {', '.join(DEFAULT_EXCLUDES)} (repeatable)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = FileIndex(args.directory, max_depth=args.max_depth, exclude=DEFAULT_EXCLUDES + tuple(args.exclude))
+    index.build()
+    walked = time.perf_counter()
+    count = write_snapshot(index, args.index_file)
+    done = time.perf_counter()
+    print(f"[+] Indexed {count} entries in {walked - started:.2f}s, "
+          f"wrote '{args.index_file}' ({os.path.getsize(args.index_file)} bytes) in {done - walked:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
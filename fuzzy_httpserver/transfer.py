@@ -0,0 +1,211 @@
+from collections import namedtuple
+
+# How a file response is put on the wire.
+#   parts: list of (preamble bytes, file offset, byte count); the preamble is
+#   written as-is and the byte range is sent zero-copy from the file.
+#   trailer: bytes written after the last part (multipart closing boundary).
+FilePlan = namedtuple('FilePlan', ['status', 'headers', 'parts', 'trailer'])
+
+# More ranges than this in one request is treated as abuse and answered in full
+MAX_RANGES = 16
+
+
+def make_etag(st, encoding=None):
+    """Strong validator from inode, size and mtime (no hashing of the content),
+    tagged with the Content-Encoding of an encoded representation"""
+    if encoding:
+        return '"%x-%x-%x-%s"' % (st.st_ino, st.st_size, st.st_mtime_ns, encoding)
+    return '"%x-%x-%x"' % (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def parse_http_date(value):
+    import email.utils  # on first use rather than at startup
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+    if parsed is None or parsed.tzinfo is None:
+        return None
+    return parsed.timestamp()
+
+
+def etag_matches(header, etag, weak=True):
+    """Check an If-None-Match / If-Match style list against our ETag"""
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if weak and candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def is_not_modified(request_headers, etag, mtime):
+    """Whether a conditional GET/HEAD is answered 304: If-None-Match wins
+    over If-Modified-Since"""
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    since = parse_http_date(request_headers.get('If-Modified-Since'))
+    return since is not None and int(mtime) <= since
+
+
+def parse_range(header, size):
+    """Parse a Range header into inclusive (start, end) pairs.
+
+    Returns None when the header should be ignored (absent, malformed or
+    not in bytes) and [] when no range is satisfiable.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                if last:
+                    end = int(last)
+                    if end < start:
+                        return None
+                    end = min(end, size - 1)
+                else:
+                    end = size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def plan_file_response(st, request_headers, ctype, command='GET', encoding=None, source_st=None, vary=False):
+    """Work out status, headers and byte ranges for serving a file.
+
+    With an encoding, st describes the compressed variant being sent and
+    source_st the original file, which the validators are derived from.
+    vary marks the plain file of one that has encoded variants.
+    """
+    import email.utils
+    source_st = source_st or st
+    etag = make_etag(source_st, encoding)
+    last_modified = email.utils.formatdate(source_st.st_mtime, usegmt=True)
+    validators = [("ETag", etag), ("Last-Modified", last_modified)]
+    if encoding or vary:
+        # Shared caches must not hand one client's representation to another
+        validators.append(("Vary", "Accept-Encoding"))
+
+    if command in ('GET', 'HEAD') and is_not_modified(request_headers, etag, source_st.st_mtime):
+        return FilePlan(304, validators, [], b'')
+
+    size = st.st_size
+    ranges = parse_range(request_headers.get('Range'), size)
+    if ranges is not None:
+        if_range = request_headers.get('If-Range')
+        if if_range:
+            if if_range.strip().startswith(('"', 'W/')):
+                fresh = etag_matches(if_range, etag, weak=False)
+            else:
+                since = parse_http_date(if_range)
+                fresh = since is not None and int(source_st.st_mtime) <= since
+            if not fresh:
+                ranges = None  # representation changed: send it whole
+
+    if encoding:
+        # Ranges are only honoured on the plain file (the server skips encoding for them)
+        headers = [("Content-type", ctype), ("Content-Encoding", encoding), ("Content-Length", str(size))]
+        return FilePlan(200, headers + validators, [(b'', 0, size)], b'')
+
+    base = [("Accept-Ranges", "bytes")] + validators
+    if ranges is None:
+        headers = [("Content-type", ctype), ("Content-Length", str(size))] + base
+        return FilePlan(200, headers, [(b'', 0, size)], b'')
+
+    if not ranges:
+        headers = [("Content-Range", f"bytes */{size}"), ("Content-Length", "0")] + base
+        return FilePlan(416, headers, [], b'')
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers = [
+            ("Content-type", ctype),
+            ("Content-Range", f"bytes {start}-{end}/{size}"),
+            ("Content-Length", str(end - start + 1)),
+        ] + base
+        return FilePlan(206, headers, [(b'', start, end - start + 1)], b'')
+
+    import uuid  # multipart ranges only
+    boundary = uuid.uuid4().hex
+    parts = []
+    total = 0
+    for start, end in ranges:
+        preamble = (f"\r\n--{boundary}\r\n"
+                    f"Content-Type: {ctype}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('latin-1')
+        parts.append((preamble, start, end - start + 1))
+        total += len(preamble) + end - start + 1
+    trailer = f"\r\n--{boundary}--\r\n".encode('latin-1')
+    total += len(trailer)
+    headers = [
+        ("Content-type", f"multipart/byteranges; boundary={boundary}"),
+        ("Content-Length", str(total)),
+    ] + base
+    return FilePlan(206, headers, parts, trailer)
+
+
+def plan_stream_response(st, request_headers, ctype, command, encoding, chunked=False):
+    """Plan for a file compressed while it is sent: the length is unknown
+    up front, so there is no Content-Length. With chunked the sender frames
+    the body with chunk() and LAST_CHUNK, otherwise it closes the connection
+    after the body."""
+    plan = plan_file_response(st, request_headers, ctype, command, encoding)
+    if plan.status != 200:
+        return plan
+    headers = [(key, value) for key, value in plan.headers if key != "Content-Length"]
+    if chunked:
+        headers.append(("Transfer-Encoding", "chunked"))
+    return plan._replace(headers=headers)
+
+
+def is_chunked(plan):
+    return ("Transfer-Encoding", "chunked") in plan.headers
+
+
+def chunk(data):
+    """data as one chunk of a chunked body (data must not be empty)"""
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+
+# Ends a chunked body (no trailers)
+LAST_CHUNK = b"0\r\n\r\n"
+
+
+def send_file_range(sock, f, offset, count):
+    """Send count bytes of f starting at offset.
+
+    socket.sendfile() uses os.sendfile (zero-copy) on plain sockets and
+    falls back to send() for TLS sockets or platforms without it, while
+    honouring the socket timeout. Returns the bytes sent, fewer than count
+    when the file was truncated meanwhile.
+    """
+    if count <= 0:
+        return 0
+    return sock.sendfile(f, offset, count)
+
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+CHUNK_SIZE = 256 * 1024
+# Longest chunk-size line (hex size + extensions) we accept in a chunked body
+MAX_CHUNK_LINE = 4096
+# int(x, 16) alone would also take "-1", "+a", "0x10" and "1_0"
+CHUNK_SIZE_FIELD = re.compile(rb'[0-9A-Fa-f]+')
+
+
+def current_umask():
+    mask = os.umask(0)  # can only be read by setting it
+    os.umask(mask)
+    return mask
+
+
+# Read once at import, before any server thread could create a file meanwhile
+UMASK = current_umask()
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadWriteError(OSError):
+    """Writing the upload to disk failed (as opposed to reading it from the client)"""
+
+
+def post_save_path(requested, base_path):
+    """Where a POST to the given (unquoted) path is stored; creates parent dirs"""
+    path_parts = requested.split("/")
+    filename = path_parts[-1] or "default"
+
+    # Make sure the directory path exists
+    dir_path = os.path.join(base_path, *path_parts[:-1])
+    os.makedirs(dir_path, exist_ok=True)
+
+    # Create the filename
+    return os.path.join(dir_path, f"fuzzy_post_data_{filename}")
+
+
+class UploadSink:
+    """Streams an upload into a temp file next to its destination, hashing
+    as it goes, and renames it into place on commit()"""
+
+    def __init__(self, save_path, max_size=None, sha256=False):
+        self.save_path = save_path
+        self.max_size = max_size
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256() if sha256 else None
+        self.started = time.perf_counter()
+        self.elapsed = None
+        try:
+            fd, self.temp_path = tempfile.mkstemp(prefix=".fuzzy_upload_", dir=os.path.dirname(save_path))
+        except OSError as e:
+            raise UploadWriteError(e.errno, str(e))
+        self.file = os.fdopen(fd, "wb", buffering=0)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise UploadTooLarge(f"upload exceeds {self.max_size} bytes")
+        self.md5.update(data)
+        if self.sha256 is not None:
+            self.sha256.update(data)
+        try:
+            self.file.write(data)
+        except OSError as e:
+            raise UploadWriteError(e.errno, str(e))
+
+    def commit(self):
+        try:
+            self.file.close()
+            os.chmod(self.temp_path, 0o666 & ~UMASK)  # mkstemp creates it 0600; open() would not
+            os.replace(self.temp_path, self.save_path)
+        except OSError as e:
+            self.abort()
+            raise UploadWriteError(e.errno, str(e))
+        self.elapsed = time.perf_counter() - self.started
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
+
+    def message(self):
+        size_kb = self.size / 1024
+        elapsed = self.elapsed or 0.0
+        rate = self.size / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+        lines = [
+            f"[+] POST data saved to: {self.save_path}",
+            f"[+] Size: {self.size} bytes ({size_kb:.2f} KB)",
+            f"[+] MD5: {self.md5.hexdigest()}",
+        ]
+        if self.sha256 is not None:
+            lines.append(f"[+] SHA-256: {self.sha256.hexdigest()}")
+        lines.append(f"[+] Throughput: {rate:.2f} MB/s ({elapsed:.3f}s)")
+        body = "".join(f"\033[30;107m{line}\033[0m\n" for line in lines)
+        return f"\n\n{body}\n\n"
+
+
+def copy_body(rfile, sink, length, buf):
+    """Copy exactly `length` bytes from rfile into sink through the reused buffer"""
+    view = memoryview(buf)
+    while length > 0:
+        n = rfile.readinto(view[:min(len(buf), length)])
+        if not n:
+            raise ValueError(f"client closed the connection with {length} bytes left")
+        sink.write(view[:n])
+        length -= n
+
+
+def parse_chunk_size(line):
+    """Size from a chunk-size line (extensions ignored), ValueError unless it
+    is plain hex digits"""
+    size_field = line.split(b";", 1)[0].rstrip()  # BWS before ";" and the CRLF
+    if not CHUNK_SIZE_FIELD.fullmatch(size_field):
+        raise ValueError(f"invalid chunk size {size_field!r}")
+    return int(size_field, 16)
+
+
+def copy_chunked(rfile, sink, buf):
+    """Decode a Transfer-Encoding: chunked body from rfile into sink"""
+    while True:
+        line = rfile.readline(MAX_CHUNK_LINE + 1)
+        if not line.endswith(b"\n"):
+            raise ValueError("malformed chunk size line")
+        size = parse_chunk_size(line)
+        if size == 0:
+            break
+        copy_body(rfile, sink, size, buf)
+        if rfile.readline(3) not in (b"\r\n", b"\n"):
+            raise ValueError("missing CRLF after chunk")
+    # Skip trailer headers up to the terminating empty line
+    while True:
+        line = rfile.readline(MAX_CHUNK_LINE + 1)
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+
+def parse_size(text):
+    """Parse a byte size such as 512, 64K, 200M or 2G"""
+    text = text.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
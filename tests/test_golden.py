@@ -0,0 +1,213 @@
+"""Golden rankings: what a request resolves to must not depend on the
+similarity backend, nor differ from what the original server answered.
+
+    python -m pytest tests                              # check every available backend
+    git show 666c436:fuzzy_httpserver/server.py > /tmp/original.py
+    python -m tests.test_golden --update /tmp/original.py   # rewrite the expectations
+
+golden_ranking.json holds a small tool share and, per request, the expected
+outcome: its kind plus the served path, or the choices offered in order.
+The expectations are recorded from the original server (its os.walk and
+listdir seeing the share in corpus order); every backend must reproduce
+all of them.
+"""
+import argparse
+import json
+import os
+
+import pytest
+
+from fuzzy_httpserver.index import FileIndex, set_shared_index
+from fuzzy_httpserver.matcher import match_request
+from fuzzy_httpserver.scoring import SIMILARITY_BACKENDS, set_similarity_backend, similarity_backend
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_ranking.json")
+# Every backend scoring.py knows; those whose module is missing are skipped
+BACKENDS = ('rapidfuzz', 'bitparallel', 'difflib')
+
+
+def load_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def outcome(request, root):
+    result = match_request(request, root)
+    record = {"request": request, "kind": result.kind}
+    if result.path is not None:
+        record["path"] = result.path
+    if result.choices:
+        record["choices"] = [rel_path for rel_path, score, file_name in result.choices]
+    return record
+
+
+def run_backend(name, corpus):
+    root = f"/nonexistent/golden-{name}"
+    set_shared_index(FileIndex.from_paths(root, corpus["paths"]))
+    previous = similarity_backend()
+    set_similarity_backend(name)
+    try:
+        return [outcome(case["request"], root) for case in corpus["cases"]]
+    finally:
+        set_similarity_backend(previous)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backend_matches_golden_rankings(backend):
+    if backend not in SIMILARITY_BACKENDS:
+        pytest.skip(f"{backend} backend not available")
+    corpus = load_corpus()
+    mismatches = [(expected, got) for expected, got in zip(corpus["cases"], run_backend(backend, corpus))
+                  if expected != got]
+    assert not mismatches, (f"{len(corpus['cases']) - len(mismatches)}/{len(corpus['cases'])} cases match:\n" +
+                            "\n".join(f"    /{expected['request']}: expected {expected}, got {got}"
+                                      for expected, got in mismatches))
+
+
+# A root with more names than any trigram shortlist would keep: the fuzzy
+# fallback must still find the best-scoring one (as the original server did)
+LARGE_ROOT = [f"zzmimq{i}.dat" for i in range(300)] + ["m_i_m_i_k_a_t_z"]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("request_path", ["mimikatz", "mimikatz.exe"])
+def test_fuzzy_fallback_scores_every_root_name(backend, request_path):
+    if backend not in SIMILARITY_BACKENDS:
+        pytest.skip(f"{backend} backend not available")
+    corpus = {"paths": LARGE_ROOT, "cases": [{"request": request_path}]}
+    assert run_backend(backend, corpus)[0] == {"request": request_path, "kind": "fuzzy", "path": "/m_i_m_i_k_a_t_z"}
+
+
+class ShareTree:
+    """The corpus paths as a directory tree; walk() and listdir() list entries
+    in corpus order, which is the order FileIndex.from_paths keeps"""
+
+    def __init__(self, top, rel_paths):
+        self.top = top
+        self.children = {"": {}}
+        for rel_path in rel_paths:
+            parts = rel_path.split("/")
+            for i in range(1, len(parts) + 1):
+                parent, rel = "/".join(parts[:i - 1]), "/".join(parts[:i])
+                self.children[parent].setdefault(parts[i - 1], i == len(parts))
+                if i < len(parts):
+                    self.children.setdefault(rel, {})
+        for rel, is_file in self.entries():
+            path = os.path.join(top, rel)
+            if is_file:
+                with open(path, "wb"):
+                    pass
+            else:
+                os.makedirs(path, exist_ok=True)
+
+    def entries(self, dir_rel=""):
+        for name, is_file in self.children[dir_rel].items():
+            rel = f"{dir_rel}/{name}" if dir_rel else name
+            yield rel, is_file
+            if not is_file:
+                yield from self.entries(rel)
+
+    def rel(self, path):
+        rel = os.path.relpath(path, self.top).replace(os.sep, "/")
+        return "" if rel == "." else rel
+
+    def listdir(self, path):
+        return list(self.children[self.rel(path)])
+
+    def walk(self, top):
+        dir_rel = self.rel(top)
+        names = self.children[dir_rel]
+        yield top, [n for n, f in names.items() if not f], [n for n, f in names.items() if f]
+        for name, is_file in names.items():
+            if not is_file:
+                yield from self.walk(os.path.join(top, name))
+
+
+# What the original server printed for each way of answering a GET
+BASELINE_KINDS = (("Smart matched", "smart"), ("Multiple files found", "choices"),
+                  ("No files found matching", "filtered_out"), ("Exactly matched the file", "exact_file"),
+                  ("Exactly matched the directory", "exact_dir"), ("Fuzzy matched", "fuzzy"),
+                  ("No exact or fuzzy match", "not_found"))
+
+
+def record_baseline(server_py, corpus):
+    """Answer every corpus request with the original server's do_GET (a
+    server.py from before the index and the matcher existed)"""
+    import contextlib
+    import http.server
+    import io
+    import re
+    import tempfile
+    import types
+
+    # The original parsed its arguments and served at import time: stop
+    # before that, after the handler class is defined
+    with open(server_py, encoding="utf-8") as f:
+        source = f.read().partition("\nparser = argparse.ArgumentParser(")[0]
+    baseline = types.ModuleType("baseline_server")
+    exec(compile(source, server_py, "exec"), baseline.__dict__)
+
+    class Serve(http.server.SimpleHTTPRequestHandler):
+        # Where the original handed the rewritten path to the stdlib
+        def do_GET(self):
+            self.served = self.path
+
+    class Handler(baseline.FuzzyHTTPRequestHandler, Serve):
+        def __init__(self, path):
+            self.path = path
+            self.served = None
+            self.wfile = io.BytesIO()
+
+        def send_response(self, code, message=None):
+            pass
+
+        def send_header(self, keyword, value):
+            pass
+
+        def end_headers(self):
+            pass
+
+    cases = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="golden-") as top:
+        tree = ShareTree(top, corpus["paths"])
+        baseline.os = types.SimpleNamespace(**{name: getattr(os, name) for name in ("getcwd", "path", "makedirs")},
+                                            walk=tree.walk, listdir=tree.listdir)
+        os.chdir(top)
+        try:
+            for case in corpus["cases"]:
+                request = case["request"]
+                handler = Handler("/" + request)
+                printed = io.StringIO()
+                with contextlib.redirect_stdout(printed):
+                    handler.do_GET()
+                first_line = printed.getvalue().partition("\n")[0]
+                kind = next(kind for marker, kind in BASELINE_KINDS if marker in first_line)
+                record = {"request": request, "kind": kind}
+                if handler.served is not None:
+                    record["path"] = handler.served
+                if kind == "choices":
+                    record["choices"] = re.findall(r"^\d+\. /(.*) \(score: [^)]*\)$",
+                                                   handler.wfile.getvalue().decode(), re.M)
+                cases.append(record)
+        finally:
+            os.chdir(cwd)
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rewrite the golden rankings")
+    parser.add_argument("--update", metavar="SERVER_PY", required=True,
+                        help="server.py of the original server to record the expectations from, "
+                             "e.g. from `git show 666c436:fuzzy_httpserver/server.py`")
+    args = parser.parse_args()
+    corpus = load_corpus()
+    corpus["cases"] = record_baseline(args.update, corpus)
+    with open(CORPUS, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, indent=1)
+        f.write("\n")
+    print(f"[+] Wrote {len(corpus['cases'])} expectations to {CORPUS}")
+
+
+if __name__ == "__main__":
+    main()
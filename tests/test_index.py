@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+from fuzzy_httpserver.index import EVENT_HEADER, IN_Q_OVERFLOW, FileIndex, InotifyWatcher
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    if not sys.platform.startswith('linux'):
+        pytest.skip("inotify is Linux only")
+    (tmp_path / "tools").mkdir()
+    index = FileIndex(str(tmp_path))
+    index.build()
+    try:
+        watcher = InotifyWatcher(index)
+    except OSError as e:
+        pytest.skip(f"inotify unavailable: {e}")
+    yield watcher
+    os.close(watcher.fd)
+
+
+def test_queue_overflow_watches_directories_created_meanwhile(tmp_path, watcher):
+    # Created while the kernel dropped events: the watcher never saw them
+    (tmp_path / "new" / "deep").mkdir(parents=True)
+    (tmp_path / "tools" / "sub").mkdir()
+    (tmp_path / "new" / "deep" / "chisel").write_bytes(b"x")
+
+    watcher._handle_events(EVENT_HEADER.pack(-1, IN_Q_OVERFLOW, 0, 0))
+
+    assert watcher.index.get("new/deep/chisel") is not None
+    for rel in ("", "tools", "tools/sub", "new", "new/deep"):
+        assert rel in watcher.dir_to_wd
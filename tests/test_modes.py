@@ -0,0 +1,82 @@
+"""The threaded and asyncio servers must answer a request the same way."""
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('threaded', 'asyncio')
+TARGETS = [
+    "/linpeas.sh",
+    "/linpeas.sh?x=1",
+    "/linpeas?download=1&v=2",
+    "/tools/chisel%20linux?arch=amd64",
+    "/tools/?sort=name",
+    "/mimikatz.exe?",
+    "/nothing-like-it?linpeas.sh",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(directory, mode):
+    port = free_port()
+    cmd = [sys.executable, "-m", "fuzzy_httpserver.server", "-d", directory, "-p", str(port), "--mode", mode]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def fetch(port, target):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", target, headers={"Accept-Encoding": "identity"})
+        response = conn.getresponse()
+        return response.status, response.getheader("Location"), response.read()
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope="module")
+def answers(tmp_path_factory):
+    tree = tmp_path_factory.mktemp("modes")
+    (tree / "tools").mkdir()
+    (tree / "linpeas.sh").write_bytes(b"#!/bin/sh\necho linpeas\n")
+    (tree / "tools" / "chisel linux").write_bytes(b"chisel")
+    (tree / "mimikatz.exe").write_bytes(b"MZ")
+    results = {}
+    for mode in MODES:
+        proc, port = start_server(str(tree), mode)
+        try:
+            results[mode] = {target: fetch(port, target) for target in TARGETS}
+        finally:
+            proc.kill()
+            proc.wait()
+    return results
+
+
+@pytest.mark.parametrize("target", TARGETS)
+def test_modes_answer_alike(answers, target):
+    assert answers["threaded"][target] == answers["asyncio"][target]
+
+
+def test_query_string_is_not_matched(answers):
+    for mode in MODES:
+        assert answers[mode]["/linpeas.sh?x=1"] == answers[mode]["/linpeas.sh"]
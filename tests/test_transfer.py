@@ -0,0 +1,114 @@
+import email.utils
+import os
+
+import pytest
+
+from fuzzy_httpserver.transfer import MAX_RANGES, make_etag, parse_range, plan_file_response
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("items=0-1", None),
+    ("bytes=", None),
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=0-", [(0, 99)]),
+    ("bytes=10-20, 30-40", [(10, 20), (30, 40)]),
+    ("BYTES = 5-5", [(5, 5)]),
+    ("bytes=90-500", [(90, 99)]),
+    ("bytes=-10", [(90, 99)]),
+    ("bytes=-500", [(0, 99)]),
+    ("bytes=-0", []),
+    ("bytes=100-", []),
+    ("bytes=200-300", []),
+    ("bytes=100-200, 0-0", [(0, 0)]),
+    ("bytes=20-10", None),
+    ("bytes=a-b", None),
+    ("bytes=5", None),
+    ("bytes=0-0," * (MAX_RANGES + 1), None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.fixture
+def st(tmp_path):
+    path = tmp_path / "linpeas.sh"
+    path.write_bytes(bytes(range(100)))
+    return os.stat(path)
+
+
+def header(plan, name):
+    return dict(plan.headers).get(name)
+
+
+def test_plain_get(st):
+    plan = plan_file_response(st, {}, "text/plain")
+    assert plan.status == 200
+    assert plan.parts == [(b'', 0, 100)]
+    assert header(plan, "Content-Length") == "100"
+    assert header(plan, "Vary") is None
+
+
+def test_unsatisfiable_range_is_416(st):
+    plan = plan_file_response(st, {"Range": "bytes=100-"}, "text/plain")
+    assert plan.status == 416
+    assert plan.parts == []
+    assert header(plan, "Content-Range") == "bytes */100"
+    assert header(plan, "Content-Length") == "0"
+
+
+def test_single_range_is_206(st):
+    plan = plan_file_response(st, {"Range": "bytes=-10"}, "text/plain")
+    assert plan.status == 206
+    assert plan.parts == [(b'', 90, 10)]
+    assert header(plan, "Content-Range") == "bytes 90-99/100"
+
+
+def test_multiple_ranges_are_multipart(st):
+    plan = plan_file_response(st, {"Range": "bytes=0-1,10-11"}, "text/plain")
+    assert plan.status == 206
+    assert header(plan, "Content-type").startswith("multipart/byteranges; boundary=")
+    assert [(offset, count) for preamble, offset, count in plan.parts] == [(0, 2), (10, 2)]
+    body_length = sum(len(preamble) + count for preamble, offset, count in plan.parts) + len(plan.trailer)
+    assert header(plan, "Content-Length") == str(body_length)
+
+
+def test_stale_if_range_sends_everything(st):
+    plan = plan_file_response(st, {"Range": "bytes=0-1", "If-Range": '"stale"'}, "text/plain")
+    assert plan.status == 200
+    plan = plan_file_response(st, {"Range": "bytes=0-1", "If-Range": make_etag(st)}, "text/plain")
+    assert plan.status == 206
+
+
+@pytest.mark.parametrize("command", ["GET", "HEAD"])
+def test_matching_etag_is_304(st, command):
+    plan = plan_file_response(st, {"If-None-Match": f'"other", W/{make_etag(st)}'}, "text/plain", command)
+    assert plan.status == 304
+    assert plan.parts == []
+    assert header(plan, "ETag") == make_etag(st)
+
+
+def test_if_modified_since(st):
+    since = email.utils.formatdate(st.st_mtime + 60, usegmt=True)
+    assert plan_file_response(st, {"If-Modified-Since": since}, "text/plain").status == 304
+    before = email.utils.formatdate(st.st_mtime - 60, usegmt=True)
+    assert plan_file_response(st, {"If-Modified-Since": before}, "text/plain").status == 200
+    assert plan_file_response(st, {"If-Modified-Since": "yesterday"}, "text/plain").status == 200
+
+
+def test_if_none_match_wins_over_if_modified_since(st):
+    since = email.utils.formatdate(st.st_mtime + 60, usegmt=True)
+    headers = {"If-None-Match": '"other"', "If-Modified-Since": since}
+    assert plan_file_response(st, headers, "text/plain").status == 200
+
+
+def test_post_is_never_304(st):
+    assert plan_file_response(st, {"If-None-Match": "*"}, "text/plain", "POST").status == 200
+
+
+def test_encoded_variant_keeps_its_own_etag(st):
+    plan = plan_file_response(st, {"If-None-Match": make_etag(st)}, "text/plain", encoding="gzip", source_st=st)
+    assert plan.status == 200
+    assert header(plan, "ETag") == make_etag(st, "gzip")
+    assert header(plan, "Vary") == "Accept-Encoding"
@@ -0,0 +1,86 @@
+import asyncio
+import io
+
+import pytest
+
+from fuzzy_httpserver.aioserver import AsyncFuzzyServer
+from fuzzy_httpserver.upload import copy_chunked, parse_chunk_size
+
+
+class Sink:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+
+@pytest.mark.parametrize("line, expected", [
+    (b"0\r\n", 0),
+    (b"1a\r\n", 26),
+    (b"FF\n", 255),
+    (b"10;name=value\r\n", 16),
+    (b"10 ;name\r\n", 16),
+])
+def test_parse_chunk_size(line, expected):
+    assert parse_chunk_size(line) == expected
+
+
+@pytest.mark.parametrize("line", [b"\r\n", b"-1\r\n", b"0x10\r\n", b"+5\r\n", b"g\r\n", b" 5\r\n"])
+def test_parse_chunk_size_rejects(line):
+    with pytest.raises(ValueError):
+        parse_chunk_size(line)
+
+
+BODIES = [
+    (b"0\r\n\r\n", b""),
+    (b"5\r\nhello\r\n0\r\n\r\n", b"hello"),
+    (b"5\r\nhello\r\n6;ext=1\r\n world\r\n0\r\n\r\n", b"hello world"),
+    (b"3\nabc\n0\n\n", b"abc"),
+    (b"4\r\ndata\r\n0\r\nX-Checksum: 1\r\nX-More: 2\r\n\r\n", b"data"),
+    (b"%x\r\n%s\r\n0\r\n\r\n" % (300000, b"x" * 300000), b"x" * 300000),
+]
+MALFORMED = [
+    b"5\r\nhel",                  # closed inside a chunk
+    b"5\r\nhelloX\r\n0\r\n\r\n",  # no CRLF after the chunk data
+    b"z\r\n",                     # not a size
+]
+
+
+def read_threaded(raw):
+    sink = Sink()
+    copy_chunked(io.BytesIO(raw), sink, bytearray(4096))
+    return bytes(sink.data)
+
+
+def read_asyncio(raw):
+    server = AsyncFuzzyServer(("127.0.0.1", 0), timeout=5)
+
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        sink = Sink()
+        await server.read_chunked(reader, sink)
+        return bytes(sink.data)
+
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize("read", [read_threaded, read_asyncio])
+@pytest.mark.parametrize("raw, expected", BODIES)
+def test_chunked_body_is_decoded(read, raw, expected):
+    assert read(raw) == expected
+
+
+@pytest.mark.parametrize("read", [read_threaded, read_asyncio])
+@pytest.mark.parametrize("raw", MALFORMED)
+def test_malformed_chunked_body_is_rejected(read, raw):
+    with pytest.raises(ValueError):
+        read(raw)
+
+
+def test_remaining_bytes_are_left_unread():
+    rfile = io.BytesIO(b"2\r\nok\r\n0\r\n\r\nGET / HTTP/1.1\r\n")
+    copy_chunked(rfile, Sink(), bytearray(16))
+    assert rfile.read() == b"GET / HTTP/1.1\r\n"